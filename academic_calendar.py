@@ -0,0 +1,24 @@
+from datetime import datetime
+from typing import Optional, Tuple
+
+from config import ACADEMIC_YEAR_START_MONTH
+
+
+def academic_year_of(when: Optional[datetime] = None) -> str:
+    """Academic year label ("2024-2025") that contains the given date"""
+    when = when or datetime.utcnow()
+    start_year = when.year if when.month >= ACADEMIC_YEAR_START_MONTH else when.year - 1
+    return f"{start_year}-{start_year + 1}"
+
+
+def academic_year_bounds(academic_year: str) -> Tuple[datetime, datetime]:
+    """[start, end) datetimes of an academic year label such as "2024-2025" or "2024" """
+    start_year = int(academic_year.split("-")[0])
+    return (
+        datetime(start_year, ACADEMIC_YEAR_START_MONTH, 1),
+        datetime(start_year + 1, ACADEMIC_YEAR_START_MONTH, 1),
+    )
+
+
+def current_academic_year_bounds() -> Tuple[datetime, datetime]:
+    return academic_year_bounds(academic_year_of())
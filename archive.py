@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+"""
+Academic-year archival.
+
+Moves a closed academic year's marks, attendance, assignments and expired
+notices out of the live databases into compressed columnar files under
+ARCHIVE_DIR/<year>/, then deletes them from the live tables.
+
+Each table becomes one file of row groups (ROW_GROUP_SIZE rows sorted by
+student). Inside a row group every column is stored as its own
+zlib-compressed chunk; manifest.json records the byte range of each chunk
+and the student id range of each group. ArchiveReader memory-maps the files
+and only decompresses the chunks a query needs, so showing one student's
+archived history touches a few kilobytes of a file that may be gigabytes.
+
+    python archive.py export 2023-2024
+    python archive.py list
+    python archive.py show 2023-2024 --student 42
+"""
+
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import threading
+import zlib
+from collections import OrderedDict
+from datetime import date, datetime
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+from sqlalchemy import Date, DateTime, select, delete
+
+from academic_calendar import academic_year_bounds
+from config import ARCHIVE_DIR, PARTITIONED_TABLES
+from database import current_databases
+from models import (
+    StudentMarks, StudentAttendance, StudentAssignments, AttendanceMonth, AttendanceException, SchoolNotices,
+)
+from repositories.notice_repository import NoticeRepository
+
+ROW_GROUP_SIZE = 10000
+FORMAT_VERSION = 1
+
+# (database, model, column that places a row in an academic year, column the
+# rows are sorted and grouped by)
+ARCHIVE_TABLES = [
+    ("student", StudentMarks, "exam_date", "student_id"),
+    ("student", StudentAttendance, "date", "student_id"),
+    ("student", AttendanceMonth, "month", "student_id"),
+    ("student", StudentAssignments, "due_date", "student_id"),
+    ("authority", SchoolNotices, "expires_at", "id"),
+]
+
+
+def _column_kind(column) -> str:
+    if isinstance(column.type, DateTime):
+        return "datetime"
+    if isinstance(column.type, Date):
+        return "date"
+    return "value"
+
+
+def _encode(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def _decode(kind: str, value):
+    if value is None or kind == "value":
+        return value
+    if kind == "datetime":
+        return datetime.fromisoformat(value)
+    return date.fromisoformat(value)
+
+
+def archive_root() -> str:
+    """ARCHIVE_DIR for the deployment's own databases, a subdirectory per hosted school"""
+    name = current_databases().name
+    return ARCHIVE_DIR if name == "default" else os.path.join(ARCHIVE_DIR, "tenants", name)
+
+
+def year_dir(academic_year: str) -> str:
+    return os.path.join(archive_root(), academic_year)
+
+
+class _TableWriter:
+    """Writes row groups of one table and collects their manifest entries"""
+
+    def __init__(self, path: str, columns: List, sort_key: str):
+        self.path = path
+        self.columns = columns
+        self.sort_key = sort_key
+        self.file = open(path, "wb")
+        self.digest = hashlib.sha256()
+        self.offset = 0
+        self.rows = 0
+        self.groups = []
+        self.pending: List[tuple] = []
+
+    def add(self, row):
+        self.pending.append(row)
+        if len(self.pending) >= ROW_GROUP_SIZE:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        key_index = [column.name for column in self.columns].index(self.sort_key)
+        group = {
+            "rows": len(self.pending),
+            "min_key": self.pending[0][key_index],
+            "max_key": self.pending[-1][key_index],
+            "chunks": {},
+        }
+        for index, column in enumerate(self.columns):
+            payload = json.dumps([_encode(row[index]) for row in self.pending], separators=(",", ":"))
+            chunk = zlib.compress(payload.encode("utf-8"), 6)
+            self.file.write(chunk)
+            self.digest.update(chunk)
+            group["chunks"][column.name] = [self.offset, len(chunk)]
+            self.offset += len(chunk)
+        self.rows += len(self.pending)
+        self.groups.append(group)
+        self.pending = []
+
+    def close(self) -> dict:
+        self.flush()
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        return {
+            "file": os.path.basename(self.path),
+            "rows": self.rows,
+            "bytes": self.offset,
+            "sha256": self.digest.hexdigest(),
+            "sort_key": self.sort_key,
+            "columns": {column.name: _column_kind(column) for column in self.columns},
+            "row_groups": self.groups,
+        }
+
+
+def _year_filter(model, column_name: str, start: datetime, end: datetime):
+    column = getattr(model, column_name)
+    if _column_kind(column) == "date":
+        return (column >= start.date()) & (column < end.date())
+    return (column >= start) & (column < end)
+
+
+def _export_table(session, model, where, sort_key: str, target: str) -> dict:
+    table = model.__table__
+    # Generated columns (the notice search vector) are left out
+    columns = [column for column in table.columns if column.computed is None]
+    writer = _TableWriter(os.path.join(target, f"{table.name}.col"), columns, sort_key)
+    query = select(*columns).where(where).order_by(table.c[sort_key], table.c.id)
+    for row in session.execute(query, execution_options={"yield_per": ROW_GROUP_SIZE}):
+        writer.add(tuple(row))
+    return writer.close()
+
+
+def export_year(academic_year: str, sessions: Dict[str, object], keep_live: bool = False) -> dict:
+    """
+    Archive one academic year. The manifest is written only after every file
+    is complete, and live rows are deleted only after that, so an interrupted
+    run never loses data. Re-running resumes the deletion step.
+    """
+    start, end = academic_year_bounds(academic_year)
+    if end > datetime.utcnow():
+        raise ValueError(f"Academic year {academic_year} is not closed yet")
+
+    target = year_dir(academic_year)
+    manifest_path = os.path.join(target, "manifest.json")
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    else:
+        staging = target + ".partial"
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+        manifest = {
+            "format": FORMAT_VERSION,
+            "academic_year": academic_year,
+            "start": start.isoformat(),
+            "end": end.isoformat(),
+            "created_at": datetime.utcnow().isoformat(timespec="seconds"),
+            "live_rows_deleted": False,
+            "tables": {},
+        }
+        for db_name, model, column, sort_key in ARCHIVE_TABLES:
+            where = _year_filter(model, column, start, end)
+            manifest["tables"][model.__tablename__] = _export_table(
+                sessions[db_name], model, where, sort_key, staging)
+        # Exceptions belong to archived attendance months
+        months = select(AttendanceMonth.id).where(_year_filter(AttendanceMonth, "month", start, end))
+        manifest["tables"][AttendanceException.__tablename__] = _export_table(
+            sessions["student"], AttendanceException, AttendanceException.month_id.in_(months), "month_id", staging)
+        with open(os.path.join(staging, "manifest.json"), "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.makedirs(archive_root(), exist_ok=True)
+        os.replace(staging, target)
+
+    if not keep_live and not manifest["live_rows_deleted"]:
+        _delete_live_rows(manifest, sessions, start, end)
+        manifest["live_rows_deleted"] = True
+        with open(manifest_path + ".tmp", "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(manifest_path + ".tmp", manifest_path)
+    _readers.pop(target, None)
+    return manifest
+
+
+def _delete_live_rows(manifest: dict, sessions: Dict[str, object], start: datetime, end: datetime):
+    # End the export transactions so detaching partitions does not wait on them
+    for session in sessions.values():
+        session.commit()
+    months = select(AttendanceMonth.id).where(_year_filter(AttendanceMonth, "month", start, end))
+    deletions = [("student", AttendanceException, AttendanceException.month_id.in_(months))]
+    deletions += [(db_name, model, _year_filter(model, column, start, end))
+                  for db_name, model, column, _ in ARCHIVE_TABLES]
+
+    for db_name, model, where in deletions:
+        session = sessions[db_name]
+        archived = manifest["tables"][model.__tablename__]["rows"]
+        if model.__tablename__ in PARTITIONED_TABLES:
+            _drop_covered_partitions(session, model.__tablename__, start, end)
+        deleted = session.execute(delete(model).where(where)).rowcount
+        remaining = session.execute(select(model.id).where(where).limit(1)).first()
+        if remaining is not None:
+            session.rollback()
+            raise RuntimeError(f"{model.__tablename__} still has rows for the archived year")
+        session.commit()
+        print(f"  {model.__tablename__}: {archived} archived, {deleted} deleted row by row")
+    # Archived notices leave the unread counters
+    NoticeRepository(sessions["authority"]).rebuild()
+
+
+def _drop_covered_partitions(session, table: str, start: datetime, end: datetime):
+    """Whole partitions inside the year are detached and dropped instead of deleted row by row"""
+    from partitions import partition_for, list_partitions, detach_partition, _add_months
+
+    engine = session.get_bind()
+    with engine.connect() as conn:
+        existing = {name for name, _ in list_partitions(conn, table)}
+    when = start
+    while when < end:
+        name, part_start, part_end = partition_for(table, when)
+        if name in existing and part_start >= start and part_end <= end:
+            detach_partition(engine, table, name)
+            with engine.begin() as conn:
+                conn.exec_driver_sql(f"DROP TABLE {name}")
+        # Next partition: a yearly one covers every month up to part_end
+        when = max(part_end, _add_months(when, 1))
+
+
+class ArchiveReader:
+    """Read-only, memory-mapped access to one archived academic year"""
+
+    def __init__(self, academic_year: str):
+        self.academic_year = academic_year
+        self.path = year_dir(academic_year)
+        with open(os.path.join(self.path, "manifest.json")) as f:
+            self.manifest = json.load(f)
+        self._maps: Dict[str, mmap.mmap] = {}
+        self._lock = threading.Lock()
+
+    def _map(self, table: str) -> Optional[mmap.mmap]:
+        meta = self.manifest["tables"].get(table)
+        if not meta or not meta["bytes"]:
+            return None
+        with self._lock:
+            if table not in self._maps:
+                with open(os.path.join(self.path, meta["file"]), "rb") as f:
+                    self._maps[table] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            return self._maps[table]
+
+    def read(self, table: str, key: Optional[int] = None, columns: Optional[List[str]] = None) -> List[SimpleNamespace]:
+        """Rows of a table, optionally only those whose sort key equals `key`"""
+        meta = self.manifest["tables"].get(table)
+        data = self._map(table)
+        if data is None:
+            return []
+        names = columns or list(meta["columns"])
+        key_column = meta["sort_key"]
+        wanted = names if key is None or key_column in names else names + [key_column]
+        rows = []
+        for group in meta["row_groups"]:
+            if key is not None and not (group["min_key"] <= key <= group["max_key"]):
+                continue
+            values = {}
+            for name in wanted:
+                offset, length = group["chunks"][name]
+                kind = meta["columns"][name]
+                raw = json.loads(zlib.decompress(data[offset:offset + length]))
+                values[name] = [_decode(kind, value) for value in raw] if kind != "value" else raw
+            for index in range(group["rows"]):
+                if key is not None and values[key_column][index] != key:
+                    continue
+                rows.append(SimpleNamespace(**{name: values[name][index] for name in names}))
+        return rows
+
+    def student_history(self, student_id: int) -> dict:
+        from repositories.attendance_repository import AttendanceRecord, CODE_STATUSES, decode_days
+
+        attendance = self.read("student_attendance", student_id)
+        months = self.read("attendance_months", student_id)
+        if months:
+            month_ids = {row.id for row in months}
+            exceptions = {(row.month_id, row.day): row for row in self.read("attendance_exceptions")
+                          if row.month_id in month_ids}
+            for row in months:
+                for day, code in decode_days(row.statuses or 0):
+                    exception = exceptions.get((row.id, day))
+                    attendance.append(AttendanceRecord(
+                        row.student_id, datetime(row.month.year, row.month.month, day),
+                        exception.status if exception else CODE_STATUSES[code], row.subject,
+                        exception.uploaded_by if exception else row.uploaded_by, row.updated_at))
+        attendance.sort(key=lambda record: (record.date, record.subject))
+        return {
+            "marks": sorted(self.read("student_marks", student_id), key=lambda row: row.exam_date),
+            "attendance": attendance,
+            "assignments": sorted(self.read("student_assignments", student_id), key=lambda row: row.due_date),
+        }
+
+    def close(self):
+        with self._lock:
+            for data in self._maps.values():
+                data.close()
+            self._maps.clear()
+
+
+# Open readers, most recently used last
+_readers: "OrderedDict[str, ArchiveReader]" = OrderedDict()
+_readers_lock = threading.Lock()
+MAX_OPEN_READERS = 4
+
+
+def get_reader(academic_year: str) -> Optional[ArchiveReader]:
+    """Shared reader for an archived year, opened on first use"""
+    path = year_dir(academic_year)
+    with _readers_lock:
+        reader = _readers.get(path)
+        if reader:
+            _readers.move_to_end(path)
+            return reader
+        if not os.path.exists(os.path.join(path, "manifest.json")):
+            return None
+        reader = _readers[path] = ArchiveReader(academic_year)
+        while len(_readers) > MAX_OPEN_READERS:
+            _, evicted = _readers.popitem(last=False)
+            evicted.close()
+        return reader
+
+
+def archived_years() -> List[str]:
+    root = archive_root()
+    if not os.path.isdir(root):
+        return []
+    return sorted((name for name in os.listdir(root)
+                   if os.path.exists(os.path.join(root, name, "manifest.json"))), reverse=True)
+
+
+def main():
+    from database import SessionLocals
+
+    parser = argparse.ArgumentParser(description="Archive closed academic years")
+    sub = parser.add_subparsers(dest="command", required=True)
+    export = sub.add_parser("export", help="Archive a year and delete it from the live tables")
+    export.add_argument("academic_year", help='e.g. "2023-2024"')
+    export.add_argument("--keep-live", action="store_true", help="Write the archive but keep the live rows")
+    sub.add_parser("list", help="List archived years")
+    show = sub.add_parser("show", help="Print one student's archived history")
+    show.add_argument("academic_year")
+    show.add_argument("--student", type=int, required=True, help="Student.id")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        sessions = {"student": SessionLocals["student"](), "authority": SessionLocals["authority"]()}
+        try:
+            manifest = export_year(args.academic_year, sessions, args.keep_live)
+        finally:
+            for session in sessions.values():
+                session.close()
+        for table, meta in manifest["tables"].items():
+            print(f"  {table:<25} {meta['rows']:>10} rows {meta['bytes']:>12} bytes")
+        print(f"[SUCCESS] Archived {args.academic_year} to {year_dir(args.academic_year)}")
+    elif args.command == "list":
+        for year in archived_years():
+            print(year)
+    elif args.command == "show":
+        reader = get_reader(args.academic_year)
+        if not reader:
+            print(f"[ERROR] {args.academic_year} is not archived")
+            return
+        for kind, rows in reader.student_history(args.student).items():
+            print(f"{kind}: {len(rows)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Audit log.
+
+Mutating routes call audit() with the action, the entity changed and its
+before/after values; the actor comes from the session. Recording an event
+only appends it to an in-memory buffer. A background thread writes the
+buffer to the authority database's audit_log table, one multi-row INSERT
+per school, whenever AUDIT_BATCH_SIZE events are waiting or every
+AUDIT_FLUSH_SECONDS, so auditing adds neither a round trip nor a
+transaction to the request. The app flushes what is left on shutdown.
+"""
+
+import atexit
+import json
+import logging
+import threading
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from fastapi import Request
+from sqlalchemy import insert
+
+from config import AUDIT_BATCH_SIZE, AUDIT_FLUSH_SECONDS, AUDIT_BUFFER_LIMIT
+from database import DatabaseSet, current_databases
+from models import AuditLog
+
+logger = logging.getLogger(__name__)
+
+
+def snapshot(obj, fields: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+    """Current values of a model instance's columns (only `fields` when given)"""
+    names = fields if fields is not None else [column.key for column in obj.__table__.columns]
+    return {name: getattr(obj, name) for name in names}
+
+
+def _dumps(values: Optional[dict]) -> Optional[str]:
+    # Dates and decimals become strings
+    return None if values is None else json.dumps(values, default=str, sort_keys=True)
+
+
+class AuditBuffer:
+    def __init__(self, batch_size: int = AUDIT_BATCH_SIZE, flush_seconds: float = AUDIT_FLUSH_SECONDS,
+                 limit: int = AUDIT_BUFFER_LIMIT):
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.limit = limit
+        self.dropped = 0
+        self._events: List[Tuple[DatabaseSet, dict]] = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def append(self, databases: DatabaseSet, event: dict):
+        with self._lock:
+            self._events.append((databases, event))
+            if len(self._events) > self.limit:
+                overflow = len(self._events) - self.limit
+                del self._events[:overflow]
+                self.dropped += overflow
+            full = len(self._events) >= self.batch_size
+            if self._thread is None:
+                # Started by the first event, so a forked web worker gets its own
+                self._thread = threading.Thread(target=self._run, name="audit-flusher", daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+        if full:
+            self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self) -> int:
+        """Write every buffered event; events that fail stay buffered for the next flush"""
+        with self._flush_lock:
+            with self._lock:
+                events, self._events = self._events, []
+            if not events:
+                return 0
+            by_databases: Dict[DatabaseSet, List[dict]] = {}
+            for databases, event in events:
+                by_databases.setdefault(databases, []).append(event)
+
+            failed = []
+            for databases, rows in by_databases.items():
+                try:
+                    self._write(databases, rows)
+                except Exception:
+                    logger.exception("Could not write %d audit events for %s", len(rows), databases.name)
+                    failed.extend((databases, row) for row in rows)
+            if failed:
+                with self._lock:
+                    self._events[:0] = failed
+            return len(events) - len(failed)
+
+    def _write(self, databases: DatabaseSet, rows: List[dict]):
+        db = databases.open_session("authority")
+        try:
+            db.execute(insert(AuditLog), [
+                dict(row, before=_dumps(row["before"]), after=_dumps(row["after"])) for row in rows
+            ])
+            db.commit()
+        finally:
+            db.close()
+
+    def close(self):
+        """Stop the flusher and write what is left"""
+        self._stop.set()
+        self._wake.set()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join()
+        self.flush()
+
+
+audit_log = AuditBuffer()
+
+
+def audit(request: Request, action: str, entity: str, entity_id: Any = None,
+          before: Optional[dict] = None, after: Optional[dict] = None,
+          actor_id: Optional[int] = None, actor_role: Optional[str] = None):
+    """
+    Record a write by the signed-in user (or `actor_id`/`actor_role`, e.g.
+    for signup). Pass only the fields that changed; values must not be
+    mutated afterwards.
+    """
+    audit_log.append(current_databases(), {
+        "occurred_at": datetime.utcnow(),
+        "actor_id": actor_id if actor_id is not None else request.session.get("user_id"),
+        "actor_role": actor_role or request.session.get("role"),
+        "action": action,
+        "entity": entity,
+        "entity_id": None if entity_id is None else str(entity_id),
+        "before": before,
+        "after": after,
+    })
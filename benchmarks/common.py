@@ -0,0 +1,149 @@
+"""
+Shared helpers for the benchmark scripts: query counting, latency
+statistics and the JSON baseline format used to compare runs.
+"""
+
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy import event
+
+# Benchmarks import the app modules (config, database, main, ...) which live
+# at the repository root and use paths relative to it (templates/, static/)
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT_DIR, "benchmarks", "results")
+
+
+def use_repo_root():
+    """Make the app importable and its relative paths resolvable"""
+    if ROOT_DIR not in sys.path:
+        sys.path.insert(0, ROOT_DIR)
+    os.chdir(ROOT_DIR)
+
+
+class QueryCounter:
+    """Counts SQL statements executed on a set of engines"""
+
+    def __init__(self, engines):
+        self.count = 0
+        self._engines = list(engines)
+        for engine in self._engines:
+            event.listen(engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+    def close(self):
+        for engine in self._engines:
+            event.remove(engine, "before_cursor_execute", self._on_execute)
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(math.ceil(pct / 100.0 * len(sorted_values)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def latency_summary(latencies_ms: List[float]) -> Dict[str, float]:
+    values = sorted(latencies_ms)
+    return {
+        "min_ms": round(values[0], 3) if values else 0.0,
+        "p50_ms": round(percentile(values, 50), 3),
+        "p95_ms": round(percentile(values, 95), 3),
+        "p99_ms": round(percentile(values, 99), 3),
+        "max_ms": round(values[-1], 3) if values else 0.0,
+    }
+
+
+def git_revision() -> Optional[str]:
+    try:
+        result = subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                                cwd=ROOT_DIR, capture_output=True, text=True)
+        return result.stdout.strip() or None
+    except Exception:
+        return None
+
+
+def run_metadata(suite: str, params: dict) -> dict:
+    return {
+        "suite": suite,
+        "revision": git_revision(),
+        "timestamp": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": params,
+    }
+
+
+def write_results(results: dict, output: Optional[str], suite: str) -> str:
+    """Write a results document, defaulting to benchmarks/results/<suite>_<revision>.json"""
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        revision = results["meta"].get("revision") or "working"
+        output = os.path.join(RESULTS_DIR, f"{suite}_{revision}.json")
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    return output
+
+
+# metric name -> direction in which the value gets worse
+REGRESSION_METRICS = {
+    "throughput_rps": "lower",
+    "p50_ms": "higher",
+    "p95_ms": "higher",
+    "p99_ms": "higher",
+    "error_rate": "higher",
+    "queries_per_request": "higher",
+    "mean_us": "higher",
+    "alloc_kib": "higher",
+}
+
+
+def compare_results(current: dict, baseline: dict, tolerance: float) -> List[str]:
+    """
+    Compare two results documents case by case and return a list of
+    human readable regressions. A metric regresses when it is worse than the
+    baseline by more than `tolerance` (a fraction, e.g. 0.1 for 10%).
+    Query counts and error rates are compared exactly.
+    """
+    regressions = []
+    baseline_cases = baseline.get("cases", {})
+    for name, metrics in current.get("cases", {}).items():
+        base = baseline_cases.get(name)
+        if not base:
+            continue
+        for metric, worse in REGRESSION_METRICS.items():
+            if metric not in metrics or metric not in base:
+                continue
+            new_value, old_value = metrics[metric], base[metric]
+            exact = metric in ("queries_per_request", "error_rate")
+            allowed = 0.0 if exact else abs(old_value) * tolerance
+            if worse == "higher" and new_value > old_value + allowed:
+                regressions.append(f"{name}: {metric} {old_value} -> {new_value}")
+            elif worse == "lower" and new_value < old_value - allowed:
+                regressions.append(f"{name}: {metric} {old_value} -> {new_value}")
+    return regressions
+
+
+def check_baseline(results: dict, baseline_path: Optional[str], tolerance: float) -> int:
+    """Print regressions against a baseline file and return a process exit code"""
+    if not baseline_path:
+        return 0
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    regressions = compare_results(results, baseline, tolerance)
+    if regressions:
+        print(f"[ERROR] {len(regressions)} regression(s) against {baseline_path}:")
+        for line in regressions:
+            print(f"  - {line}")
+        return 1
+    print(f"[SUCCESS] No regressions against {baseline_path}")
+    return 0
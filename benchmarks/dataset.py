@@ -0,0 +1,379 @@
+"""
+Synthetic dataset for benchmarks.
+
+Seeds the four configured databases with a reproducible school: bench users
+in school_public, students with marks/attendance/assignments in
+school_students, teachers with class assignments in school_teachers and
+an authority with notices in school_authority. All usernames start with
+BENCH_PREFIX so the data can be found and removed again.
+
+    python -m benchmarks.dataset --students 500 --days 40
+    python -m benchmarks.dataset --drop
+"""
+
+import argparse
+import random
+from dataclasses import dataclass, asdict, field
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+from benchmarks.common import use_repo_root
+
+use_repo_root()
+
+from sqlalchemy import insert, delete, select  # noqa: E402
+
+from database import engines, SessionLocals, create_all_tables  # noqa: E402
+from partitions import PARTITIONED_TABLES, ensure_range  # noqa: E402
+from grading import DEFAULT_SCALE  # noqa: E402
+from models import (  # noqa: E402
+    PublicUser, Student, StudentMarks, StudentAttendance, StudentAssignments,
+    AttendanceMonth, AttendanceException, AttendanceWindow, AbsenceAlert,
+    Teacher, TeacherSubjects, TeacherUnavailability, TimetableEntry, Authority, SchoolNotices,
+)
+from repositories.user_repository import pwd_context  # noqa: E402
+
+BENCH_PREFIX = "bench_"
+BENCH_PASSWORD = "password123"
+
+SUBJECTS = ["Mathematics", "Science", "English", "Social Studies", "Computer"]
+GRADES = ["6", "7", "8", "9", "10"]
+SECTIONS = ["A", "B"]
+FIRST_NAMES = ["Aarav", "Sita", "Ram", "Gita", "Hari", "Maya", "Bikash", "Anita", "Suman", "Kiran"]
+LAST_NAMES = ["Sharma", "Thapa", "Gurung", "Rai", "Shrestha", "Tamang", "Karki", "Dhami", "Magar", "Joshi"]
+
+CLASSES_PER_TEACHER = 2
+CHUNK_SIZE = 5000
+
+
+@dataclass
+class DatasetSpec:
+    students: int = 200
+    teachers: int = 10
+    authorities: int = 2
+    days: int = 20
+    exams_per_subject: int = 3
+    assignments_per_subject: int = 2
+    notices: int = 50
+    seed: int = 42
+
+
+@dataclass
+class Dataset:
+    spec: DatasetSpec
+    student_usernames: List[str] = field(default_factory=list)
+    teacher_usernames: List[str] = field(default_factory=list)
+    authority_usernames: List[str] = field(default_factory=list)
+    student_ids: List[int] = field(default_factory=list)
+
+    def summary(self) -> Dict[str, int]:
+        spec = self.spec
+        subjects = len(SUBJECTS)
+        return {
+            "students": spec.students,
+            "teachers": spec.teachers,
+            "authorities": spec.authorities,
+            "attendance_rows": spec.students * subjects * spec.days,
+            "marks_rows": spec.students * subjects * spec.exams_per_subject,
+            "assignment_rows": spec.students * subjects * spec.assignments_per_subject,
+            "notices": spec.notices,
+        }
+
+
+def _chunks(rows, size=CHUNK_SIZE):
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+
+def _bulk_insert(session, model, rows):
+    for chunk in _chunks(rows):
+        session.execute(insert(model), chunk)
+
+
+def _insert_returning_ids(session, model, rows) -> List[int]:
+    ids = []
+    for chunk in _chunks(rows):
+        ids.extend(session.scalars(insert(model).returning(model.id), chunk).all())
+    return ids
+
+
+def create_tables():
+    create_all_tables()
+
+
+def student_history_rows(student_id: int, rng: random.Random, days: int, exams: int,
+                         assignments: int, uploaded_by: int, start: datetime):
+    """Marks, attendance and assignment rows for one student"""
+    marks, attendance, homework = [], [], []
+    for subject in SUBJECTS:
+        for day in range(days):
+            attendance.append({
+                "student_id": student_id,
+                "date": start + timedelta(days=day),
+                "status": rng.choices(["present", "absent", "late"], weights=[88, 8, 4])[0],
+                "subject": subject,
+                "uploaded_by": uploaded_by,
+            })
+        for exam in range(exams):
+            obtained = round(rng.uniform(25, 100), 1)
+            marks.append({
+                "student_id": student_id,
+                "subject": subject,
+                "exam_type": ["quiz", "midterm", "final"][exam % 3],
+                "marks_obtained": obtained,
+                "total_marks": 100.0,
+                "grade": DEFAULT_SCALE.grade(obtained, 100.0),
+                "exam_date": start + timedelta(days=exam * 7),
+                "uploaded_by": uploaded_by,
+            })
+        for number in range(assignments):
+            assigned = start + timedelta(days=number * 5)
+            homework.append({
+                "student_id": student_id,
+                "assignment_title": f"{subject} worksheet {number + 1}",
+                "subject": subject,
+                "assignment_date": assigned,
+                "due_date": assigned + timedelta(days=7),
+                "status": rng.choice(["submitted", "pending", "overdue"]),
+                "uploaded_by": uploaded_by,
+            })
+    return marks, attendance, homework
+
+
+def seed(spec: DatasetSpec) -> Dataset:
+    """Create the synthetic school. Existing bench data is removed first."""
+    rng = random.Random(spec.seed)
+    dataset = Dataset(spec=spec)
+    create_tables()
+    drop()
+
+    # Hashing is deliberately slow, every bench user shares one hash
+    hashed_password = pwd_context.hash(BENCH_PASSWORD)
+
+    users = []
+    for role, count, names in (
+        ("student", spec.students, dataset.student_usernames),
+        ("teacher", spec.teachers, dataset.teacher_usernames),
+        ("authority", spec.authorities, dataset.authority_usernames),
+    ):
+        for i in range(count):
+            username = f"{BENCH_PREFIX}{role}{i}"
+            names.append(username)
+            users.append({
+                "username": username,
+                "email": f"{username}@bench.example.com",
+                "hashed_password": hashed_password,
+                "role": role,
+                "is_active": True,
+            })
+
+    public_db = SessionLocals["public"]()
+    student_db = SessionLocals["student"]()
+    teacher_db = SessionLocals["teacher"]()
+    authority_db = SessionLocals["authority"]()
+    try:
+        user_ids = _insert_returning_ids(public_db, PublicUser, users)
+        public_db.commit()
+        student_user_ids = user_ids[:spec.students]
+        teacher_user_ids = user_ids[spec.students:spec.students + spec.teachers]
+        authority_user_ids = user_ids[spec.students + spec.teachers:]
+
+        # Teachers, each teaching one subject to a few classes
+        classes = [(grade, section) for grade in GRADES for section in SECTIONS]
+        teachers = []
+        for i, user_id in enumerate(teacher_user_ids):
+            teachers.append({
+                "user_id": user_id,
+                "teacher_id": f"BTCH{user_id:05d}",
+                "first_name": rng.choice(FIRST_NAMES),
+                "last_name": rng.choice(LAST_NAMES),
+                "subjects": SUBJECTS[i % len(SUBJECTS)],
+                "phone": f"98{rng.randint(10000000, 99999999)}",
+                "qualification": "M.Ed",
+                "experience_years": rng.randint(1, 25),
+            })
+        teacher_ids = _insert_returning_ids(teacher_db, Teacher, teachers)
+        teacher_subjects = []
+        for i, teacher_id in enumerate(teacher_ids):
+            for offset in range(CLASSES_PER_TEACHER):
+                grade, section = classes[(i * CLASSES_PER_TEACHER + offset) % len(classes)]
+                teacher_subjects.append({
+                    "teacher_id": teacher_id,
+                    "subject_name": SUBJECTS[i % len(SUBJECTS)],
+                    "grade": grade,
+                    "section": section,
+                })
+        _bulk_insert(teacher_db, TeacherSubjects, teacher_subjects)
+        teacher_db.commit()
+
+        # Students and their history
+        students = []
+        for i, user_id in enumerate(student_user_ids):
+            grade, section = classes[i % len(classes)]
+            students.append({
+                "user_id": user_id,
+                "student_id": f"BSTU{user_id:06d}",
+                "first_name": rng.choice(FIRST_NAMES),
+                "last_name": rng.choice(LAST_NAMES),
+                "grade": grade,
+                "section": section,
+                "phone": f"98{rng.randint(10000000, 99999999)}",
+                "address": f"Ward {rng.randint(1, 32)}, Kathmandu",
+                "guardian_name": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+                "guardian_phone": f"98{rng.randint(10000000, 99999999)}",
+            })
+        dataset.student_ids = _insert_returning_ids(student_db, Student, students)
+
+        start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=spec.days)
+        for table in PARTITIONED_TABLES:
+            ensure_range(engines["student"], table, start, datetime.utcnow())
+        uploader = teacher_user_ids[0] if teacher_user_ids else 0
+        marks, attendance, homework = [], [], []
+        for student_id in dataset.student_ids:
+            m, a, h = student_history_rows(student_id, rng, spec.days, spec.exams_per_subject,
+                                           spec.assignments_per_subject, uploader, start)
+            marks.extend(m)
+            attendance.extend(a)
+            homework.extend(h)
+            # Flush in batches so large datasets do not sit in memory
+            if len(attendance) >= CHUNK_SIZE * 4:
+                _bulk_insert(student_db, StudentMarks, marks)
+                _bulk_insert(student_db, StudentAttendance, attendance)
+                _bulk_insert(student_db, StudentAssignments, homework)
+                marks, attendance, homework = [], [], []
+        _bulk_insert(student_db, StudentMarks, marks)
+        _bulk_insert(student_db, StudentAttendance, attendance)
+        _bulk_insert(student_db, StudentAssignments, homework)
+        student_db.commit()
+
+        # Authorities and notices
+        _bulk_insert(authority_db, Authority, [{
+            "user_id": user_id,
+            "first_name": rng.choice(FIRST_NAMES),
+            "last_name": rng.choice(LAST_NAMES),
+            "position": "Admin",
+            "phone": f"98{rng.randint(10000000, 99999999)}",
+        } for user_id in authority_user_ids])
+        creator = authority_user_ids[0] if authority_user_ids else 0
+        _bulk_insert(authority_db, SchoolNotices, [{
+            "title": f"Notice {i + 1}",
+            "content": "The school will remain closed for the upcoming festival. " * rng.randint(1, 6),
+            "priority": rng.choice(["high", "medium", "low"]),
+            "target_audience": rng.choice(["all", "students", "teachers"]),
+            "is_active": rng.random() > 0.1,
+            "created_by": creator,
+            "created_at": start + timedelta(hours=i),
+        } for i in range(spec.notices)])
+        authority_db.commit()
+    finally:
+        public_db.close()
+        student_db.close()
+        teacher_db.close()
+        authority_db.close()
+
+    return dataset
+
+
+def load(spec: DatasetSpec) -> Dataset:
+    """Describe an already seeded dataset without recreating it"""
+    dataset = Dataset(spec=spec)
+    public_db = SessionLocals["public"]()
+    student_db = SessionLocals["student"]()
+    try:
+        users = public_db.execute(
+            select(PublicUser.id, PublicUser.username, PublicUser.role)
+            .where(PublicUser.username.like(f"{BENCH_PREFIX}%"))
+            .order_by(PublicUser.id)
+        ).all()
+        by_role = {"student": dataset.student_usernames, "teacher": dataset.teacher_usernames,
+                   "authority": dataset.authority_usernames}
+        for _, username, role in users:
+            by_role[role].append(username)
+        student_user_ids = [user_id for user_id, _, role in users if role == "student"]
+        for chunk in _chunks(student_user_ids):
+            dataset.student_ids.extend(
+                student_db.scalars(select(Student.id).where(Student.user_id.in_(chunk))).all()
+            )
+    finally:
+        public_db.close()
+        student_db.close()
+    return dataset
+
+
+def drop():
+    """Remove every row created by seed()"""
+    public_db = SessionLocals["public"]()
+    student_db = SessionLocals["student"]()
+    teacher_db = SessionLocals["teacher"]()
+    authority_db = SessionLocals["authority"]()
+    try:
+        user_ids = public_db.scalars(
+            select(PublicUser.id).where(PublicUser.username.like(f"{BENCH_PREFIX}%"))
+        ).all()
+        if not user_ids:
+            return
+        student_ids = student_db.scalars(select(Student.id).where(Student.user_id.in_(user_ids))).all()
+        for chunk in _chunks(list(student_ids)):
+            months = select(AttendanceMonth.id).where(AttendanceMonth.student_id.in_(chunk))
+            student_db.execute(delete(AttendanceException).where(AttendanceException.month_id.in_(months)))
+            # Including the rows the app derives from their attendance
+            for model in (StudentMarks, StudentAttendance, StudentAssignments,
+                          AttendanceMonth, AttendanceWindow, AbsenceAlert):
+                student_db.execute(delete(model).where(model.student_id.in_(chunk)))
+            student_db.execute(delete(Student).where(Student.id.in_(chunk)))
+        student_db.commit()
+
+        teacher_ids = teacher_db.scalars(select(Teacher.id).where(Teacher.user_id.in_(user_ids))).all()
+        for model in (TeacherSubjects, TeacherUnavailability, TimetableEntry):
+            teacher_db.execute(delete(model).where(model.teacher_id.in_(teacher_ids)))
+        teacher_db.execute(delete(Teacher).where(Teacher.id.in_(teacher_ids)))
+        teacher_db.commit()
+
+        authority_db.execute(delete(SchoolNotices).where(SchoolNotices.created_by.in_(user_ids)))
+        authority_db.execute(delete(Authority).where(Authority.user_id.in_(user_ids)))
+        authority_db.commit()
+
+        for chunk in _chunks(list(user_ids)):
+            public_db.execute(delete(PublicUser).where(PublicUser.id.in_(chunk)))
+        public_db.commit()
+    finally:
+        public_db.close()
+        student_db.close()
+        teacher_db.close()
+        authority_db.close()
+
+
+def spec_arguments(parser: argparse.ArgumentParser):
+    defaults = DatasetSpec()
+    parser.add_argument("--students", type=int, default=defaults.students)
+    parser.add_argument("--teachers", type=int, default=defaults.teachers)
+    parser.add_argument("--days", type=int, default=defaults.days)
+    parser.add_argument("--notices", type=int, default=defaults.notices)
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+
+
+def spec_from_args(args) -> DatasetSpec:
+    return DatasetSpec(students=args.students, teachers=args.teachers, days=args.days,
+                       notices=args.notices, seed=args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Seed or drop the synthetic benchmark dataset")
+    spec_arguments(parser)
+    parser.add_argument("--drop", action="store_true", help="Only remove existing bench data")
+    args = parser.parse_args()
+
+    if args.drop:
+        drop()
+        print("[SUCCESS] Benchmark data removed")
+        return
+
+    dataset = seed(spec_from_args(args))
+    print("[SUCCESS] Benchmark dataset created")
+    for name, value in dataset.summary().items():
+        print(f"  {name}: {value}")
+    print(f"  spec: {asdict(dataset.spec)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+"""
+End-to-end load test for the ASGI app in main.py.
+
+Virtual users drive the real app in-process over httpx's ASGI transport,
+against the synthetic dataset from benchmarks/dataset.py. Each scenario
+reports throughput, p50/p95/p99 latency, error rate and the number of SQL
+statements it caused. Results are written as JSON so two revisions can be
+compared automatically:
+
+    python -m benchmarks.load_test --output baseline.json
+    python -m benchmarks.load_test --compare baseline.json --tolerance 0.15
+"""
+
+import argparse
+import asyncio
+import random
+import sys
+import time
+from datetime import date
+from typing import Callable, Dict, List
+
+import httpx
+
+from benchmarks.common import (
+    use_repo_root, QueryCounter, latency_summary, run_metadata, write_results, check_baseline,
+)
+
+use_repo_root()
+
+from benchmarks import dataset as bench_dataset  # noqa: E402
+from benchmarks.dataset import BENCH_PASSWORD, SUBJECTS  # noqa: E402
+from database import engines  # noqa: E402
+from main import app  # noqa: E402
+
+
+class Recorder:
+    """Latency and error bookkeeping for one scenario"""
+
+    def __init__(self):
+        self.latencies_ms: List[float] = []
+        self.errors = 0
+
+    def add(self, elapsed_ms: float, ok: bool):
+        self.latencies_ms.append(elapsed_ms)
+        if not ok:
+            self.errors += 1
+
+
+class VirtualUser:
+    def __init__(self, username: str, scenario: str, recorder: Recorder, rng: random.Random):
+        self.username = username
+        self.scenario = scenario
+        self.recorder = recorder
+        self.rng = rng
+        self.client = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=app),
+            base_url="http://testserver",
+            follow_redirects=False,
+        )
+
+    async def request(self, method: str, url: str, expect=(200,), record: bool = True, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, **kwargs)
+            ok = response.status_code in expect
+        except Exception:
+            ok = False
+        if record:
+            self.recorder.add((time.perf_counter() - started) * 1000.0, ok)
+        return ok
+
+    async def login(self, record: bool = False):
+        return await self.request("POST", "/login", expect=(303,), record=record,
+                                  data={"username": self.username, "password": BENCH_PASSWORD})
+
+    async def close(self):
+        await self.client.aclose()
+
+
+# Scenario steps. Each performs one user "action" which may be several requests.
+
+async def login_storm(vu: VirtualUser, data):
+    await vu.login(record=True)
+    vu.client.cookies.clear()
+
+
+async def teacher_attendance(vu: VirtualUser, data):
+    await vu.request("GET", "/teacher/add-attendance")
+    await vu.request("POST", "/teacher/add-attendance", expect=(303,), data={
+        "student_id": vu.rng.choice(data.student_ids),
+        "date": date.today().isoformat(),
+        "status": vu.rng.choices(["present", "absent", "late"], weights=[88, 8, 4])[0],
+        "subject": vu.rng.choice(SUBJECTS),
+    })
+
+
+async def student_dashboard(vu: VirtualUser, data):
+    await vu.request("GET", "/student/dashboard")
+
+
+async def authority_rosters(vu: VirtualUser, data):
+    await vu.request("GET", "/authority/students")
+    await vu.request("GET", "/authority/teachers")
+    await vu.request("GET", "/authority/notices")
+
+
+# name -> (role of the virtual users, log in before measuring, step)
+SCENARIOS: Dict[str, tuple] = {
+    "login_storm": ("student", False, login_storm),
+    "teacher_attendance": ("teacher", True, teacher_attendance),
+    "student_dashboard": ("student", True, student_dashboard),
+    "authority_rosters": ("authority", True, authority_rosters),
+}
+
+# Relative frequency of each scenario in the "mixed" run
+MIX_WEIGHTS = {
+    "login_storm": 1,
+    "teacher_attendance": 3,
+    "student_dashboard": 10,
+    "authority_rosters": 1,
+}
+
+
+def usernames_for(role: str, data, count: int) -> List[str]:
+    pool = {
+        "student": data.student_usernames,
+        "teacher": data.teacher_usernames,
+        "authority": data.authority_usernames,
+    }[role]
+    if not pool:
+        raise RuntimeError(f"Benchmark dataset has no {role} users")
+    return [pool[i % len(pool)] for i in range(count)]
+
+
+async def run_vus(vus: List[VirtualUser], iterations: int, step_for: Callable, data):
+    async def run_one(vu):
+        for _ in range(iterations):
+            await step_for(vu)(vu, data)
+    await asyncio.gather(*(run_one(vu) for vu in vus))
+
+
+async def run_scenario(name: str, data, concurrency: int, iterations: int, seed: int) -> dict:
+    recorder = Recorder()
+    rng = random.Random(seed)
+
+    if name == "mixed":
+        # Virtual users are split between the scenarios by weight
+        names = [n for n in SCENARIOS for _ in range(MIX_WEIGHTS[n])]
+        assigned = [names[i % len(names)] for i in range(concurrency)]
+    else:
+        assigned = [name] * concurrency
+
+    vus = []
+    for scenario in sorted(set(assigned)):
+        role = SCENARIOS[scenario][0]
+        count = assigned.count(scenario)
+        for username in usernames_for(role, data, count):
+            vus.append(VirtualUser(username, scenario, recorder, random.Random(rng.random())))
+
+    try:
+        for vu in vus:
+            if SCENARIOS[vu.scenario][1] and not await vu.login():
+                raise RuntimeError(f"Setup login failed for {vu.username}")
+
+        counter = QueryCounter(engines.values())
+        started = time.perf_counter()
+        await run_vus(vus, iterations, lambda vu: SCENARIOS[vu.scenario][2], data)
+        elapsed = time.perf_counter() - started
+        counter.close()
+    finally:
+        for vu in vus:
+            await vu.close()
+
+    requests = len(recorder.latencies_ms)
+    result = {
+        "requests": requests,
+        "errors": recorder.errors,
+        "error_rate": round(recorder.errors / requests, 4) if requests else 0.0,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(requests / elapsed, 2) if elapsed else 0.0,
+        "queries": counter.count,
+        "queries_per_request": round(counter.count / requests, 2) if requests else 0.0,
+    }
+    result.update(latency_summary(recorder.latencies_ms))
+    return result
+
+
+def print_case(name: str, case: dict):
+    print(f"{name:<20} {case['requests']:>6} req  {case['throughput_rps']:>8.1f} rps  "
+          f"p50 {case['p50_ms']:>8.2f}  p95 {case['p95_ms']:>8.2f}  p99 {case['p99_ms']:>8.2f} ms  "
+          f"err {case['error_rate'] * 100:>5.1f}%  {case['queries_per_request']:>6.2f} q/req")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the School Management Portal")
+    bench_dataset.spec_arguments(parser)
+    parser.add_argument("--reuse", action="store_true", help="Use the already seeded dataset")
+    parser.add_argument("--scenario", action="append", choices=list(SCENARIOS) + ["mixed"],
+                        help="Scenario to run (repeatable, default: all plus mixed)")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--iterations", type=int, default=10, help="Steps per virtual user")
+    parser.add_argument("--output", help="Results file (default: benchmarks/results/load_<rev>.json)")
+    parser.add_argument("--compare", help="Baseline results file to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.10,
+                        help="Allowed relative slowdown before a metric counts as a regression")
+    args = parser.parse_args()
+
+    spec = bench_dataset.spec_from_args(args)
+    if args.reuse:
+        data = bench_dataset.load(spec)
+    else:
+        print("Seeding benchmark dataset...")
+        data = bench_dataset.seed(spec)
+
+    scenarios = args.scenario or list(SCENARIOS) + ["mixed"]
+    results = {
+        "meta": run_metadata("load", {
+            "concurrency": args.concurrency,
+            "iterations": args.iterations,
+            "dataset": data.summary(),
+        }),
+        "cases": {},
+    }
+    for name in scenarios:
+        case = asyncio.run(run_scenario(name, data, args.concurrency, args.iterations, args.seed))
+        results["cases"][name] = case
+        print_case(name, case)
+
+    path = write_results(results, args.output, "load")
+    print(f"[SUCCESS] Results written to {path}")
+    sys.exit(check_baseline(results, args.compare, args.tolerance))
+
+
+if __name__ == "__main__":
+    main()
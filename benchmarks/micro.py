@@ -0,0 +1,284 @@
+"""
+Microbenchmarks for the hot building blocks: repository fetches,
+authentication, token creation and template rendering.
+
+Every data-dependent case runs at several history sizes (days of
+attendance per subject, with marks and assignments scaled alongside) and
+reports per-call timing plus peak allocations, so it is easy to see which
+layer grows badly as a student's history gets longer:
+
+    python -m benchmarks.micro --sizes 10,100,1000 --output micro.json
+    python -m benchmarks.micro --compare micro.json
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from decimal import Decimal
+from types import SimpleNamespace
+from typing import Callable, Dict, List
+
+from benchmarks.common import use_repo_root, run_metadata, write_results, check_baseline
+
+use_repo_root()
+
+from fastapi.templating import Jinja2Templates  # noqa: E402
+from sqlalchemy import insert  # noqa: E402
+
+from benchmarks import dataset as bench_dataset  # noqa: E402
+from benchmarks.dataset import BENCH_PREFIX, BENCH_PASSWORD, SUBJECTS  # noqa: E402
+from database import SessionLocals  # noqa: E402
+from grading import DEFAULT_SCALE  # noqa: E402
+from partitions import PARTITIONED_TABLES, ensure_range  # noqa: E402
+from reports import subject_results  # noqa: E402
+from models import StudentMarks, StudentAttendance, StudentAssignments  # noqa: E402
+from repositories.attendance_repository import summarize_records  # noqa: E402
+from repositories.fee_repository import FeeTotals  # noqa: E402
+from repositories.notice_repository import NoticeView  # noqa: E402
+from repositories.student_repository import StudentRepository, StudentListItem  # noqa: E402
+from repositories.user_repository import UserRepository  # noqa: E402
+from rosters import Roster, RosterClass  # noqa: E402
+from routes.authority import NoticeStats  # noqa: E402
+from routes.auth import create_access_token  # noqa: E402
+
+TEMPLATE_DIR = "templates"
+
+
+def measure(fn: Callable, repeat: int) -> Dict[str, float]:
+    """Time `repeat` calls of fn and the peak allocation of one extra call"""
+    fn()  # warm up caches, compiled templates and the connection pool
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter_ns()
+        fn()
+        timings.append((time.perf_counter_ns() - started) / 1000.0)
+
+    tracemalloc.start()
+    baseline, _ = tracemalloc.get_traced_memory()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    timings.sort()
+    return {
+        "calls": repeat,
+        "mean_us": round(statistics.fmean(timings), 2),
+        "p50_us": round(timings[len(timings) // 2], 2),
+        "p95_us": round(timings[min(int(len(timings) * 0.95), len(timings) - 1)], 2),
+        "alloc_kib": round((peak - baseline) / 1024.0, 2),
+    }
+
+
+def seed_history(size: int, rng: random.Random) -> SimpleNamespace:
+    """A user and student with `size` days of history in every subject"""
+    public_db = SessionLocals["public"]()
+    student_db = SessionLocals["student"]()
+    try:
+        username = f"{BENCH_PREFIX}micro{size}"
+        user = UserRepository(public_db).create_user(username, f"{username}@bench.example.com",
+                                                     BENCH_PASSWORD, "student")
+        student = StudentRepository(student_db).create_student(user.id, {
+            "student_id": f"BMIC{size:06d}", "first_name": "Micro", "last_name": f"Bench{size}",
+            "grade": "10", "section": "A", "phone": "", "address": "",
+            "guardian_name": "", "guardian_phone": "",
+        })
+        start = datetime.utcnow() - timedelta(days=size)
+        for table in PARTITIONED_TABLES:
+            ensure_range(student_db.get_bind(), table, start, datetime.utcnow())
+        marks, attendance, homework = bench_dataset.student_history_rows(
+            student.id, rng, days=size, exams=max(size // 10, 1),
+            assignments=max(size // 10, 1), uploaded_by=0, start=start,
+        )
+        for model, rows in ((StudentMarks, marks), (StudentAttendance, attendance),
+                            (StudentAssignments, homework)):
+            for chunk in bench_dataset._chunks(rows):
+                student_db.execute(insert(model), chunk)
+        student_db.commit()
+        return SimpleNamespace(user_id=user.id, username=username, student_pk=student.id,
+                               rows={"marks": len(marks), "attendance": len(attendance),
+                                     "assignments": len(homework)})
+    finally:
+        public_db.close()
+        student_db.close()
+
+
+def repository_cases(history) -> Dict[str, Callable]:
+    def with_repo(call):
+        def run():
+            db = SessionLocals["student"]()
+            try:
+                return call(StudentRepository(db))
+            finally:
+                db.close()
+        return run
+
+    return {
+        "repo.get_student_by_user_id": with_repo(lambda r: r.get_student_by_user_id(history.user_id)),
+        "repo.get_student_marks": with_repo(lambda r: r.get_student_marks(history.student_pk)),
+        "repo.get_student_attendance": with_repo(lambda r: r.get_student_attendance(history.student_pk)),
+        "repo.get_student_assignments": with_repo(lambda r: r.get_student_assignments(history.student_pk)),
+    }
+
+
+class FakeRequest:
+    """Just enough of a Starlette request for base.html and url_for()"""
+
+    def __init__(self, role: str):
+        self.session = {"user_id": 1, "username": f"{role}1", "role": role}
+        self.query_params = {}
+
+    def url_for(self, name: str, **path_params) -> str:
+        return f"/{name}{path_params.get('path', '')}"
+
+
+def template_context(size: int, rng: random.Random) -> dict:
+    """Context covering every variable used across templates/, scaled by size"""
+    now = datetime.utcnow()
+    person = SimpleNamespace(id=1, student_id="STU0001", teacher_id="TCH0001", first_name="Sita",
+                             last_name="Thapa", grade="10", section="A", subjects="Mathematics",
+                             position="Principal", phone="9800000000")
+    marks = [SimpleNamespace(subject=rng.choice(SUBJECTS), exam_type="midterm", marks_obtained=78.5,
+                             total_marks=100.0, grade="B+", created_at=now) for _ in range(size)]
+    attendance = [SimpleNamespace(date=now - timedelta(days=i), subject=rng.choice(SUBJECTS),
+                                  status=rng.choice(["present", "absent", "late"]), created_at=now)
+                  for i in range(size * len(SUBJECTS))]
+    assignments = [SimpleNamespace(assignment_title=f"Worksheet {i}", subject=rng.choice(SUBJECTS),
+                                   due_date=now, status="pending") for i in range(size)]
+    notices = [SimpleNamespace(id=i, title=f"Notice {i}", content="Exam schedule update. " * 10,
+                               priority=rng.choice(["high", "medium", "low"]), target_audience="all",
+                               is_active=True, created_at=now, expires_at=None) for i in range(size)]
+    students = [SimpleNamespace(id=i, student_id=f"STU{i:04d}", first_name="Ram", last_name="Rai",
+                                grade="10", section="A") for i in range(size)]
+    teachers = [SimpleNamespace(id=i, teacher_id=f"TCH{i:04d}", first_name="Hari", last_name="Karki",
+                                subjects="Science") for i in range(size)]
+    balances = [SimpleNamespace(student_id=s.id, invoiced=Decimal("25000.00"), paid=Decimal("10000.00"),
+                                balance=Decimal("15000.00")) for s in students]
+    invoices = [SimpleNamespace(academic_year="2023-2024", fee_type="tuition", due_date=now.date(),
+                                amount=Decimal("2500.00")) for _ in range(size)]
+    payments = [SimpleNamespace(paid_at=now, method="cash", reference=None, amount=Decimal("1000.00"))
+                for _ in range(size)]
+    roster_students = [StudentListItem(s.id, s.student_id, s.first_name, s.last_name, s.grade, s.section)
+                       for s in students]
+    roster = Roster([RosterClass("10", "A", ["Mathematics"], roster_students)], roster_students,
+                    frozenset(s.id for s in roster_students))
+    return {
+        "student": person, "teacher": person, "authority": person, "user": person,
+        "marks": marks, "attendance": attendance, "assignments": assignments,
+        "notices": notices, "recent_notices": notices[:5], "unread_notices": size,
+        "notice_views": [NoticeView(notice, False) for notice in notices],
+        "recent_marks": marks[:10], "recent_attendance": attendance[:10],
+        "students": students, "teachers": teachers,
+        "total_students": size, "total_teachers": size, "active_notices": size,
+        "grade_scales": {"": DEFAULT_SCALE.bands},
+        "notice_stats": NoticeStats(size, size // 3, size, size),
+        "roster": roster, "attendance_summary": summarize_records(attendance), "academic_year": "2023-2024",
+        "totals": FeeTotals(size, Decimal("25000.00") * size, Decimal("10000.00") * size,
+                            Decimal("15000.00") * size),
+        "billed_grades": ["9", "10"], "outstanding": list(zip(balances, students)), "lookup": person.student_id,
+        "account": {"student": person, "balance": balances[0] if balances else None,
+                    "invoices": invoices, "payments": payments},
+        "school": "Bench School", "generated_at": now,
+        "subjects": subject_results([dict(vars(mark), exam_date=now) for mark in marks]),
+    }
+
+
+# Templates that list notices with the student's read state, as (notice, is_read)
+NOTICE_VIEW_TEMPLATES = {"notices.html", "student_dashboard.html"}
+
+
+def template_cases(size: int, rng: random.Random) -> Dict[str, Callable]:
+    templates = Jinja2Templates(directory=TEMPLATE_DIR)
+    context = template_context(size, rng)
+    cases = {}
+    for name in sorted(os.listdir(TEMPLATE_DIR)):
+        if not name.endswith(".html") or name == "base.html":
+            continue
+        role = name.split("_")[0] if "_" in name else "student"
+        template = templates.get_template(name)
+        ctx = dict(context, request=FakeRequest(role))
+        if name in NOTICE_VIEW_TEMPLATES:
+            ctx["notices"] = context["notice_views"]
+        cases[f"template.{name}"] = lambda t=template, c=ctx: t.render(c)
+    return cases
+
+
+def print_growth(cases: Dict[str, dict], sizes: List[int]):
+    """How much slower each case gets from the smallest to the largest size"""
+    if len(sizes) < 2:
+        return
+    print(f"\nGrowth from n={sizes[0]} to n={sizes[-1]}:")
+    names = sorted({key.split("[")[0] for key in cases})
+    growth = []
+    for name in names:
+        first, last = cases.get(f"{name}[n={sizes[0]}]"), cases.get(f"{name}[n={sizes[-1]}]")
+        if first and last and first["mean_us"]:
+            growth.append((last["mean_us"] / first["mean_us"], name))
+    for ratio, name in sorted(growth, reverse=True):
+        print(f"  {name:<45} x{ratio:.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmarks for repositories and templates")
+    parser.add_argument("--sizes", default="10,100,1000",
+                        help="Comma separated days of history per subject")
+    parser.add_argument("--repeat", type=int, default=50, help="Timed calls per case")
+    parser.add_argument("--auth-repeat", type=int, default=5,
+                        help="Timed calls for authenticate_user (bcrypt is slow on purpose)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Results file (default: benchmarks/results/micro_<rev>.json)")
+    parser.add_argument("--compare", help="Baseline results file to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.10)
+    args = parser.parse_args()
+
+    sizes = sorted(int(size) for size in args.sizes.split(","))
+    rng = random.Random(args.seed)
+    bench_dataset.create_tables()
+    bench_dataset.drop()
+
+    results = {
+        "meta": run_metadata("micro", {"sizes": sizes, "repeat": args.repeat}),
+        "cases": {},
+    }
+
+    def record(name: str, fn: Callable, repeat: int, **extra):
+        case = measure(fn, repeat)
+        case.update(extra)
+        results["cases"][name] = case
+        print(f"{name:<60} {case['mean_us']:>12.1f} us  p95 {case['p95_us']:>12.1f} us  "
+              f"{case['alloc_kib']:>10.1f} KiB")
+
+    try:
+        # Size independent cases
+        record("auth.create_access_token",
+               lambda: create_access_token({"sub": "student1"}, timedelta(minutes=30)), args.repeat)
+        for size in sizes:
+            history = seed_history(size, rng)
+            if size == sizes[0]:
+                def authenticate(username=history.username):
+                    db = SessionLocals["public"]()
+                    try:
+                        return UserRepository(db).authenticate_user(username, BENCH_PASSWORD)
+                    finally:
+                        db.close()
+                record("repo.authenticate_user", authenticate, args.auth_repeat)
+
+            for name, fn in repository_cases(history).items():
+                record(f"{name}[n={size}]", fn, args.repeat, rows=history.rows)
+            for name, fn in template_cases(size, rng).items():
+                record(f"{name}[n={size}]", fn, args.repeat)
+    finally:
+        bench_dataset.drop()
+
+    print_growth(results["cases"], sizes)
+    path = write_results(results, args.output, "micro")
+    print(f"\n[SUCCESS] Results written to {path}")
+    sys.exit(check_baseline(results, args.compare, args.tolerance))
+
+
+if __name__ == "__main__":
+    main()
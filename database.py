@@ -1,46 +1,269 @@
-from sqlalchemy import create_engine, MetaData
+import itertools
+import threading
+import time
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+from fastapi import Request
+from sqlalchemy import create_engine, MetaData, text
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-from config import DATABASE_CONFIGS
+from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.sql import Select
+from config import (
+    DATABASE_CONFIGS, DATABASE_REPLICA_CONFIGS, REPLICA_MAX_LAG_SECONDS, REPLICA_LAG_CHECK_SECONDS,
+    READ_YOUR_WRITES_SECONDS, DEPLOYMENT_MODE, CONSOLIDATED_DATABASE_URL, CONSOLIDATED_SCHEMAS,
+    CONSOLIDATED_REPLICA_URLS,
+)
+
+CONSOLIDATED = DEPLOYMENT_MODE == "consolidated"
+
+
+class RoutingSession(Session):
+    """
+    Session that sends plain SELECTs to a replica when `use_replicas` is set
+    and everything else (flushes, INSERT/UPDATE/DELETE, FOR UPDATE, raw SQL)
+    to the primary. After the first write the session stays on the primary,
+    so it reads its own changes.
+    """
+
+    def __init__(self, db_name=None, databases=None, use_replicas=False, **kwargs):
+        super().__init__(**kwargs)
+        self.db_name = db_name
+        self.databases = databases
+        self.use_replicas = use_replicas
+        self._replica = None
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if self.use_replicas:
+            if (clause is not None and not self._flushing and isinstance(clause, Select)
+                    and clause._for_update_arg is None):
+                if self._replica is None:
+                    # One replica per session keeps a request's reads consistent
+                    self._replica = self.databases.pick_replica(self.db_name) or False
+                if self._replica:
+                    return self._replica
+            elif clause is not None or self._flushing:
+                self.use_replicas = False
+        return super().get_bind(mapper=mapper, clause=clause, **kwargs)
+
+
+def _create_engine(url: str, consolidated: bool, **pool_options):
+    """
+    Engine that maps the models' schema tokens (see models.py) to real
+    schemas: one per logical database in consolidated mode, the database's
+    default schema otherwise. In consolidated mode the search_path also
+    covers every schema so hand-written SQL (partitions.py) finds its tables.
+    """
+    if consolidated:
+        search_path = ",".join(CONSOLIDATED_SCHEMAS.values())
+        engine = create_engine(url, connect_args={"options": f"-csearch_path={search_path}"}, **pool_options)
+        return engine.execution_options(schema_translate_map=dict(CONSOLIDATED_SCHEMAS))
+    engine = create_engine(url, **pool_options)
+    return engine.execution_options(schema_translate_map={token: None for token in CONSOLIDATED_SCHEMAS})
+
+
+class DatabaseSet:
+    """
+    Engines, replicas and session factories for one copy of the four logical
+    databases: the deployment's own (config.py) or a hosted school's
+    (tenants.py). With `consolidated_url` all four share one engine.
+    """
+
+    def __init__(self, name: str, urls: Dict[str, str], replica_urls: Optional[Dict[str, List[str]]] = None,
+                 consolidated_url: Optional[str] = None, consolidated_replica_urls: Optional[List[str]] = None,
+                 **pool_options):
+        self.name = name
+        self.consolidated = consolidated_url is not None
+        self.pool_options = pool_options
+        self.engines = {}
+        self.replica_engines = {}
+        self.session_factories = {}
+
+        if self.consolidated:
+            shared_engine = _create_engine(consolidated_url, True, **pool_options)
+            shared_replicas = [_create_engine(url, True, **pool_options) for url in consolidated_replica_urls or []]
+        for db_name, db_url in urls.items():
+            if self.consolidated:
+                self.engines[db_name] = shared_engine
+                self.replica_engines[db_name] = shared_replicas
+            else:
+                self.engines[db_name] = _create_engine(db_url, False, **pool_options)
+                self.replica_engines[db_name] = [_create_engine(url, False, **pool_options)
+                                                 for url in (replica_urls or {}).get(db_name, [])]
+            self.session_factories[db_name] = sessionmaker(
+                class_=RoutingSession, autocommit=False, autoflush=False,
+                bind=self.engines[db_name], db_name=db_name, databases=self,
+            )
+        self._replica_cycles = {db_name: itertools.cycle(range(len(replicas)))
+                                for db_name, replicas in self.replica_engines.items() if replicas}
+
+    def primary_engines(self) -> list:
+        """Each physical primary once (all four names share one in consolidated mode)"""
+        return list({id(engine): engine for engine in self.engines.values()}.values())
+
+    def all_engines(self) -> list:
+        replicas = [engine for engines in self.replica_engines.values() for engine in engines]
+        return list({id(engine): engine for engine in self.primary_engines() + replicas}.values())
+
+    def max_connections(self) -> int:
+        """Most connections this set's pools can hold open at once"""
+        per_engine = self.pool_options.get("pool_size", 5) + self.pool_options.get("max_overflow", 10)
+        return per_engine * len(self.all_engines())
+
+    def dispose(self, close: bool = True):
+        """
+        Drop every pooled connection (idle tenants, shutdown). A forked worker
+        passes close=False so it does not close sockets its parent still uses.
+        """
+        for engine in self.all_engines():
+            engine.dispose(close=close)
+
+    def pick_replica(self, db_name: str):
+        """A replica within the lag budget, round robin, or None to use the primary"""
+        replicas = self.replica_engines.get(db_name)
+        if not replicas:
+            return None
+        for _ in range(len(replicas)):
+            engine = replicas[next(self._replica_cycles[db_name])]
+            if _replica_usable(engine):
+                return engine
+        return None
+
+    def open_session(self, db_name: str, read_only: bool = False) -> RoutingSession:
+        """New session on `db_name`; read_only sessions may read from a replica"""
+        return self.session_factories[db_name](use_replicas=read_only and bool(self.replica_engines[db_name]))
+
+
+# The deployment's own databases. A request for a hosted school switches to
+# that school's set with use_databases() for its duration (see tenants.py).
+default_databases = DatabaseSet("default", DATABASE_CONFIGS, DATABASE_REPLICA_CONFIGS,
+                                CONSOLIDATED_DATABASE_URL if CONSOLIDATED else None, CONSOLIDATED_REPLICA_URLS)
+engines = default_databases.engines
+replica_engines = default_databases.replica_engines
+SessionLocals = default_databases.session_factories
+metadata = {db_name: MetaData() for db_name in DATABASE_CONFIGS}
+
+_current_databases: ContextVar[Optional[DatabaseSet]] = ContextVar("current_databases", default=None)
+
+
+def current_databases() -> DatabaseSet:
+    return _current_databases.get() or default_databases
 
-# Create engines for each database
-engines = {}
-SessionLocals = {}
-metadata = {}
 
-for db_name, db_url in DATABASE_CONFIGS.items():
-    engines[db_name] = create_engine(db_url)
-    SessionLocals[db_name] = sessionmaker(autocommit=False, autoflush=False, bind=engines[db_name])
-    metadata[db_name] = MetaData()
+def use_databases(databases: DatabaseSet):
+    """Make `databases` current in this context; pass the token to reset_databases()"""
+    return _current_databases.set(databases)
+
+
+def reset_databases(token):
+    _current_databases.reset(token)
+
+
+def is_consolidated() -> bool:
+    return current_databases().consolidated
 
 # Base classes for each database
 Base = declarative_base()
 
+
+def distinct_engines():
+    """Each physical primary of the current databases once"""
+    return current_databases().primary_engines()
+
+
+def create_all_tables(databases: Optional[DatabaseSet] = None):
+    databases = databases or current_databases()
+    for engine in databases.primary_engines():
+        if databases.consolidated:
+            with engine.begin() as conn:
+                for schema in CONSOLIDATED_SCHEMAS.values():
+                    conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {schema}"))
+        Base.metadata.create_all(bind=engine)
+
+
+# Replica health: engine -> (checked at, usable)
+_replica_health = {}
+_replica_lock = threading.Lock()
+
+
+def replica_lag(engine) -> float:
+    """Seconds the replica is behind its primary (0 when fully replayed)"""
+    with engine.connect() as conn:
+        lag = conn.execute(text(
+            "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+            "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+        )).scalar()
+    return float(lag or 0)
+
+
+def _replica_usable(engine) -> bool:
+    now = time.monotonic()
+    with _replica_lock:
+        checked = _replica_health.get(engine)
+        if checked and now - checked[0] < REPLICA_LAG_CHECK_SECONDS:
+            return checked[1]
+        # Hold the previous verdict while this thread re-checks
+        _replica_health[engine] = (now, checked[1] if checked else True)
+    try:
+        usable = replica_lag(engine) <= REPLICA_MAX_LAG_SECONDS
+    except Exception:
+        usable = False
+    with _replica_lock:
+        _replica_health[engine] = (time.monotonic(), usable)
+    return usable
+
+
+def pick_replica(db_name):
+    return current_databases().pick_replica(db_name)
+
+
+def open_session(db_name: str, read_only: bool = False) -> RoutingSession:
+    """New session on `db_name` of the current databases; read_only sessions may read from a replica"""
+    return current_databases().open_session(db_name, read_only)
+
+
+def open_request_session(db_name: str, request: Request) -> RoutingSession:
+    """
+    Session for a request. GET/HEAD requests read from replicas unless the
+    caller posted something within READ_YOUR_WRITES_SECONDS (the redirect
+    after a form submit must show the new row); other methods use the primary
+    and start that window.
+    """
+    databases = current_databases()
+    if not any(databases.replica_engines.values()):
+        return databases.open_session(db_name)
+    now = int(time.time())
+    if request.method in ("GET", "HEAD"):
+        return databases.open_session(db_name, read_only=request.session.get("primary_until", 0) < now)
+    request.session["primary_until"] = now + READ_YOUR_WRITES_SECONDS
+    return databases.open_session(db_name)
+
+
 # Dependency functions for each database
-def get_student_db():
-    db = SessionLocals["student"]()
+def get_student_db(request: Request):
+    db = open_request_session("student", request)
     try:
         yield db
     finally:
         db.close()
 
-def get_teacher_db():
-    db = SessionLocals["teacher"]()
+def get_teacher_db(request: Request):
+    db = open_request_session("teacher", request)
     try:
         yield db
     finally:
         db.close()
 
-def get_authority_db():
-    db = SessionLocals["authority"]()
+def get_authority_db(request: Request):
+    db = open_request_session("authority", request)
     try:
         yield db
     finally:
         db.close()
 
-def get_public_db():
-    db = SessionLocals["public"]()
+def get_public_db(request: Request):
+    db = open_request_session("public", request)
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
@@ -0,0 +1,53 @@
+"""
+Data exports run as background jobs (see jobs.py). Each writes a file to
+JOB_OUTPUT_DIR (a subdirectory per hosted school, whose job ids overlap) and
+returns its name; /jobs/{id}/download serves it to the user who queued it.
+"""
+
+import csv
+import os
+from typing import Optional
+
+from config import JOB_OUTPUT_DIR
+from database import current_databases, open_session
+from jobs import JobContext, job
+from repositories.sharded_student_repository import student_repository
+
+
+def output_root() -> str:
+    """JOB_OUTPUT_DIR for the deployment's own databases, a subdirectory per hosted school"""
+    name = current_databases().name
+    return JOB_OUTPUT_DIR if name == "default" else os.path.join(JOB_OUTPUT_DIR, "tenants", name)
+
+
+def output_file(job_id: int, name: str) -> str:
+    return os.path.join(output_root(), f"{job_id}-{name}")
+
+
+def output_path(job_id: int, name: str) -> str:
+    """output_file(), creating its directory for writing"""
+    os.makedirs(output_root(), exist_ok=True)
+    return output_file(job_id, name)
+
+
+@job("students.export")
+def export_students(ctx: JobContext, grade: Optional[str] = None):
+    """Student directory as CSV, streamed from the database in batches"""
+    db = open_session("student", read_only=True)
+    repo = student_repository(db)
+    try:
+        total = repo.count_students(grade)
+        name = f"students-{grade}.csv" if grade else "students.csv"
+        with open(output_path(ctx.job_id, name), "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["Student ID", "First name", "Last name", "Grade", "Section"])
+            for done, student in enumerate(repo.iter_students(grade=grade), 1):
+                writer.writerow([student.student_id, student.first_name, student.last_name,
+                                 student.grade, student.section])
+                if done % 1000 == 0:
+                    ctx.progress(done / max(total, 1), f"{done} of {total} students")
+        return {"file": name}
+    finally:
+        if hasattr(repo, "close"):
+            repo.close()
+        db.close()
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Grading policies.
+
+A policy is a scale of grade bands (the lowest percentage that earns each
+grade) for one academic year, either for every exam type or for one exam
+type only. Saving a scale adds a new version and retires the previous one,
+so earlier scales stay on record. Grades are computed on the server when
+marks are recorded (grade_for): the exam type's own policy for the exam
+date's academic year, else the year-wide policy, else DEFAULT_GRADE_BANDS.
+
+A regrade applies the year's current policies to all of its student_marks
+inside the database. The band lookup is the same in both places: bisect
+over the band thresholds in Python, width_bucket() over the same thresholds
+in SQL, so a whole chunk of rows is graded by one UPDATE instead of row by
+row. Chunks are REGRADE_CHUNK_ROWS ids, each committed on its own, and rows
+whose grade would not change are not written.
+
+    python grading.py show 2024-2025
+    python grading.py regrade 2024-2025     # without the queue
+"""
+
+import argparse
+from bisect import bisect_right
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import Float, String, case, cast, func, literal
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.orm import Session
+
+from academic_calendar import academic_year_bounds, academic_year_of
+from cache import TTLCache
+from config import DEFAULT_GRADE_BANDS, GRADING_CACHE_SECONDS, REGRADE_CHUNK_ROWS
+from database import current_databases, open_session
+from jobs import JobContext, job
+from models import StudentMarks
+from repositories.grading_repository import GradingRepository
+from repositories.sharded_student_repository import student_repository
+
+
+@dataclass(frozen=True)
+class GradeScale:
+    """grades[0] is earned from 0%, grades[i] from thresholds[i - 1]; thresholds ascend"""
+    thresholds: Tuple[float, ...]
+    grades: Tuple[str, ...]
+
+    @classmethod
+    def from_bands(cls, bands: Iterable[Tuple[float, str]]) -> "GradeScale":
+        """Scale from (lowest percentage, grade) pairs in any order; ValueError if they do not cover 0-100%"""
+        ordered = sorted((float(min_percent), (grade or "").strip()) for min_percent, grade in bands)
+        if not ordered or ordered[0][0] != 0:
+            raise ValueError("The lowest band must start at 0%")
+        minimums = [min_percent for min_percent, _ in ordered]
+        if len(set(minimums)) != len(minimums):
+            raise ValueError("Two bands start at the same percentage")
+        if minimums[-1] > 100:
+            raise ValueError("A band cannot start above 100%")
+        if not all(grade for _, grade in ordered):
+            raise ValueError("Every band needs a grade")
+        return cls(tuple(minimums[1:]), tuple(grade for _, grade in ordered))
+
+    @property
+    def bands(self) -> List[Tuple[float, str]]:
+        """(lowest percentage, grade), best grade first"""
+        return list(zip((0.0,) + self.thresholds, self.grades))[::-1]
+
+    def grade(self, obtained: Optional[float], total: Optional[float]) -> Optional[str]:
+        if obtained is None or not total or total <= 0:
+            return None
+        # Same arithmetic, in the same order, as sql() so both agree at the boundaries
+        return self.grades[bisect_right(self.thresholds, obtained * 100.0 / total)]
+
+    def sql(self):
+        """grade() of a student_marks row as a SQL expression"""
+        if not self.thresholds:
+            return literal(self.grades[0])
+        percent = StudentMarks.marks_obtained * 100.0 / StudentMarks.total_marks
+        # width_bucket() counts the thresholds <= percent, like bisect_right;
+        # Postgres arrays are 1-based
+        bucket = func.width_bucket(percent, cast(list(self.thresholds), ARRAY(Float)))
+        return cast(list(self.grades), ARRAY(String))[bucket + 1]
+
+
+DEFAULT_SCALE = GradeScale.from_bands(DEFAULT_GRADE_BANDS)
+
+# (school, academic year) -> {exam type or None: scale}
+_scales = TTLCache(GRADING_CACHE_SECONDS)
+
+
+def parse_bands(text: str) -> GradeScale:
+    """Scale from lines such as "90 A+" (lowest percentage, then grade); ValueError on bad input"""
+    bands = []
+    for line in (text or "").splitlines():
+        if not line.strip():
+            continue
+        parts = line.replace(":", " ").replace("%", " ").split(None, 1)
+        try:
+            bands.append((float(parts[0]), parts[1]))
+        except (ValueError, IndexError):
+            raise ValueError(f"Expected a percentage and a grade, got {line.strip()!r}")
+    return GradeScale.from_bands(bands)
+
+
+def year_scales(authority_db: Session, academic_year: str) -> Dict[Optional[str], GradeScale]:
+    """Scales of the year's active policies by exam type (None for the year-wide one)"""
+    def load():
+        return {
+            policy.exam_type: GradeScale.from_bands((band.min_percent, band.grade) for band in policy.bands)
+            for policy in GradingRepository(authority_db).get_active_policies(academic_year)
+        }
+    return _scales.get_or_set((current_databases().name, academic_year), load)
+
+
+def invalidate_scales(academic_year: str):
+    """Forget this process's cached scales after a policy change"""
+    _scales.invalidate((current_databases().name, academic_year))
+
+
+def scale_for(scales: Dict[Optional[str], GradeScale], exam_type: Optional[str]) -> GradeScale:
+    return scales.get(exam_type) or scales.get(None) or DEFAULT_SCALE
+
+
+def grade_for(authority_db: Session, exam_type: str, exam_date, obtained: float, total: float) -> Optional[str]:
+    """The grade for new marks under the policy of their exam's year and type"""
+    return scale_for(year_scales(authority_db, academic_year_of(exam_date)), exam_type).grade(obtained, total)
+
+
+def regrade_expression(scales: Dict[Optional[str], GradeScale]):
+    """One SQL grade expression for every exam type of a year"""
+    default = scales.get(None) or DEFAULT_SCALE
+    own = {exam_type: scale.sql() for exam_type, scale in scales.items() if exam_type is not None}
+    if not own:
+        return default.sql()
+    return case(own, value=StudentMarks.exam_type, else_=default.sql())
+
+
+@job("grading.regrade")
+def regrade_year(ctx: JobContext, academic_year: str):
+    """Recompute the grade of every mark in the academic year under its current policies"""
+    authority_db = open_session("authority")
+    student_db = open_session("student")
+    repo = student_repository(student_db)
+    try:
+        invalidate_scales(academic_year)
+        scales = year_scales(authority_db, academic_year)
+        authority_db.close()  # not needed while the marks are updated
+        start, end = academic_year_bounds(academic_year)
+        ctx.progress(0.0, f"Regrading {academic_year}", force=True)
+        updated = repo.regrade_marks(
+            regrade_expression(scales), start, end, REGRADE_CHUNK_ROWS,
+            lambda fraction, changed: ctx.progress(fraction, f"{changed} grades changed"),
+        )
+        return {"academic_year": academic_year, "updated": updated}
+    finally:
+        if hasattr(repo, "close"):
+            repo.close()
+        student_db.close()
+        authority_db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show grading scales or regrade an academic year's marks")
+    sub = parser.add_subparsers(dest="command", required=True)
+    show = sub.add_parser("show", help="Print the year's active grading scales")
+    show.add_argument("year", nargs="?", help="Academic year such as 2024-2025 (default: current)")
+    regrade = sub.add_parser("regrade", help="Recompute every grade of the year under its current policies")
+    regrade.add_argument("year", nargs="?", help="Academic year such as 2024-2025 (default: current)")
+    args = parser.parse_args()
+    academic_year = args.year or academic_year_of()
+
+    if args.command == "show":
+        db = open_session("authority", read_only=True)
+        try:
+            scales = year_scales(db, academic_year)
+        finally:
+            db.close()
+        if None not in scales:
+            scales = {None: DEFAULT_SCALE, **scales}
+        for exam_type, scale in scales.items():
+            bands = ", ".join(f"{grade} {min_percent:g}%" for min_percent, grade in scale.bands)
+            print(f"{exam_type or 'all exams'}: {bands}")
+        return
+
+    result = regrade_year(JobContext.standalone(), academic_year)
+    print(f"[SUCCESS] {result}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+Gunicorn settings for the production server; start it with `python serve.py`
+(or `gunicorn -c gunicorn.conf.py main:app`).
+
+The app is imported once in the master and forked into the workers, which
+run uvloop and httptools through serve.PortalWorker. Signals to the master:
+TERM/INT drain in-flight requests and stop, HUP restarts the workers one
+generation at a time, TTIN/TTOU add or remove a worker, and USR2 starts a
+new master with new code next to the old one (then TERM the old master).
+"""
+
+from config import (
+    WEB_BIND, WEB_WORKERS, WORKER_MAX_REQUESTS, WORKER_MAX_REQUESTS_JITTER, WORKER_GRACEFUL_TIMEOUT,
+)
+
+bind = WEB_BIND
+workers = WEB_WORKERS
+worker_class = "serve.PortalWorker"
+preload_app = True
+
+max_requests = WORKER_MAX_REQUESTS
+max_requests_jitter = WORKER_MAX_REQUESTS_JITTER
+graceful_timeout = WORKER_GRACEFUL_TIMEOUT
+timeout = 60
+keepalive = 5
+
+accesslog = "-"
+errorlog = "-"
+
+
+def on_starting(server):
+    # Tables and partitions once, before any worker exists
+    import main
+
+    if not main.registry.tenants:
+        main.create_tables()
+    main.tables_created = True
+    main.dispose_pools()
+
+
+def post_fork(server, worker):
+    # Pools copied from the master would share its sockets
+    import main
+
+    main.dispose_pools(close=False)
+
+
+def worker_exit(server, worker):
+    import main
+
+    main.dispose_pools()
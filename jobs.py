@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+Background jobs.
+
+Heavy work (imports, exports, report generation, regrading) is queued as a
+background_jobs row in the authority database and run by a JobWorker
+instead of inside a request. Handlers are plain functions registered with
+@job; I/O-bound ones run on a thread pool, CPU-bound ones
+(executor="process") on a process pool. Workers claim due jobs, highest
+priority first, with FOR UPDATE SKIP LOCKED, so every web process and any
+number of `python jobs.py worker` processes can share one queue. A failing
+job is retried with exponential backoff; a handler reports progress through
+its JobContext, which the submitter sees on /jobs.
+
+A claimed job is leased to its worker: the worker renews the lease of every
+job it runs every LEASE_RENEW_SECONDS, whether or not the handler reports
+progress, and jobs whose lease is older than JOB_LEASE_SECONDS (the worker
+died) are requeued. Progress and the final result are only written while the
+worker still holds that attempt's lease, so a worker that lost it never
+overwrites the attempt that replaced it.
+
+    @job("students.export")
+    def export_students(ctx: JobContext, grade=None):
+        ...
+        ctx.progress(done / total, f"{done} of {total} students")
+        return {"file": name}
+
+    JobRepository(authority_db).enqueue("students.export", {"grade": "10"}, submitted_by=user_id)
+
+Hosted schools (tenants.py) each need their own worker:
+`python jobs.py worker --tenant <slug>`.
+"""
+
+import argparse
+import importlib
+import logging
+import os
+import socket
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from multiprocessing import get_context
+from typing import Callable, Dict, Optional
+
+from config import JOB_THREADS, JOB_PROCESSES, JOB_POLL_SECONDS, JOB_MAX_ATTEMPTS, JOB_LEASE_SECONDS
+from database import DatabaseSet, default_databases, use_databases, reset_databases, open_session
+from repositories.job_repository import JobRepository, ClaimedJob
+
+logger = logging.getLogger(__name__)
+
+# Modules that register handlers, imported by standalone workers
+JOB_MODULES = ["exports", "reports", "timetable", "grading"]
+
+# Seconds between progress writes of one job
+PROGRESS_INTERVAL = 1.0
+# Seconds between lease renewals of a worker's running jobs
+LEASE_RENEW_SECONDS = JOB_LEASE_SECONDS / 5
+
+
+class LeaseLost(Exception):
+    """The job was requeued (its lease expired) while this attempt was still running"""
+
+
+@dataclass(frozen=True)
+class JobKind:
+    name: str
+    handler: Callable
+    executor: str  # "thread" or "process"
+    max_attempts: int
+    priority: int
+
+
+JOB_KINDS: Dict[str, JobKind] = {}
+
+
+def job(name: str, executor: str = "thread", max_attempts: int = JOB_MAX_ATTEMPTS, priority: int = 0):
+    """Register a module-level function as the handler for jobs of kind `name`"""
+    if executor not in ("thread", "process"):
+        raise ValueError(f"Unknown executor {executor!r}")
+
+    def register(handler: Callable) -> Callable:
+        JOB_KINDS[name] = JobKind(name, handler, executor, max_attempts, priority)
+        return handler
+    return register
+
+
+def enqueue(authority_db, kind: str, payload: Optional[dict] = None, submitted_by: Optional[int] = None,
+            priority: Optional[int] = None):
+    """Queue a job of a registered kind with that kind's defaults"""
+    job_kind = JOB_KINDS[kind]
+    return JobRepository(authority_db).enqueue(
+        kind, payload, submitted_by, job_kind.priority if priority is None else priority, job_kind.max_attempts
+    )
+
+
+@dataclass
+class JobContext:
+    """Handed to handlers; picklable so it crosses into worker processes"""
+    job_id: int
+    attempt: int
+    worker_id: Optional[str] = None  # None when the handler runs outside a worker
+    tenant: Optional[str] = None
+    _last_report: float = 0.0
+
+    @classmethod
+    def standalone(cls) -> "JobContext":
+        """Context for calling a handler directly (command line); there is no job row, progress is not written"""
+        return cls(job_id=0, attempt=1)
+
+    def progress(self, fraction: float, message: Optional[str] = None, force: bool = False):
+        """Report progress (at most every PROGRESS_INTERVAL); raises LeaseLost if the job was taken away"""
+        if self.worker_id is None:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_report < PROGRESS_INTERVAL:
+            return
+        self._last_report = now
+        db = open_session("authority")
+        try:
+            held = JobRepository(db).report_progress(self.job_id, self.worker_id, self.attempt, fraction, message)
+        finally:
+            db.close()
+        if not held:
+            raise LeaseLost(f"Job {self.job_id} attempt {self.attempt} lost its lease")
+
+
+_tenant_databases: Dict[str, DatabaseSet] = {}
+
+
+def _run_handler(handler: Callable, ctx: JobContext, payload: dict):
+    """Runs in the pool thread or process, on the job's school's databases"""
+    if ctx.tenant is None:
+        return handler(ctx, **payload)
+    databases = _tenant_databases.get(ctx.tenant)
+    if databases is None:
+        from tenants import registry
+
+        databases = _tenant_databases[ctx.tenant] = registry.tenants[ctx.tenant].open_databases()
+    token = use_databases(databases)
+    try:
+        return handler(ctx, **payload)
+    finally:
+        reset_databases(token)
+
+
+class JobWorker:
+    def __init__(self, databases: DatabaseSet = default_databases, tenant: Optional[str] = None,
+                 threads: int = JOB_THREADS, processes: int = JOB_PROCESSES, poll_seconds: float = JOB_POLL_SECONDS):
+        self.databases = databases
+        self.tenant = tenant
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.slots = {"thread": threads, "process": processes}
+        self.running = {"thread": 0, "process": 0}
+        self.poll_seconds = poll_seconds
+        self._executors = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._last_sweep = 0.0
+        # Claimed jobs by id, while their handler runs
+        self._active: Dict[int, ClaimedJob] = {}
+        self._heartbeat = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name="job-dispatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self, wait: bool = True):
+        """Stop claiming; with wait, let running jobs finish"""
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join()
+        for executor in self._executors.values():
+            executor.shutdown(wait=wait, cancel_futures=not wait)
+        # Running jobs keep their lease until the executors are done with them
+        self._stopped.set()
+
+    def run(self):
+        if self._heartbeat is None:
+            self._heartbeat = threading.Thread(target=self._renew_leases, name="job-heartbeat", daemon=True)
+            self._heartbeat.start()
+        while not self._stop.is_set():
+            try:
+                claimed = self.poll_once()
+            except Exception:
+                logger.exception("Job dispatcher failed to poll")
+                claimed = 0
+            if not claimed:
+                self._wake.wait(self.poll_seconds)
+                self._wake.clear()
+
+    def _renew_leases(self):
+        while not self._stopped.wait(LEASE_RENEW_SECONDS):
+            with self._lock:
+                active = list(self._active.values())
+            if not active:
+                continue
+            db = self.databases.open_session("authority")
+            try:
+                for job_id in JobRepository(db).renew_leases(self.worker_id, active):
+                    logger.warning("Job %s lost its lease while running", job_id)
+            except Exception:
+                logger.exception("Could not renew job leases")
+            finally:
+                db.close()
+
+    def poll_once(self) -> int:
+        claimed = 0
+        db = self.databases.open_session("authority")
+        try:
+            repo = JobRepository(db)
+            if time.monotonic() - self._last_sweep > JOB_LEASE_SECONDS / 2:
+                repo.requeue_stale()
+                self._last_sweep = time.monotonic()
+            for executor, slots in self.slots.items():
+                kinds = [kind.name for kind in JOB_KINDS.values() if kind.executor == executor]
+                with self._lock:
+                    free = slots - self.running[executor]
+                if free <= 0 or not kinds:
+                    continue
+                for claimed_job in repo.claim(self.worker_id, kinds, free):
+                    self._submit(executor, claimed_job)
+                    claimed += 1
+        finally:
+            db.close()
+        return claimed
+
+    def _executor(self, kind: str):
+        executor = self._executors.get(kind)
+        if executor is None:
+            if kind == "process":
+                # spawn: children start clean instead of inheriting this
+                # process's threads, locks and database connections
+                executor = ProcessPoolExecutor(self.slots["process"], mp_context=get_context("spawn"))
+            else:
+                executor = ThreadPoolExecutor(self.slots["thread"], thread_name_prefix="job")
+            self._executors[kind] = executor
+        return executor
+
+    def _submit(self, executor: str, claimed_job: ClaimedJob):
+        kind = JOB_KINDS[claimed_job.kind]
+        ctx = JobContext(claimed_job.id, claimed_job.attempts, self.worker_id, self.tenant)
+        with self._lock:
+            self.running[executor] += 1
+            self._active[claimed_job.id] = claimed_job
+        future = self._executor(executor).submit(_run_handler, kind.handler, ctx, claimed_job.payload)
+        future.add_done_callback(lambda done: self._finished(executor, claimed_job, done))
+
+    def _finished(self, executor: str, claimed_job: ClaimedJob, future):
+        db = self.databases.open_session("authority")
+        try:
+            repo = JobRepository(db)
+            try:
+                result = future.result()
+            except Exception as error:
+                logger.warning("Job %s (%s) attempt %s failed: %s", claimed_job.id, claimed_job.kind,
+                               claimed_job.attempts, error)
+                recorded = repo.fail(claimed_job, self.worker_id, "".join(traceback.format_exception(error))[-4000:])
+            else:
+                recorded = repo.finish(claimed_job, self.worker_id, result)
+            if not recorded:
+                logger.warning("Job %s attempt %s lost its lease, outcome discarded", claimed_job.id,
+                               claimed_job.attempts)
+        except Exception:
+            logger.exception("Could not record the outcome of job %s", claimed_job.id)
+        finally:
+            db.close()
+            with self._lock:
+                self.running[executor] -= 1
+                self._active.pop(claimed_job.id, None)
+            self._wake.set()
+
+
+def load_job_modules():
+    for module in JOB_MODULES:
+        importlib.import_module(module)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run background jobs")
+    sub = parser.add_subparsers(dest="command", required=True)
+    worker = sub.add_parser("worker", help="Run a worker until interrupted")
+    worker.add_argument("--tenant", help="Hosted school whose queue to work (tenants.py)")
+    worker.add_argument("--threads", type=int, default=JOB_THREADS)
+    worker.add_argument("--processes", type=int, default=JOB_PROCESSES)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    load_job_modules()
+    databases = default_databases
+    if args.tenant:
+        from tenants import registry
+
+        databases = registry.tenants[args.tenant].open_databases()
+    runner = JobWorker(databases, args.tenant, args.threads, args.processes)
+    print(f"[SUCCESS] Worker {runner.worker_id} running {', '.join(sorted(JOB_KINDS))}")
+    try:
+        runner.run()
+    except KeyboardInterrupt:
+        print("\nStopping, waiting for running jobs...")
+        runner.stop(wait=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,18 @@
 from fastapi import FastAPI, Request
 from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.middleware.sessions import SessionMiddleware
 from sqlalchemy import create_engine
 
-from config import SECRET_KEY, DATABASE_CONFIGS
-from database import Base, engines
-from routes import auth, students, teacher, authority
+from audit import audit_log
+from config import SECRET_KEY, DATABASE_CONFIGS, RUN_JOBS_IN_APP
+from database import engines, create_all_tables, default_databases
+from partitions import ensure_partitions
+from jobs import JobWorker
+from routes import auth, students, teacher, authority, jobs, notices, ops
+from shards import dispose_engines as dispose_shard_engines
+from snapshots import install_change_tracking
+from tenants import TenantMiddleware, registry
 
 # Initialize FastAPI app
 app = FastAPI(title="School Management Portal", version="1.0.0")
@@ -24,35 +29,77 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Pick the school for each request when several are hosted (outermost, so
+# sessions and everything below see the school's databases)
+app.add_middleware(TenantMiddleware)
+
 # Mount static files
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
-# Initialize templates
-templates = Jinja2Templates(directory="templates")
-
 # Create database tables
 def create_tables():
-    for db_name, engine in engines.items():
-        Base.metadata.create_all(bind=engine)
+    create_all_tables()
+    ensure_partitions(engines["student"])
+    for engine in default_databases.primary_engines():
+        install_change_tracking(engine)
+
+
+# Set by the production launcher (gunicorn.conf.py) once the master process
+# has created the tables, so workers do not race to do it again
+tables_created = False
+
+
+def dispose_pools(close: bool = True):
+    """Drop every database connection pool (worker fork and shutdown)"""
+    default_databases.dispose(close)
+    registry.dispose(close)
+    dispose_shard_engines(close)
 
 # Include routers
 app.include_router(auth.router, tags=["auth"])
 app.include_router(students.router, prefix="/student", tags=["students"])
 app.include_router(teacher.router, prefix="/teacher", tags=["teacher"])
 app.include_router(authority.router, prefix="/authority", tags=["authority"])
+app.include_router(jobs.router, prefix="/jobs", tags=["jobs"])
+app.include_router(notices.router, prefix="/notices", tags=["notices"])
+app.include_router(ops.router, prefix="/ops", tags=["ops"])
+
+# Background jobs for this school's queue (hosted schools run `python jobs.py worker --tenant`).
+# Built in the startup event, so each gunicorn worker forked from a preloaded
+# master gets its own worker_id (the id is what holds a job's lease)
+job_worker = None
 
 
 @app.on_event("startup")
 #@app.lifespan("startup")
 async def startup_event():
-    create_tables()
-    print("✅ Database tables created successfully")
+    global job_worker
+    if registry.tenants:
+        print(f"🏫 Hosting {len(registry.tenants)} schools (python tenants.py init creates their tables)")
+        registry.start_sweeper()
+    elif not tables_created:
+        create_tables()
+        print("✅ Database tables created successfully")
     print("🚀 School Management Portal is running!")
+    if RUN_JOBS_IN_APP and not registry.tenants:
+        job_worker = JobWorker()
+        job_worker.start()
     print("📚 Access the portal at: http://localhost:8000")
 
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    # Runs after in-flight requests have drained; unfinished jobs are
+    # requeued once their lease runs out
+    if job_worker:
+        job_worker.stop(wait=False)
+    audit_log.close()
+    dispose_pools()
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True)
+    # Development server; use serve.py in production
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
 
 # import sys
 # import os
@@ -1,10 +1,28 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, Text, ForeignKey, Boolean
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, BigInteger, String, Float, Numeric, Date, DateTime, Text, ForeignKey, Boolean, Index, UniqueConstraint, Computed
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.orm import deferred, relationship
+from config import NOTICE_SEARCH_LANGUAGE
 from database import Base
 from datetime import datetime
 
+# Every table carries the schema token of its logical database ("student",
+# "teacher", "authority", "public"). database.py translates the tokens: to
+# the default schema of each separate database in split mode, or to one
+# schema per logical database when DEPLOYMENT_MODE is "consolidated".
+
+class ChangeTracked:
+    """
+    Change tracking columns of every table. updated_at is kept by the ORM;
+    change_seq is set from a per-table sequence by a database trigger on
+    every insert and update (snapshots.py installs it), so bulk and raw SQL
+    writes are tracked too. Rows written before the trigger existed have no
+    change_seq.
+    """
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    change_seq = Column(BigInteger, index=True)
+
 # PUBLIC DATABASE MODELS
-class PublicUser(Base):
+class PublicUser(ChangeTracked, Base):
     __tablename__ = "public_users"
     __table_args__ = {'schema': 'public'}
     
@@ -17,8 +35,9 @@ class PublicUser(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
 
 # STUDENT DATABASE MODELS
-class Student(Base):
+class Student(ChangeTracked, Base):
     __tablename__ = "students"
+    __table_args__ = (Index("ix_students_grade_section", "grade", "section"), {"schema": "student"})
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, unique=True, index=True)  # Reference to PublicUser
@@ -31,38 +50,113 @@ class Student(Base):
     address = Column(Text)
     guardian_name = Column(String)
     guardian_phone = Column(String)
-    created_at = Column(DateTime, default=datetime.timezone.utcnow)
+    created_at = Column(DateTime, default=datetime.utcnow)
 
-class StudentMarks(Base):
+# Marks and attendance are range partitioned on their date column (see
+# partitions.py), so the date is part of the primary key
+class StudentMarks(ChangeTracked, Base):
     __tablename__ = "student_marks"
+    __table_args__ = (
+        Index("ix_student_marks_student_id_exam_date", "student_id", "exam_date"),
+        {"schema": "student", "postgresql_partition_by": "RANGE (exam_date)"},
+    )
     
-    id = Column(Integer, primary_key=True, index=True)
-    student_id = Column(Integer, ForeignKey("students.id"))
+    id = Column(Integer, primary_key=True, autoincrement=True, index=True)
+    student_id = Column(Integer, ForeignKey("student.students.id"))
     subject = Column(String)
     exam_type = Column(String)  # midterm, final, quiz
     marks_obtained = Column(Float)
     total_marks = Column(Float)
     grade = Column(String)
-    exam_date = Column(DateTime)
+    exam_date = Column(DateTime, primary_key=True)
     uploaded_by = Column(Integer)  # Teacher user_id
-    created_at = Column(DateTime, default=datetime.timezone.utcnow)
+    created_at = Column(DateTime, default=datetime.utcnow)
 
-class StudentAttendance(Base):
+class StudentAttendance(ChangeTracked, Base):
     __tablename__ = "student_attendance"
+    __table_args__ = (
+        Index("ix_student_attendance_student_id_date", "student_id", "date"),
+        {"schema": "student", "postgresql_partition_by": "RANGE (date)"},
+    )
     
-    id = Column(Integer, primary_key=True, index=True)
-    student_id = Column(Integer, ForeignKey("students.id"))
-    date = Column(DateTime)
+    id = Column(Integer, primary_key=True, autoincrement=True, index=True)
+    student_id = Column(Integer, ForeignKey("student.students.id"))
+    date = Column(DateTime, primary_key=True)
     status = Column(String)  # present, absent, late
     subject = Column(String)
     uploaded_by = Column(Integer)  # Teacher user_id
-    created_at = Column(DateTime, default=datetime.timezone.utcnow)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+# Compact attendance store (config ATTENDANCE_STORE = "bitmap"): one row per
+# student, subject and month with a 2-bit status per day packed into
+# `statuses`. Days recorded by someone other than `uploaded_by`, or with an
+# unusual status, are kept in attendance_exceptions.
+class AttendanceMonth(ChangeTracked, Base):
+    __tablename__ = "attendance_months"
+    __table_args__ = (UniqueConstraint("student_id", "subject", "month"), {"schema": "student"})
+    
+    id = Column(Integer, primary_key=True, index=True)
+    student_id = Column(Integer, ForeignKey("student.students.id"), index=True)
+    subject = Column(String)
+    month = Column(Date)  # first day of the month
+    statuses = Column(BigInteger, default=0)  # day d at bits 2*(d-1)
+    uploaded_by = Column(Integer)  # Teacher user_id for most days
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class AttendanceException(ChangeTracked, Base):
+    __tablename__ = "attendance_exceptions"
+    __table_args__ = {"schema": "student"}
+    
+    id = Column(Integer, primary_key=True, index=True)
+    month_id = Column(Integer, ForeignKey("student.attendance_months.id"), index=True)
+    day = Column(Integer)
+    status = Column(String)
+    uploaded_by = Column(Integer)
+
+# Rolling attendance windows for chronic absence alerts
+# (repositories/absence_repository.py). One row per student and subject, plus
+# subject "" for the student overall. Bit i of the masks is the school day i
+# days before `anchor`.
+class AttendanceWindow(ChangeTracked, Base):
+    __tablename__ = "attendance_windows"
+    __table_args__ = {"schema": "student"}
+
+    student_id = Column(Integer, ForeignKey("student.students.id"), primary_key=True)
+    subject = Column(String, primary_key=True)
+    anchor = Column(Integer, nullable=False)  # latest recorded school day (school_day())
+    recorded = Column(BigInteger, nullable=False, default=0)
+    attended = Column(BigInteger, nullable=False, default=0)
+    flagged = Column(Boolean, nullable=False, default=False)  # below the threshold, alert raised
+
+class AbsenceAlert(ChangeTracked, Base):
+    """A student's attendance in a window crossing below the threshold"""
+    __tablename__ = "absence_alerts"
+    __table_args__ = (
+        Index("ix_absence_alerts_student", "student_id", "subject"),
+        {"schema": "student"},
+    )
 
-class StudentAssignments(Base):
+    id = Column(Integer, primary_key=True, index=True)
+    student_id = Column(Integer, ForeignKey("student.students.id"), nullable=False)
+    subject = Column(String, nullable=False)  # "" for overall attendance
+    rate = Column(Float)  # attendance rate in the window when raised
+    recorded_days = Column(Integer)
+    raised_at = Column(DateTime, default=datetime.utcnow)
+    resolved_at = Column(DateTime, nullable=True)  # attendance back above the threshold
+    dismissed_by = Column(Integer, nullable=True)  # Authority user_id
+    dismissed_at = Column(DateTime, nullable=True)
+
+
+# Open alerts, newest first, for the dashboard
+Index("ix_absence_alerts_open", AbsenceAlert.raised_at.desc(),
+      postgresql_where=(AbsenceAlert.resolved_at.is_(None) & AbsenceAlert.dismissed_at.is_(None)))
+
+class StudentAssignments(ChangeTracked, Base):
     __tablename__ = "student_assignments"
+    __table_args__ = {"schema": "student"}
     
     id = Column(Integer, primary_key=True, index=True)
-    student_id = Column(Integer, ForeignKey("students.id"))
+    student_id = Column(Integer, ForeignKey("student.students.id"))
     assignment_title = Column(String)
     subject = Column(String)
     assignment_date = Column(DateTime)
@@ -70,11 +164,12 @@ class StudentAssignments(Base):
     status = Column(String)  # submitted, pending, overdue
     marks = Column(Float, nullable=True)
     uploaded_by = Column(Integer)  # Teacher user_id
-    created_at = Column(DateTime, default=datetime.timezone.utcnow)
+    created_at = Column(DateTime, default=datetime.utcnow)
 
 # TEACHER DATABASE MODELS
-class Teacher(Base):
+class Teacher(ChangeTracked, Base):
     __tablename__ = "teachers"
+    __table_args__ = {"schema": "teacher"}
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, unique=True, index=True)  # Reference to PublicUser
@@ -85,20 +180,70 @@ class Teacher(Base):
     phone = Column(String)
     qualification = Column(String)
     experience_years = Column(Integer)
-    created_at = Column(DateTime, default=datetime.timezone.utcnow)
+    created_at = Column(DateTime, default=datetime.utcnow)
 
-class TeacherSubjects(Base):
+class TeacherSubjects(ChangeTracked, Base):
     __tablename__ = "teacher_subjects"
+    __table_args__ = {"schema": "teacher"}
     
     id = Column(Integer, primary_key=True, index=True)
-    teacher_id = Column(Integer, ForeignKey("teachers.id"))
+    teacher_id = Column(Integer, ForeignKey("teacher.teachers.id"))
     subject_name = Column(String)
     grade = Column(String)
     section = Column(String)
 
+class SubjectPeriods(ChangeTracked, Base):
+    """Weekly periods of a subject in a grade, for timetable.py"""
+    __tablename__ = "subject_periods"
+    __table_args__ = (UniqueConstraint("grade", "subject_name"), {"schema": "teacher"})
+
+    id = Column(Integer, primary_key=True, index=True)
+    grade = Column(String, nullable=False)
+    subject_name = Column(String, nullable=False)
+    periods_per_week = Column(Integer, nullable=False)
+    room_type = Column(String, nullable=True)  # e.g. "lab"; None means the class's own room
+
+class TimetableRoom(ChangeTracked, Base):
+    """How many rooms of a shared type (labs, gym) exist"""
+    __tablename__ = "timetable_rooms"
+    __table_args__ = {"schema": "teacher"}
+
+    room_type = Column(String, primary_key=True)
+    rooms = Column(Integer, nullable=False)
+
+class TeacherUnavailability(ChangeTracked, Base):
+    """A period a teacher cannot teach (standing constraint or absence)"""
+    __tablename__ = "teacher_unavailability"
+    __table_args__ = (UniqueConstraint("teacher_id", "day", "period"), {"schema": "teacher"})
+
+    id = Column(Integer, primary_key=True, index=True)
+    teacher_id = Column(Integer, ForeignKey("teacher.teachers.id"), nullable=False)
+    day = Column(Integer, nullable=False)  # 0 = first day of the week
+    period = Column(Integer, nullable=False)  # 0 = first period of the day
+    reason = Column(String, nullable=True)
+
+class TimetableEntry(ChangeTracked, Base):
+    """One lesson of the weekly timetable, written by timetable.py"""
+    __tablename__ = "timetable_entries"
+    __table_args__ = (
+        UniqueConstraint("grade", "section", "day", "period"),
+        Index("ix_timetable_entries_teacher", "teacher_id", "day", "period"),
+        {"schema": "teacher"},
+    )
+
+    id = Column(Integer, primary_key=True)
+    grade = Column(String, nullable=False)
+    section = Column(String, nullable=True)
+    day = Column(Integer, nullable=False)
+    period = Column(Integer, nullable=False)
+    subject_name = Column(String, nullable=False)
+    teacher_id = Column(Integer, ForeignKey("teacher.teachers.id"), nullable=False)
+    room_type = Column(String, nullable=True)
+
 # AUTHORITY DATABASE MODELS
-class Authority(Base):
+class Authority(ChangeTracked, Base):
     __tablename__ = "authorities"
+    __table_args__ = {"schema": "authority"}
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, unique=True, index=True)  # Reference to PublicUser
@@ -106,10 +251,20 @@ class Authority(Base):
     last_name = Column(String)
     position = Column(String)  # Principal, Vice Principal, Admin
     phone = Column(String)
-    created_at = Column(DateTime, default=datetime.timezone.utcnow)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+# Full-text search document of a notice; title words rank above body words
+NOTICE_SEARCH_VECTOR = (
+    f"setweight(to_tsvector('{NOTICE_SEARCH_LANGUAGE}', coalesce(title, '')), 'A') || "
+    f"setweight(to_tsvector('{NOTICE_SEARCH_LANGUAGE}', coalesce(content, '')), 'B')"
+)
 
-class SchoolNotices(Base):
+class SchoolNotices(ChangeTracked, Base):
     __tablename__ = "school_notices"
+    __table_args__ = (
+        Index("ix_school_notices_search", "search_vector", postgresql_using="gin"),
+        {"schema": "authority"},
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String)
@@ -118,11 +273,77 @@ class SchoolNotices(Base):
     target_audience = Column(String)  # all, students, teachers
     is_active = Column(Boolean, default=True)
     created_by = Column(Integer)  # Authority user_id
-    created_at = Column(DateTime, default=datetime.timezone.utcnow)
+    created_at = Column(DateTime, default=datetime.utcnow)
     expires_at = Column(DateTime, nullable=True)
+    # Generated by Postgres on every insert and update; not loaded with the row
+    search_vector = deferred(Column(TSVECTOR, Computed(NOTICE_SEARCH_VECTOR, persisted=True)))
+
+class NoticeAudienceCount(ChangeTracked, Base):
+    """Active notices per target_audience, kept up to date by notice_repository.py"""
+    __tablename__ = "notice_audience_counts"
+    __table_args__ = {"schema": "authority"}
+
+    audience = Column(String, primary_key=True)  # all, students, teachers
+    active = Column(Integer, default=0, nullable=False)
+
+class NoticeReadState(ChangeTracked, Base):
+    """
+    What a user has read: every notice up to `watermark` (set by mark all
+    read) plus the NoticeReceipts above it. `read_count` is how many of the
+    active notices for the user's audiences that covers.
+    """
+    __tablename__ = "notice_read_states"
+    __table_args__ = {"schema": "authority"}
+
+    user_id = Column(Integer, primary_key=True)  # PublicUser id
+    role = Column(String, nullable=False, index=True)
+    watermark = Column(Integer, default=0, nullable=False)  # SchoolNotices id
+    read_count = Column(Integer, default=0, nullable=False)
+
+class NoticeReceipt(ChangeTracked, Base):
+    """A notice read individually; only kept for notices above the reader's watermark"""
+    __tablename__ = "notice_receipts"
+    __table_args__ = {"schema": "authority"}
+
+    user_id = Column(Integer, primary_key=True)
+    notice_id = Column(Integer, ForeignKey("authority.school_notices.id", ondelete="CASCADE"), primary_key=True,
+                       index=True)
+    read_at = Column(DateTime, default=datetime.utcnow)
+
+# Grading scales (grading.py). Each change to a year's scale for an exam type
+# is a new version; the active one grades new marks and regrades.
+class GradingPolicy(ChangeTracked, Base):
+    __tablename__ = "grading_policies"
+    __table_args__ = (
+        UniqueConstraint("academic_year", "exam_type", "version"),
+        Index("ix_grading_policies_active", "academic_year", "exam_type", "is_active"),
+        {"schema": "authority"},
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    academic_year = Column(String, nullable=False)
+    exam_type = Column(String, nullable=True)  # None: every exam type without a policy of its own
+    version = Column(Integer, nullable=False)
+    is_active = Column(Boolean, default=True)
+    created_by = Column(Integer)  # Authority user_id
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    bands = relationship("GradeBand", order_by="GradeBand.min_percent", cascade="all, delete-orphan",
+                         lazy="selectin")
 
-class FeeStructure(Base):
+class GradeBand(ChangeTracked, Base):
+    """A grade and the lowest percentage that earns it"""
+    __tablename__ = "grade_bands"
+    __table_args__ = (UniqueConstraint("policy_id", "min_percent"), {"schema": "authority"})
+
+    id = Column(Integer, primary_key=True, index=True)
+    policy_id = Column(Integer, ForeignKey("authority.grading_policies.id", ondelete="CASCADE"), nullable=False)
+    min_percent = Column(Float, nullable=False)
+    grade = Column(String, nullable=False)
+
+class FeeStructure(ChangeTracked, Base):
     __tablename__ = "fee_structure"
+    __table_args__ = {"schema": "authority"}
     
     id = Column(Integer, primary_key=True, index=True)
     grade = Column(String)
@@ -131,4 +352,99 @@ class FeeStructure(Base):
     academic_year = Column(String)
     is_active = Column(Boolean, default=True)
     created_by = Column(Integer)  # Authority user_id
-    created_at = Column(DateTime, default=datetime.timezone.utcnow)
\ No newline at end of file
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+# Fee invoicing (repositories/fee_repository.py). Amounts are exact decimals;
+# student_id is Student.id in the student database.
+class FeeInvoice(ChangeTracked, Base):
+    __tablename__ = "fee_invoices"
+    __table_args__ = (
+        # One invoice per student and fee line, so regenerating a year is a no-op
+        UniqueConstraint("student_id", "fee_structure_id"),
+        {"schema": "authority"},
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    student_id = Column(Integer, nullable=False)
+    fee_structure_id = Column(Integer, ForeignKey("authority.fee_structure.id"), nullable=False)
+    grade = Column(String)
+    fee_type = Column(String)
+    academic_year = Column(String, index=True)
+    amount = Column(Numeric(12, 2), nullable=False)
+    due_date = Column(Date, nullable=True)
+    issued_by = Column(Integer)  # Authority user_id
+    issued_at = Column(DateTime, default=datetime.utcnow)
+
+class FeePayment(ChangeTracked, Base):
+    __tablename__ = "fee_payments"
+    __table_args__ = {"schema": "authority"}
+
+    id = Column(Integer, primary_key=True, index=True)
+    student_id = Column(Integer, nullable=False, index=True)
+    invoice_id = Column(Integer, ForeignKey("authority.fee_invoices.id"), nullable=True)
+    amount = Column(Numeric(12, 2), nullable=False)
+    method = Column(String)  # cash, card, bank transfer, etc
+    reference = Column(String, nullable=True)
+    received_by = Column(Integer)  # Authority user_id
+    paid_at = Column(DateTime, default=datetime.utcnow)
+
+class StudentFeeBalance(ChangeTracked, Base):
+    """Running totals per student, kept up to date by every invoice run and payment"""
+    __tablename__ = "student_fee_balances"
+    __table_args__ = {"schema": "authority"}
+
+    student_id = Column(Integer, primary_key=True)
+    invoiced = Column(Numeric(12, 2), default=0, nullable=False)
+    paid = Column(Numeric(12, 2), default=0, nullable=False)
+    balance = Column(Numeric(12, 2), default=0, nullable=False, index=True)  # invoiced - paid
+
+class AuditLog(ChangeTracked, Base):
+    """Append-only history of writes, filled in batches by audit.py"""
+    __tablename__ = "audit_log"
+    __table_args__ = (
+        Index("ix_audit_log_entity", "entity", "entity_id", "occurred_at"),
+        Index("ix_audit_log_actor", "actor_id", "occurred_at"),
+        {"schema": "authority"},
+    )
+
+    id = Column(BigInteger, primary_key=True)
+    occurred_at = Column(DateTime, nullable=False, index=True)
+    actor_id = Column(Integer, nullable=True)  # PublicUser id
+    actor_role = Column(String, nullable=True)
+    action = Column(String, nullable=False)  # e.g. "notice.toggle"
+    entity = Column(String, nullable=False)  # table name
+    entity_id = Column(String, nullable=True)
+    before = Column(Text, nullable=True)  # JSON of the changed fields
+    after = Column(Text, nullable=True)  # JSON
+
+class BackgroundJob(ChangeTracked, Base):
+    """Queued work for jobs.py; workers claim rows with FOR UPDATE SKIP LOCKED"""
+    __tablename__ = "background_jobs"
+    __table_args__ = (
+        Index("ix_background_jobs_submitted_by", "submitted_by", "created_at"),
+        {"schema": "authority"},
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String, nullable=False)
+    payload = Column(Text)  # JSON keyword arguments for the handler
+    status = Column(String, default="queued", nullable=False)  # queued, running, succeeded, failed
+    priority = Column(Integer, default=0, nullable=False)  # higher runs first
+    attempts = Column(Integer, default=0, nullable=False)
+    max_attempts = Column(Integer, default=3, nullable=False)
+    run_after = Column(DateTime, default=datetime.utcnow, nullable=False)
+    locked_by = Column(String, nullable=True)
+    locked_at = Column(DateTime, nullable=True)
+    progress = Column(Float, default=0.0)  # 0 to 1
+    progress_message = Column(String, nullable=True)
+    result = Column(Text, nullable=True)  # JSON
+    error = Column(Text, nullable=True)
+    submitted_by = Column(Integer, nullable=True)  # PublicUser id
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+
+# Claim order; the partial index only holds jobs still waiting
+Index("ix_background_jobs_queue", BackgroundJob.priority.desc(), BackgroundJob.id,
+      postgresql_where=BackgroundJob.status == "queued")
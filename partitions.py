@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+Range partition maintenance for student_attendance and student_marks.
+
+Both tables are declared PARTITION BY RANGE on their date column in
+models.py. Partitions are monthly or per academic year (config
+PARTITIONED_TABLES) and are created automatically: on startup for the
+current period plus PARTITION_MONTHS_AHEAD, and on demand by the
+repository before inserting a row for a period that has none yet. A
+DEFAULT partition catches anything else so inserts never fail.
+
+    python partitions.py ensure
+    python partitions.py list student_attendance
+    python partitions.py detach student_attendance student_attendance_2023_04 --archive-schema archive
+    python partitions.py migrate student_attendance     # convert an existing heap table
+"""
+
+import argparse
+import threading
+import time
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+from academic_calendar import academic_year_of, academic_year_bounds
+from config import (
+    PARTITIONED_TABLES, PARTITION_MONTHS_AHEAD, PARTITION_DETACH_LOCK_TIMEOUT_MS, PARTITION_DETACH_RETRIES,
+)
+
+# table -> partition key column
+PARTITION_COLUMNS = {
+    "student_attendance": "date",
+    "student_marks": "exam_date",
+}
+
+# (engine url, partition name) pairs known to exist, so the insert path
+# only pays for a catalog lookup once per period per process
+_known_partitions = set()
+_partitioned_tables = {}
+_lock = threading.Lock()
+
+
+def _add_months(when: datetime, months: int) -> datetime:
+    month = when.month - 1 + months
+    return datetime(when.year + month // 12, month % 12 + 1, 1)
+
+
+def partition_for(table: str, when: datetime) -> Tuple[str, datetime, datetime]:
+    """Name and [start, end) bounds of the partition holding `when`"""
+    if PARTITIONED_TABLES[table] == "year":
+        academic_year = academic_year_of(when)
+        start, end = academic_year_bounds(academic_year)
+        return f"{table}_ay{start.year}", start, end
+    start = datetime(when.year, when.month, 1)
+    return f"{table}_{start.year}_{start.month:02d}", start, _add_months(start, 1)
+
+
+def is_partitioned(conn, table: str) -> bool:
+    """Whether the live table is a partitioned parent (not a legacy heap)"""
+    return conn.execute(text(
+        "SELECT 1 FROM pg_partitioned_table pt JOIN pg_class c ON c.oid = pt.partrelid "
+        "WHERE c.relname = :table AND pg_table_is_visible(c.oid)"
+    ), {"table": table}).first() is not None
+
+
+def list_partitions(conn, table: str) -> List[Tuple[str, str]]:
+    """(partition name, bound expression) for every attached partition"""
+    return [tuple(row) for row in conn.execute(text(
+        "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) "
+        "FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid "
+        "JOIN pg_class p ON p.oid = i.inhparent "
+        "WHERE p.relname = :table AND pg_table_is_visible(p.oid) "
+        "ORDER BY c.relname"
+    ), {"table": table})]
+
+
+def _create_partition(conn, table: str, name: str, start: datetime, end: datetime):
+    column = PARTITION_COLUMNS[table]
+    create = (f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {table} "
+              f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')")
+    savepoint = conn.begin_nested()
+    try:
+        conn.execute(text(create))
+        savepoint.commit()
+        return
+    except IntegrityError:
+        savepoint.rollback()
+
+    # The DEFAULT partition already holds rows for this range. Move them
+    # into the new partition while the default is detached.
+    default = f"{table}_default"
+    conn.execute(text(f"ALTER TABLE {table} DETACH PARTITION {default}"))
+    conn.execute(text(create))
+    where = f"{column} >= :start AND {column} < :end"
+    conn.execute(text(f"INSERT INTO {table} SELECT * FROM {default} WHERE {where}"),
+                 {"start": start, "end": end})
+    conn.execute(text(f"DELETE FROM {default} WHERE {where}"), {"start": start, "end": end})
+    conn.execute(text(f"ALTER TABLE {table} ATTACH PARTITION {default} DEFAULT"))
+
+
+def ensure_partition(engine: Engine, table: str, when: datetime) -> Optional[str]:
+    """Create the partition covering `when` if it does not exist yet"""
+    name, start, end = partition_for(table, when)
+    key = (str(engine.url), name)
+    if key in _known_partitions:
+        return name
+
+    with _lock:
+        if key in _known_partitions:
+            return name
+        with engine.begin() as conn:
+            partitioned = _partitioned_tables.get((str(engine.url), table))
+            if partitioned is None:
+                partitioned = is_partitioned(conn, table)
+                _partitioned_tables[(str(engine.url), table)] = partitioned
+            if not partitioned:
+                # Legacy heap table, nothing to do until it is migrated
+                return None
+            existing = {partition for partition, _ in list_partitions(conn, table)}
+            if name not in existing:
+                _create_partition(conn, table, name, start, end)
+            if f"{table}_default" not in existing:
+                conn.execute(text(f"CREATE TABLE IF NOT EXISTS {table}_default PARTITION OF {table} DEFAULT"))
+        _known_partitions.add(key)
+    return name
+
+
+def ensure_partitions(engine: Engine, when: Optional[datetime] = None, months_ahead: int = PARTITION_MONTHS_AHEAD):
+    """Create partitions for the current period and the next few months"""
+    when = when or datetime.utcnow()
+    for table in PARTITIONED_TABLES:
+        for offset in range(months_ahead + 1):
+            ensure_partition(engine, table, _add_months(datetime(when.year, when.month, 1), offset))
+
+
+def ensure_range(engine: Engine, table: str, start: datetime, end: datetime):
+    """Create every partition overlapping [start, end], for bulk loads"""
+    when = datetime(start.year, start.month, 1)
+    while when <= end:
+        ensure_partition(engine, table, when)
+        when = _add_months(when, 1)
+
+
+def detach_partition(engine: Engine, table: str, partition: str, archive_schema: Optional[str] = None):
+    """
+    Detach a partition without stalling the live table. DETACH ...
+    CONCURRENTLY is not allowed while the table has a DEFAULT partition,
+    which ensure_partition() always creates, so this uses a plain DETACH
+    under a short lock_timeout instead. The ACCESS EXCLUSIVE lock is held
+    only for the catalog change; if it cannot be had within
+    PARTITION_DETACH_LOCK_TIMEOUT_MS (a long query is running) the attempt
+    gives up rather than queueing every other query behind it, and is
+    retried up to PARTITION_DETACH_RETRIES times. The detached table can
+    then be moved to an archive schema, dumped or dropped independently.
+    """
+    for attempt in range(1, PARTITION_DETACH_RETRIES + 1):
+        try:
+            with engine.begin() as conn:
+                conn.execute(text(f"SET LOCAL lock_timeout = {int(PARTITION_DETACH_LOCK_TIMEOUT_MS)}"))
+                conn.execute(text(f"ALTER TABLE {table} DETACH PARTITION {partition}"))
+            break
+        except OperationalError as e:
+            # lock_not_available: try again after the blocking query
+            if getattr(e.orig, "pgcode", None) != "55P03" or attempt == PARTITION_DETACH_RETRIES:
+                raise
+            time.sleep(min(attempt, 5))
+    if archive_schema:
+        with engine.begin() as conn:
+            conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {archive_schema}"))
+            conn.execute(text(f"ALTER TABLE {partition} SET SCHEMA {archive_schema}"))
+    _known_partitions.discard((str(engine.url), partition))
+
+
+def migrate_table(engine: Engine, table: str) -> int:
+    """
+    Convert an existing heap table into the partitioned layout in one
+    transaction: build a partitioned copy, create partitions covering the
+    data, copy the rows, then swap the names and drop the heap.
+    """
+    column = PARTITION_COLUMNS[table]
+    staging = f"{table}_partitioned"
+    with engine.begin() as conn:
+        if is_partitioned(conn, table):
+            return 0
+        columns = [row[0] for row in conn.execute(text(
+            "SELECT column_name FROM information_schema.columns "
+            "WHERE table_name = :table AND table_schema = current_schema() ORDER BY ordinal_position"
+        ), {"table": table})]
+        low, high, total = conn.execute(text(
+            f"SELECT min(coalesce({column}, created_at)), max(coalesce({column}, created_at)), count(*) FROM {table}"
+        )).one()
+
+        conn.execute(text(f"CREATE TABLE {staging} (LIKE {table} INCLUDING DEFAULTS) PARTITION BY RANGE ({column})"))
+        conn.execute(text(f"ALTER TABLE {staging} ADD PRIMARY KEY (id, {column})"))
+        conn.execute(text(f"CREATE TABLE {table}_default PARTITION OF {staging} DEFAULT"))
+        if low is not None:
+            month = datetime(low.year, low.month, 1)
+            while month <= high:
+                name, start, end = partition_for(table, month)
+                conn.execute(text(
+                    f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {staging} "
+                    f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+                ))
+                month = end
+
+        select_list = ", ".join(
+            f"coalesce({name}, created_at)" if name == column else name for name in columns
+        )
+        conn.execute(text(f"INSERT INTO {staging} ({', '.join(columns)}) SELECT {select_list} FROM {table}"))
+        copied = conn.execute(text(f"SELECT count(*) FROM {staging}")).scalar()
+        if copied != total:
+            raise RuntimeError(f"Copied {copied} of {total} rows from {table}, aborting")
+
+        # Keep the id sequence, it is owned by the heap's column
+        sequence = conn.execute(text("SELECT pg_get_serial_sequence(:table, 'id')"), {"table": table}).scalar()
+        conn.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY NONE"))
+        conn.execute(text(f"DROP TABLE {table}"))
+        conn.execute(text(f"ALTER TABLE {staging} RENAME TO {table}"))
+        conn.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY {table}.id"))
+        conn.execute(text(f"ALTER TABLE {table} RENAME CONSTRAINT {staging}_pkey TO {table}_pkey"))
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_{table}_id ON {table} (id)"))
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_{table}_student_id_{column} ON {table} (student_id, {column})"))
+        conn.execute(text(
+            f"ALTER TABLE {table} ADD FOREIGN KEY (student_id) REFERENCES students (id)"
+        ))
+
+    _partitioned_tables.pop((str(engine.url), table), None)
+    return total
+
+
+def main():
+    from database import engines
+
+    parser = argparse.ArgumentParser(description="Manage attendance and marks partitions")
+    sub = parser.add_subparsers(dest="command", required=True)
+    ensure = sub.add_parser("ensure", help="Create current and upcoming partitions")
+    ensure.add_argument("--months-ahead", type=int, default=PARTITION_MONTHS_AHEAD)
+    listing = sub.add_parser("list", help="List partitions of a table")
+    listing.add_argument("table", choices=list(PARTITIONED_TABLES))
+    detach = sub.add_parser("detach", help="Detach an old partition (short lock, retried)")
+    detach.add_argument("table", choices=list(PARTITIONED_TABLES))
+    detach.add_argument("partition")
+    detach.add_argument("--archive-schema", help="Move the detached table into this schema")
+    migrate = sub.add_parser("migrate", help="Convert an existing heap table to partitions")
+    migrate.add_argument("table", choices=list(PARTITIONED_TABLES))
+    args = parser.parse_args()
+
+    engine = engines["student"]
+    if args.command == "ensure":
+        ensure_partitions(engine, months_ahead=args.months_ahead)
+        print("[SUCCESS] Partitions are in place")
+    elif args.command == "list":
+        with engine.connect() as conn:
+            for name, bound in list_partitions(conn, args.table):
+                print(f"{name:<40} {bound}")
+    elif args.command == "detach":
+        detach_partition(engine, args.table, args.partition, args.archive_schema)
+        print(f"[SUCCESS] Detached {args.partition}")
+    elif args.command == "migrate":
+        rows = migrate_table(engine, args.table)
+        print(f"[SUCCESS] {args.table} is partitioned ({rows} rows moved)")
+
+
+if __name__ == "__main__":
+    main()
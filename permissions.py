@@ -0,0 +1,74 @@
+"""
+Role and class-scope checks for the routers.
+
+Routers declare who may use them with require_role(); the decision (is
+the session's user still active and in that role) is made once per request
+and cached per user for AUTH_CACHE_SECONDS, so the hot path adds no
+queries. Teacher writes are further limited to the teacher's classes with
+require_class_scope(), which reuses the cached roster.
+"""
+
+from dataclasses import dataclass
+from typing import Optional
+
+from fastapi import Depends, HTTPException, Request, status
+from sqlalchemy.orm import Session
+
+from cache import TTLCache
+from config import AUTH_CACHE_SECONDS, TEACHER_CLASS_SCOPE
+from database import current_databases, get_public_db
+from repositories.student_repository import StudentRepository
+from repositories.user_repository import UserRepository
+from rosters import get_roster
+from routes.auth import require_auth
+
+
+@dataclass(frozen=True)
+class Authorization:
+    user_id: int
+    role: Optional[str]  # None when the user is gone or deactivated
+
+
+_decisions = TTLCache(AUTH_CACHE_SECONDS)
+
+
+def get_authorization(request: Request, public_db: Session = Depends(get_public_db)) -> Authorization:
+    decision = getattr(request.state, "authorization", None)
+    if decision is not None:
+        return decision
+
+    user_id = require_auth(request)
+    key = (current_databases().name, user_id)
+    decision = _decisions.get(key)
+    if decision is None:
+        user = UserRepository(public_db).get_user_by_id(user_id)
+        decision = Authorization(user_id, user.role if user and user.is_active else None)
+        _decisions.set(key, decision)
+    request.state.authorization = decision
+    return decision
+
+
+def invalidate_authorization(user_id: Optional[int] = None):
+    """Call when a user's role or active flag changes"""
+    _decisions.invalidate(None if user_id is None else (current_databases().name, user_id))
+
+
+def require_role(*roles: str):
+    """Dependency for routers or routes: the caller must hold one of `roles`"""
+    def dependency(request: Request, authorization: Authorization = Depends(get_authorization)) -> Authorization:
+        if authorization.role is None:
+            request.session.clear()
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
+        if authorization.role not in roles or request.session.get("role") != authorization.role:
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not allowed for this role")
+        return authorization
+    return dependency
+
+
+def require_class_scope(request: Request, teacher_db: Session, student_repo: StudentRepository, student_id: int):
+    """Raise 403 unless the calling teacher takes a class the student is in"""
+    if not TEACHER_CLASS_SCOPE:
+        return
+    user_id = require_auth(request)
+    if student_id not in get_roster(teacher_db, student_repo, user_id):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Student is not in one of your classes")
@@ -0,0 +1,222 @@
+"""
+End-of-term report cards for a whole grade, run as a background job.
+
+The grade's students, marks, attendance and assignments are fetched in one
+set-based query each (per shard when sharded) instead of a few queries per
+student. The data is then split into chunks that a process pool renders
+with templates/report_card.html; each finished chunk is appended to a zip
+archive as it comes back, and the job reports progress and the time spent
+per student as it goes.
+
+    python reports.py 10 --section A --year 2024-2025   # without the queue
+"""
+
+import argparse
+import time
+import zipfile
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import repeat
+from multiprocessing import get_context
+from typing import Dict, List, Optional, Tuple
+
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+
+from academic_calendar import academic_year_bounds, academic_year_of
+from config import REPORT_PROCESSES, REPORT_CHUNK_SIZE
+from database import open_session
+from exports import output_path
+from jobs import JobContext, job
+from models import SchoolNotices
+from repositories.sharded_student_repository import student_repository
+from templating import TEMPLATE_DIR
+
+REPORT_TEMPLATE = "report_card.html"
+
+# Jinja environments of a renderer process, by template directories
+_environments: Dict[Tuple[str, ...], Environment] = {}
+
+
+def _template(template_dirs: Tuple[str, ...]):
+    env = _environments.get(template_dirs)
+    if env is None:
+        env = _environments[template_dirs] = Environment(
+            loader=FileSystemLoader(list(template_dirs)), autoescape=select_autoescape()
+        )
+    return env.get_template(REPORT_TEMPLATE)
+
+
+def subject_results(marks: List[dict]) -> List[dict]:
+    """Marks grouped by subject, in subject order, with each subject's overall percentage"""
+    subjects = defaultdict(list)
+    for mark in marks:
+        subjects[mark["subject"]].append(mark)
+    results = []
+    for subject in sorted(subjects, key=lambda name: name or ""):
+        exams = subjects[subject]
+        obtained = sum(mark["marks_obtained"] or 0 for mark in exams)
+        total = sum(mark["total_marks"] or 0 for mark in exams)
+        results.append({
+            "subject": subject,
+            "exams": exams,
+            "obtained": obtained,
+            "total": total,
+            "percentage": 100 * obtained / total if total else None,
+        })
+    return results
+
+
+def assignment_results(assignments: List[dict]) -> dict:
+    submitted = sum(1 for assignment in assignments if assignment["status"] == "submitted")
+    graded = [assignment["marks"] for assignment in assignments if assignment["marks"] is not None]
+    return {
+        "total": len(assignments),
+        "submitted": submitted,
+        "pending": sum(1 for assignment in assignments if assignment["status"] == "pending"),
+        "overdue": sum(1 for assignment in assignments if assignment["status"] == "overdue"),
+        "completion": 100 * submitted / len(assignments) if assignments else None,
+        "average_marks": sum(graded) / len(graded) if graded else None,
+    }
+
+
+def render_chunk(template_dirs: Tuple[str, ...], shared: dict, cards: List[dict]) -> Tuple[List[Tuple[str, str]], float]:
+    """
+    Runs in a renderer process: (archive name, HTML) per card and the CPU
+    seconds the chunk took
+    """
+    started = time.process_time()
+    template = _template(template_dirs)
+    files = []
+    for card in cards:
+        student = card["student"]
+        html = template.render(
+            **shared,
+            student=student,
+            subjects=subject_results(card["marks"]),
+            attendance=card["attendance"],
+            assignments=assignment_results(card["assignments"]),
+        )
+        name = f"{student['student_id']}-{student['last_name']}-{student['first_name']}".replace("/", "-")
+        files.append((f"{student['section'] or 'no-section'}/{name}.html", html))
+    return files, time.process_time() - started
+
+
+def prefetch(grade: str, section: Optional[str], start: datetime, end: datetime) -> Tuple[List[dict], List[dict]]:
+    """Per-student card data and the term's notices, in five queries"""
+    classes = [(grade, section)]
+    db = open_session("student", read_only=True)
+    repo = student_repository(db)
+    try:
+        students = repo.get_students_in_classes(classes)
+        marks = defaultdict(list)
+        for mark in repo.get_class_marks(classes, start, end):
+            marks[mark.student_id].append(mark._asdict())
+        assignments = defaultdict(list)
+        for assignment in repo.get_class_assignments(classes, start, end):
+            assignments[assignment.student_id].append(assignment._asdict())
+        summaries = repo.get_class_attendance_summaries(classes, start, end)
+    finally:
+        if hasattr(repo, "close"):
+            repo.close()
+        db.close()
+
+    authority_db = open_session("authority", read_only=True)
+    try:
+        notices = [
+            {"title": notice.title, "content": notice.content, "created_at": notice.created_at}
+            for notice in authority_db.query(SchoolNotices).filter(
+                SchoolNotices.target_audience.in_(["all", "students"]),
+                SchoolNotices.created_at >= start,
+                SchoolNotices.created_at < end,
+            ).order_by(SchoolNotices.created_at)
+        ]
+    finally:
+        authority_db.close()
+
+    cards = [{
+        "student": student._asdict(),
+        "marks": marks.get(student.id, []),
+        "attendance": summaries.get(student.id),
+        "assignments": assignments.get(student.id, []),
+    } for student in students]
+    return cards, notices
+
+
+def template_dirs(tenant: Optional[str]) -> Tuple[str, ...]:
+    """A hosted school's own templates first, as in templating.py"""
+    if tenant:
+        from tenants import registry
+
+        school = registry.tenants[tenant]
+        if school.templates:
+            return (school.templates, TEMPLATE_DIR)
+    return (TEMPLATE_DIR,)
+
+
+@job("reports.report_cards")
+def generate_report_cards(ctx: JobContext, grade: str, section: Optional[str] = None,
+                          academic_year: Optional[str] = None):
+    """
+    One HTML report card per student of the grade (or class) in a zip. The
+    job itself only queries and writes the archive; rendering happens on its
+    own process pool.
+    """
+    academic_year = academic_year or academic_year_of()
+    start, end = academic_year_bounds(academic_year)
+    started = time.perf_counter()
+    cards, notices = prefetch(grade, section, start, end)
+    prefetch_seconds = time.perf_counter() - started
+    total = len(cards)
+    if not total:
+        return {"students": 0, "message": f"No students in grade {grade}"}
+
+    school = None
+    if ctx.tenant:
+        from tenants import registry
+
+        school = registry.tenants[ctx.tenant].name
+    shared = {"school": school, "academic_year": academic_year, "notices": notices,
+              "generated_at": datetime.utcnow()}
+    chunks = [cards[i:i + REPORT_CHUNK_SIZE] for i in range(0, total, REPORT_CHUNK_SIZE)]
+    name = f"report-cards-{grade}{'-' + section if section else ''}-{academic_year}.zip".replace("/", "-")
+    done = 0
+    render_cpu = 0.0
+    ctx.progress(0.0, f"Fetched {total} students in {prefetch_seconds:.1f}s", force=True)
+
+    with zipfile.ZipFile(output_path(ctx.job_id, name), "w", zipfile.ZIP_DEFLATED) as archive:
+        with ProcessPoolExecutor(min(REPORT_PROCESSES, len(chunks)), mp_context=get_context("spawn")) as pool:
+            # map() hands results back in order as each chunk finishes
+            for files, cpu_seconds in pool.map(render_chunk, repeat(template_dirs(ctx.tenant)), repeat(shared),
+                                               chunks):
+                for file_name, html in files:
+                    archive.writestr(file_name, html)
+                done += len(files)
+                render_cpu += cpu_seconds
+                elapsed = time.perf_counter() - started
+                ctx.progress(done / total, f"{done} of {total} students, {1000 * elapsed / done:.1f} ms each")
+
+    elapsed = time.perf_counter() - started
+    return {
+        "file": name,
+        "students": total,
+        "seconds": round(elapsed, 2),
+        "prefetch_seconds": round(prefetch_seconds, 2),
+        "ms_per_student": round(1000 * elapsed / total, 2),
+        "render_cpu_ms_per_student": round(1000 * render_cpu / total, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate report cards for a grade into job_output/")
+    parser.add_argument("grade")
+    parser.add_argument("--section")
+    parser.add_argument("--year", help="Academic year such as 2024-2025 (default: current)")
+    args = parser.parse_args()
+
+    result = generate_report_cards(JobContext.standalone(), args.grade, args.section, args.year)
+    print(f"[SUCCESS] {result}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+"""
+Chronic absence detection.
+
+Each student has a rolling window per subject, plus one overall (subject
+""), over their last ABSENCE_WINDOW_DAYS school days (Monday to Friday). A
+window is two bitmasks anchored at the latest school day recorded: bit i of
+`recorded` means the student has attendance for the school day i days
+before the anchor, and bit i of `attended` means they were present or late.
+Recording a day shifts the masks forward if the day is newer than the anchor
+and then sets or clears one bit. Corrections and late entries inside the
+window work the same way, and days older than the window are ignored. The
+rate is a popcount, so no attendance is ever rescanned.
+
+The overall window is rebuilt from the student's subject windows, as
+merge_subjects() does for summaries: a day is attended if any subject was
+attended. When a window's rate first drops below ABSENCE_ALERT_RATE an
+absence_alerts row is raised. It is resolved once the rate recovers, so
+each crossing alerts once.
+
+create_attendance feeds every recorded day in. After bulk loads (or to
+change the window settings) recompute everything in one ordered pass:
+
+    python -m repositories.absence_repository rebuild
+"""
+
+from collections import namedtuple
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from config import (
+    ABSENCE_ALERT_RATE, ABSENCE_ALERTS_SHOWN, ABSENCE_MIN_DAYS, ABSENCE_WINDOW_DAYS, ATTENDANCE_STORE,
+)
+from models import AbsenceAlert, AttendanceWindow, Student, StudentAttendance
+from repositories.attendance_repository import STATUS_CODES, AttendanceBitmapRepository, popcount
+
+OVERALL = ""
+# Window key of attendance recorded without a subject
+NO_SUBJECT = "-"
+WINDOW_MASK = (1 << ABSENCE_WINDOW_DAYS) - 1
+ATTENDED_CODES = (STATUS_CODES["present"], STATUS_CODES["late"])
+
+# An open alert with the student it is about, for the dashboard
+AbsenceAlertItem = namedtuple("AbsenceAlertItem", "id student_id student_code first_name last_name grade section "
+                                                  "subject rate recorded_days raised_at")
+
+
+def school_day(when) -> Optional[int]:
+    """Number of Monday-to-Friday days since 1 January 1 AD (a Monday); None at weekends"""
+    days = (when.date() if isinstance(when, datetime) else when).toordinal() - 1
+    weeks, weekday = divmod(days, 7)
+    return weeks * 5 + weekday if weekday < 5 else None
+
+
+def advance(window: Tuple[Optional[int], int, int], day: int, attended: Optional[bool]) -> Tuple[int, int, int]:
+    """
+    (anchor, recorded, attended) after recording school day `day`: attended
+    True/False, or None to clear a day whose status is not an attendance
+    status
+    """
+    anchor, recorded_mask, attended_mask = window
+    if anchor is None:
+        anchor = day
+    elif day > anchor:
+        shift = day - anchor
+        recorded_mask = (recorded_mask << shift) & WINDOW_MASK
+        attended_mask = (attended_mask << shift) & WINDOW_MASK
+        anchor = day
+    offset = anchor - day
+    if offset >= ABSENCE_WINDOW_DAYS:
+        return anchor, recorded_mask, attended_mask
+    bit = 1 << offset
+    recorded_mask = recorded_mask | bit if attended is not None else recorded_mask & ~bit
+    attended_mask = attended_mask | bit if attended else attended_mask & ~bit
+    return anchor, recorded_mask, attended_mask
+
+
+def combine(windows: Iterable[Tuple[int, int, int]]) -> Tuple[Optional[int], int, int]:
+    """Overall window from subject windows: recorded in any subject, attended in any subject"""
+    windows = list(windows)
+    anchor = max((window[0] for window in windows), default=None)
+    recorded_mask = attended_mask = 0
+    for subject_anchor, subject_recorded, subject_attended in windows:
+        shift = anchor - subject_anchor
+        recorded_mask |= (subject_recorded << shift) & WINDOW_MASK
+        attended_mask |= (subject_attended << shift) & WINDOW_MASK
+    return anchor, recorded_mask, attended_mask
+
+
+def window_rate(recorded_mask: int, attended_mask: int) -> Tuple[int, float]:
+    recorded_days = popcount(recorded_mask)
+    return recorded_days, popcount(attended_mask) / recorded_days if recorded_days else 1.0
+
+
+def is_below(recorded_mask: int, attended_mask: int) -> bool:
+    recorded_days, rate = window_rate(recorded_mask, attended_mask)
+    return recorded_days >= ABSENCE_MIN_DAYS and rate < ABSENCE_ALERT_RATE
+
+
+def _attended(status: str) -> Optional[bool]:
+    code = STATUS_CODES.get(status, 0)
+    return code in ATTENDED_CODES if code else None
+
+
+class AbsenceRepository:
+    def __init__(self, db: Session):
+        self.db = db
+
+    def _locked_window(self, student_id: int, subject: str, anchor: int) -> AttendanceWindow:
+        self.db.execute(
+            pg_insert(AttendanceWindow)
+            .values(student_id=student_id, subject=subject, anchor=anchor, recorded=0, attended=0, flagged=False)
+            .on_conflict_do_nothing(index_elements=["student_id", "subject"])
+        )
+        return self.db.query(AttendanceWindow).filter(
+            AttendanceWindow.student_id == student_id,
+            AttendanceWindow.subject == subject,
+        ).with_for_update().one()
+
+    def observe(self, student_id: int, when, status: str, subject: Optional[str]):
+        """
+        Move the student's windows for one recorded day, raising or resolving
+        alerts. Runs in the caller's transaction; the caller commits.
+        """
+        day = school_day(when)
+        if day is None:
+            return
+        window = self._locked_window(student_id, subject or NO_SUBJECT, day)
+        window.anchor, window.recorded, window.attended = advance(
+            (window.anchor, window.recorded, window.attended), day, _attended(status)
+        )
+        self._check(window)
+        self.db.flush()
+
+        # Lock the overall row before reading the subject windows, so a
+        # concurrent update of another subject is seen by whichever runs last
+        overall = self._locked_window(student_id, OVERALL, day)
+        subjects = self.db.execute(select(AttendanceWindow.anchor, AttendanceWindow.recorded,
+                                          AttendanceWindow.attended).where(
+            AttendanceWindow.student_id == student_id,
+            AttendanceWindow.subject != OVERALL,
+        )).all()
+        overall.anchor, overall.recorded, overall.attended = combine(subjects)
+        self._check(overall)
+
+    def _check(self, window: AttendanceWindow):
+        below = is_below(window.recorded, window.attended)
+        if below == window.flagged:
+            return
+        window.flagged = below
+        if below:
+            recorded_days, rate = window_rate(window.recorded, window.attended)
+            self.db.add(AbsenceAlert(student_id=window.student_id, subject=window.subject, rate=rate,
+                                     recorded_days=recorded_days))
+        else:
+            self.db.execute(update(AbsenceAlert).where(
+                AbsenceAlert.student_id == window.student_id,
+                AbsenceAlert.subject == window.subject,
+                AbsenceAlert.resolved_at.is_(None),
+            ).values(resolved_at=datetime.utcnow()))
+
+    def get_open_alerts(self, limit: int = ABSENCE_ALERTS_SHOWN) -> List[AbsenceAlertItem]:
+        """Unresolved, undismissed alerts, newest first"""
+        query = select(
+            AbsenceAlert.id, Student.id, Student.student_id, Student.first_name, Student.last_name,
+            Student.grade, Student.section, AbsenceAlert.subject, AbsenceAlert.rate,
+            AbsenceAlert.recorded_days, AbsenceAlert.raised_at,
+        ).join(Student, Student.id == AbsenceAlert.student_id).where(
+            AbsenceAlert.resolved_at.is_(None),
+            AbsenceAlert.dismissed_at.is_(None),
+        ).order_by(AbsenceAlert.raised_at.desc()).limit(limit)
+        return [AbsenceAlertItem(*row) for row in self.db.execute(query)]
+
+    def dismiss(self, student_id: int, alert_id: int, dismissed_by: int) -> bool:
+        """Hide an alert; the window stays flagged, so it is not raised again until attendance recovers"""
+        dismissed = self.db.execute(update(AbsenceAlert).where(
+            AbsenceAlert.id == alert_id,
+            AbsenceAlert.student_id == student_id,
+            AbsenceAlert.dismissed_at.is_(None),
+        ).values(dismissed_by=dismissed_by, dismissed_at=datetime.utcnow())).rowcount
+        self.db.commit()
+        return bool(dismissed)
+
+    def _records(self, batch_size: int):
+        """(student_id, date, status, subject) of all attendance, by student and then date"""
+        if ATTENDANCE_STORE == "bitmap":
+            for record in AttendanceBitmapRepository(self.db).iter_records(batch_size):
+                yield record.student_id, record.date, record.status, record.subject
+            return
+        yield from self.db.execute(
+            select(StudentAttendance.student_id, StudentAttendance.date, StudentAttendance.status,
+                   StudentAttendance.subject)
+            .order_by(StudentAttendance.student_id, StudentAttendance.date, StudentAttendance.id),
+            execution_options={"yield_per": batch_size},
+        )
+
+    def rebuild(self, batch_size: int = 5000) -> int:
+        """
+        Recompute every window from the attendance in one pass ordered by
+        student, then reconcile the open alerts with the new flags: alerts
+        for windows that are no longer below the threshold are resolved and
+        windows newly below it get one. Returns the number of windows.
+        """
+        flagged: Dict[Tuple[int, str], Tuple[int, float]] = {}
+        pending: List[dict] = []
+        count = 0
+
+        def flush_student(student_id: int, windows: Dict[str, Tuple[int, int, int]]):
+            windows[OVERALL] = combine(windows.values())
+            for subject, (anchor, recorded_mask, attended_mask) in windows.items():
+                below = is_below(recorded_mask, attended_mask)
+                if below:
+                    flagged[(student_id, subject)] = window_rate(recorded_mask, attended_mask)
+                pending.append({"student_id": student_id, "subject": subject, "anchor": anchor,
+                                "recorded": recorded_mask, "attended": attended_mask, "flagged": below,
+                                "updated_at": datetime.utcnow()})
+
+        self.db.execute(delete(AttendanceWindow))
+        current, windows = None, {}
+        for student_id, when, status, subject in self._records(batch_size):
+            if student_id != current:
+                if windows:
+                    flush_student(current, windows)
+                current, windows = student_id, {}
+            day = school_day(when)
+            if day is None:
+                continue
+            key = subject or NO_SUBJECT
+            windows[key] = advance(windows.get(key, (None, 0, 0)), day, _attended(status))
+            if len(pending) >= batch_size:
+                self.db.execute(insert(AttendanceWindow), pending)
+                count += len(pending)
+                pending = []
+        if windows:
+            flush_student(current, windows)
+        if pending:
+            self.db.execute(insert(AttendanceWindow), pending)
+            count += len(pending)
+
+        open_alerts = set(self.db.execute(select(AbsenceAlert.student_id, AbsenceAlert.subject).where(
+            AbsenceAlert.resolved_at.is_(None)
+        )).all())
+        now = datetime.utcnow()
+        for student_id, subject in open_alerts - flagged.keys():
+            self.db.execute(update(AbsenceAlert).where(
+                AbsenceAlert.student_id == student_id,
+                AbsenceAlert.subject == subject,
+                AbsenceAlert.resolved_at.is_(None),
+            ).values(resolved_at=now))
+        raised = [
+            {"student_id": student_id, "subject": subject, "rate": rate, "recorded_days": recorded_days,
+             "raised_at": now}
+            for (student_id, subject), (recorded_days, rate) in flagged.items()
+            if (student_id, subject) not in open_alerts
+        ]
+        if raised:
+            self.db.execute(insert(AbsenceAlert), raised)
+        self.db.commit()
+        return count
+
+
+if __name__ == "__main__":
+    import sys
+    from database import SessionLocals
+    from repositories.sharded_student_repository import student_repository
+
+    if sys.argv[1:] != ["rebuild"]:
+        print("Usage: python -m repositories.absence_repository rebuild")
+        sys.exit(1)
+    db = SessionLocals["student"]()
+    repo = student_repository(db)
+    try:
+        # Attendance and its windows live on each student's shard when sharded
+        if hasattr(repo, "scatter"):
+            count = sum(repo.scatter(lambda shard: AbsenceRepository(shard.db).rebuild()))
+        else:
+            count = AbsenceRepository(db).rebuild()
+        print(f"[SUCCESS] Rebuilt {count} attendance windows")
+    finally:
+        if hasattr(repo, "close"):
+            repo.close()
+        db.close()
@@ -0,0 +1,359 @@
+"""
+Compact attendance store.
+
+Instead of one student_attendance row per student, subject and day, each
+attendance_months row packs a whole month for one student and subject into
+a 64-bit integer: 2 bits per day (0 = not recorded, 1 = present,
+2 = absent, 3 = late), day d at bits 2*(d-1). Rates and streaks are worked
+out on the packed words with mask-and-popcount arithmetic, so a year of
+history is twelve integers per subject rather than a few hundred rows.
+
+    python -m repositories.attendance_repository convert   # copy existing rows once
+"""
+
+from dataclasses import dataclass
+from datetime import date, datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from models import AttendanceMonth, AttendanceException, StudentAttendance
+
+STATUS_CODES = {"present": 1, "absent": 2, "late": 3}
+CODE_STATUSES = {code: status for status, code in STATUS_CODES.items()}
+
+# Low bit of every 2-bit slot
+LOW_BITS = int("01" * 32, 2)
+MONTH_WIDTH = 64
+
+
+def set_day(statuses: int, day: int, code: int) -> int:
+    shift = 2 * (day - 1)
+    return (statuses & ~(0b11 << shift)) | (code << shift)
+
+
+def decode_days(statuses: int) -> Iterator[Tuple[int, int]]:
+    """(day, code) for every recorded day of a packed month, in day order"""
+    recorded = (statuses | (statuses >> 1)) & LOW_BITS
+    while recorded:
+        lowest = recorded & -recorded
+        position = lowest.bit_length() - 1
+        yield position // 2 + 1, (statuses >> position) & 0b11
+        recorded ^= lowest
+
+
+def status_masks(statuses: int) -> Tuple[int, int, int]:
+    """Present, absent and late masks (one bit per day slot) of a packed month"""
+    low = statuses & LOW_BITS
+    high = (statuses >> 1) & LOW_BITS
+    return low & ~high, high & ~low, low & high
+
+
+def popcount(value: int) -> int:
+    return bin(value).count("1")
+
+
+@dataclass
+class AttendanceSummary:
+    present: int = 0
+    absent: int = 0
+    late: int = 0
+    longest_streak: int = 0
+    current_streak: int = 0
+
+    @property
+    def recorded(self) -> int:
+        return self.present + self.absent + self.late
+
+    @property
+    def rate(self) -> float:
+        """Share of recorded days the student attended (late counts as attended)"""
+        return (self.present + self.late) / self.recorded if self.recorded else 0.0
+
+
+def summarize(months: Iterable[int]) -> AttendanceSummary:
+    """
+    Totals and streaks over packed months given oldest first. A streak is the
+    number of attended days between two absences; days without a record
+    (weekends, holidays) neither extend nor break it.
+    """
+    summary = AttendanceSummary()
+    attended_all = absent_all = 0
+    offset = 0
+    for statuses in months:
+        present, absent, late = status_masks(statuses)
+        summary.present += popcount(present)
+        summary.absent += popcount(absent)
+        summary.late += popcount(late)
+        attended_all |= (present | late) << offset
+        absent_all |= absent << offset
+        offset += MONTH_WIDTH
+
+    start = 0
+    while absent_all:
+        lowest = absent_all & -absent_all
+        position = lowest.bit_length() - 1
+        run = popcount(attended_all & ((1 << position) - (1 << start)))
+        summary.longest_streak = max(summary.longest_streak, run)
+        start = position + 1
+        absent_all ^= lowest
+    summary.current_streak = popcount(attended_all >> start)
+    summary.longest_streak = max(summary.longest_streak, summary.current_streak)
+    return summary
+
+
+def merge_subjects(statuses: Iterable[int]) -> int:
+    """
+    Collapse several subjects' packed words for the same month into one: a day
+    is present/late if attended in any subject and absent only if absent in
+    every subject recorded that day.
+    """
+    attended = absent = late = 0
+    for word in statuses:
+        p, a, l = status_masks(word)
+        attended |= p | l
+        late |= l
+        absent |= a
+    absent &= ~attended
+    present = attended & ~late
+    # Re-pack: present = 01, absent = 10, late = 11
+    return present | (absent << 1) | late | (late << 1)
+
+
+def summarize_records(records) -> AttendanceSummary:
+    """Summary of already loaded attendance rows or records, packed the same way"""
+    months: Dict[Tuple[int, int], Dict[int, int]] = {}
+    for record in records:
+        days = months.setdefault((record.date.year, record.date.month), {})
+        code = STATUS_CODES.get(record.status, 0)
+        # A day counts as attended if any subject was attended
+        if code and days.get(record.date.day) in (None, STATUS_CODES["absent"]):
+            days[record.date.day] = code
+    packed = []
+    for key in sorted(months):
+        word = 0
+        for day, code in months[key].items():
+            word = set_day(word, day, code)
+        packed.append(word)
+    return summarize(packed)
+
+
+class AttendanceRecord:
+    """Read model with the same attributes templates use on StudentAttendance"""
+    __slots__ = ("student_id", "date", "status", "subject", "uploaded_by", "created_at")
+
+    def __init__(self, student_id, date, status, subject, uploaded_by, created_at=None):
+        self.student_id = student_id
+        self.date = date
+        self.status = status
+        self.subject = subject
+        self.uploaded_by = uploaded_by
+        self.created_at = created_at
+
+
+def _month_start(when) -> date:
+    return date(when.year, when.month, 1)
+
+
+class AttendanceBitmapRepository:
+    def __init__(self, db: Session):
+        self.db = db
+
+    def _locked_month(self, student_id: int, subject: str, month: date, uploaded_by: int) -> AttendanceMonth:
+        self.db.execute(
+            pg_insert(AttendanceMonth)
+            .values(student_id=student_id, subject=subject, month=month, statuses=0,
+                    uploaded_by=uploaded_by, created_at=datetime.utcnow(), updated_at=datetime.utcnow())
+            .on_conflict_do_nothing(index_elements=["student_id", "subject", "month"])
+        )
+        return self.db.query(AttendanceMonth).filter(
+            AttendanceMonth.student_id == student_id,
+            AttendanceMonth.subject == subject,
+            AttendanceMonth.month == month,
+        ).with_for_update().one()
+
+    def record(self, student_id: int, date: datetime, status: str, subject: str,
+               uploaded_by: int) -> AttendanceRecord:
+        row = self._locked_month(student_id, subject, _month_start(date), uploaded_by)
+        code = STATUS_CODES.get(status, 0)
+        row.statuses = set_day(row.statuses or 0, date.day, code)
+
+        exception = self.db.query(AttendanceException).filter(
+            AttendanceException.month_id == row.id,
+            AttendanceException.day == date.day,
+        ).first()
+        if code and uploaded_by == row.uploaded_by:
+            if exception:
+                self.db.delete(exception)
+        else:
+            if not exception:
+                exception = AttendanceException(month_id=row.id, day=date.day)
+                self.db.add(exception)
+            exception.status = status
+            exception.uploaded_by = uploaded_by
+
+        self.db.commit()
+        return AttendanceRecord(student_id, date, status, subject, uploaded_by, row.updated_at)
+
+    def _months(self, student_id: int, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                subject: Optional[str] = None) -> List[AttendanceMonth]:
+        query = self.db.query(AttendanceMonth).filter(AttendanceMonth.student_id == student_id)
+        if start:
+            query = query.filter(AttendanceMonth.month >= _month_start(start))
+        if end:
+            query = query.filter(AttendanceMonth.month < end)
+        if subject:
+            query = query.filter(AttendanceMonth.subject == subject)
+        return query.order_by(AttendanceMonth.month, AttendanceMonth.subject).all()
+
+    def _exceptions(self, months: List[AttendanceMonth]) -> Dict[int, Dict[int, AttendanceException]]:
+        by_month: Dict[int, Dict[int, AttendanceException]] = {}
+        if not months:
+            return by_month
+        for exception in self.db.query(AttendanceException).filter(
+            AttendanceException.month_id.in_([row.id for row in months])
+        ):
+            by_month.setdefault(exception.month_id, {})[exception.day] = exception
+        return by_month
+
+    def _decode(self, months: List[AttendanceMonth], start=None, end=None) -> List[AttendanceRecord]:
+        exceptions = self._exceptions(months)
+        records = []
+        for row in months:
+            days = dict(decode_days(row.statuses or 0))
+            overrides = exceptions.get(row.id, {})
+            for day in sorted(set(days) | set(overrides)):
+                when = datetime(row.month.year, row.month.month, day)
+                if (start and when < start) or (end and when >= end):
+                    continue
+                exception = overrides.get(day)
+                records.append(AttendanceRecord(
+                    row.student_id, when,
+                    exception.status if exception else CODE_STATUSES[days[day]],
+                    row.subject,
+                    exception.uploaded_by if exception else row.uploaded_by,
+                    row.updated_at,
+                ))
+        records.sort(key=lambda record: (record.date, record.subject))
+        return records
+
+    def get_attendance(self, student_id: int, start: Optional[datetime] = None,
+                       end: Optional[datetime] = None) -> List[AttendanceRecord]:
+        return self._decode(self._months(student_id, start, end), start, end)
+
+    def get_summary(self, student_id: int, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                    subject: Optional[str] = None) -> AttendanceSummary:
+        """Rate and streaks straight from the packed words, without decoding days"""
+        by_month: Dict[date, List[int]] = {}
+        for row in self._months(student_id, start, end, subject):
+            by_month.setdefault(row.month, []).append(row.statuses or 0)
+        return summarize(merge_subjects(words) for _, words in sorted(by_month.items()))
+
+    def get_summaries(self, student_ids, start: Optional[datetime] = None,
+                      end: Optional[datetime] = None) -> Dict[int, AttendanceSummary]:
+        """get_summary for many students (ids or a subquery of them) in one query"""
+        query = self.db.query(AttendanceMonth.student_id, AttendanceMonth.month, AttendanceMonth.statuses).filter(
+            AttendanceMonth.student_id.in_(student_ids)
+        )
+        if start:
+            query = query.filter(AttendanceMonth.month >= _month_start(start))
+        if end:
+            query = query.filter(AttendanceMonth.month < end)
+        words: Dict[int, Dict[date, List[int]]] = {}
+        for student_id, month, statuses in query:
+            words.setdefault(student_id, {}).setdefault(month, []).append(statuses or 0)
+        return {
+            student_id: summarize(merge_subjects(month_words) for _, month_words in sorted(by_month.items()))
+            for student_id, by_month in words.items()
+        }
+
+    def get_recent_by_uploader(self, uploaded_by: int, limit: int = 10) -> List[AttendanceRecord]:
+        months = self.db.query(AttendanceMonth).filter(
+            AttendanceMonth.uploaded_by == uploaded_by
+        ).order_by(AttendanceMonth.updated_at.desc()).limit(limit).all()
+        records = []
+        for row in months:
+            recorded = list(decode_days(row.statuses or 0))
+            if recorded:
+                day, code = recorded[-1]
+                records.append(AttendanceRecord(row.student_id, datetime(row.month.year, row.month.month, day),
+                                                CODE_STATUSES[code], row.subject, row.uploaded_by, row.updated_at))
+        return records
+
+    def iter_records(self, batch_size: int = 5000) -> Iterator[AttendanceRecord]:
+        """Every recorded day, by student and then date, decoded batch_size months at a time"""
+        months = self.db.query(AttendanceMonth).order_by(
+            AttendanceMonth.student_id, AttendanceMonth.month, AttendanceMonth.subject,
+        ).execution_options(yield_per=batch_size)
+        batch = []
+        for row in months:
+            batch.append(row)
+            if len(batch) == batch_size:
+                yield from sorted(self._decode(batch), key=lambda record: (record.student_id, record.date))
+                batch = []
+        if batch:
+            yield from sorted(self._decode(batch), key=lambda record: (record.student_id, record.date))
+
+    def import_rows(self, batch_size: int = 50000) -> int:
+        """
+        Build packed months from the existing student_attendance rows in one
+        ordered pass. Each month's uploaded_by is its most frequent uploader;
+        other uploaders and unknown statuses become exceptions.
+        """
+        imported = 0
+        current_key = None
+        days: Dict[int, Tuple[str, int]] = {}
+
+        def flush(key, days):
+            student_id, subject, month = key
+            uploaders: Dict[int, int] = {}
+            for _, uploader in days.values():
+                uploaders[uploader] = uploaders.get(uploader, 0) + 1
+            owner = max(uploaders, key=uploaders.get)
+            statuses = 0
+            for day, (status, _) in days.items():
+                statuses = set_day(statuses, day, STATUS_CODES.get(status, 0))
+            row = AttendanceMonth(student_id=student_id, subject=subject, month=month,
+                                  statuses=statuses, uploaded_by=owner)
+            self.db.add(row)
+            self.db.flush()
+            for day, (status, uploader) in days.items():
+                if uploader != owner or status not in STATUS_CODES:
+                    self.db.add(AttendanceException(month_id=row.id, day=day, status=status, uploaded_by=uploader))
+
+        rows = self.db.query(
+            StudentAttendance.student_id, StudentAttendance.subject, StudentAttendance.date,
+            StudentAttendance.status, StudentAttendance.uploaded_by,
+        ).order_by(
+            StudentAttendance.student_id, StudentAttendance.subject, StudentAttendance.date,
+        ).execution_options(yield_per=batch_size)
+
+        for student_id, subject, when, status, uploaded_by in rows:
+            key = (student_id, subject, _month_start(when))
+            if key != current_key:
+                if current_key:
+                    flush(current_key, days)
+                current_key, days = key, {}
+            # Later rows for the same day win, as they would on screen
+            days[when.day] = (status, uploaded_by)
+            imported += 1
+        if current_key:
+            flush(current_key, days)
+        self.db.commit()
+        return imported
+
+
+if __name__ == "__main__":
+    import sys
+    from database import SessionLocals
+
+    if sys.argv[1:] != ["convert"]:
+        print("Usage: python -m repositories.attendance_repository convert")
+        sys.exit(1)
+    db = SessionLocals["student"]()
+    try:
+        count = AttendanceBitmapRepository(db).import_rows()
+        print(f"[SUCCESS] Packed {count} attendance rows into attendance_months")
+    finally:
+        db.close()
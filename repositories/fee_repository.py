@@ -0,0 +1,189 @@
+"""
+Fee invoicing and the payments ledger.
+
+Invoices are generated in bulk: one INSERT ... SELECT joins the year's active
+fee_structure rows with every student of each grade, skips invoices that
+already exist, and feeds the new rows straight into an upsert of the
+per-student student_fee_balances totals, all in one statement. Payments
+adjust the same totals, so a student's balance is always a primary key read.
+
+    python -m repositories.fee_repository rebuild   # recompute every balance
+"""
+
+from collections import namedtuple
+from datetime import date, datetime
+from decimal import Decimal
+from typing import List, Optional
+
+from sqlalchemy import Column, Date, DateTime, Integer, MetaData, Numeric, String, Table, cast, func, select, union_all
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from database import is_consolidated
+from models import FeeInvoice, FeePayment, FeeStructure, Student, StudentFeeBalance
+
+# Totals over every balance, for the authority overview
+FeeTotals = namedtuple("FeeTotals", "students invoiced paid outstanding")
+
+# In split mode students live in another database, so the invoice run copies
+# (id, grade) pairs into this temporary table and joins against it
+_invoice_students = Table(
+    "fee_invoice_students", MetaData(),
+    Column("student_id", Integer, primary_key=True),
+    Column("grade", String),
+    prefixes=["TEMPORARY"],
+    postgresql_on_commit="DROP",
+)
+
+
+def _balance_upsert(rows):
+    """INSERT ... ON CONFLICT that adds `rows` (student_id, invoiced, paid, balance, updated_at) to the totals"""
+    statement = pg_insert(StudentFeeBalance).from_select(
+        ["student_id", "invoiced", "paid", "balance", "updated_at"], rows
+    )
+    return statement.on_conflict_do_update(index_elements=["student_id"], set_={
+        "invoiced": StudentFeeBalance.invoiced + statement.excluded.invoiced,
+        "paid": StudentFeeBalance.paid + statement.excluded.paid,
+        "balance": StudentFeeBalance.balance + statement.excluded.balance,
+        "updated_at": statement.excluded.updated_at,
+    })
+
+
+class FeeRepository:
+    def __init__(self, db: Session):
+        self.db = db
+
+    def get_billed_grades(self, academic_year: str) -> List[str]:
+        """Grades with at least one active fee line in the year"""
+        return list(self.db.execute(select(FeeStructure.grade).where(
+            FeeStructure.is_active == True, FeeStructure.academic_year == academic_year
+        ).distinct().order_by(FeeStructure.grade)).scalars())
+
+    def generate_invoices(self, academic_year: str, issued_by: int, grades: Optional[List[str]] = None,
+                          student_repo=None, due_date: Optional[date] = None) -> int:
+        """
+        Invoice every student for each active fee line of the year (only
+        `grades` when given) and return how many students were billed. In
+        consolidated mode the students table is joined directly; in split
+        mode the students come from `student_repo` in one query.
+        """
+        now = datetime.utcnow()
+        if is_consolidated():
+            source = select(Student.id.label("student_id"), Student.grade).subquery()
+        else:
+            classes = [(grade, None) for grade in grades or self.get_billed_grades(academic_year)]
+            _invoice_students.create(self.db.connection())
+            rows = [{"student_id": student.id, "grade": student.grade}
+                    for student in student_repo.get_students_in_classes(classes)]
+            if rows:
+                self.db.execute(_invoice_students.insert(), rows)
+            source = _invoice_students
+
+        lines = select(
+            source.c.student_id, FeeStructure.id, FeeStructure.grade, FeeStructure.fee_type,
+            FeeStructure.academic_year, FeeStructure.amount, cast(due_date, Date), cast(issued_by, Integer),
+            cast(now, DateTime),
+        ).join(FeeStructure, FeeStructure.grade == source.c.grade).where(
+            FeeStructure.is_active == True,
+            FeeStructure.academic_year == academic_year,
+            FeeStructure.amount > 0,
+        )
+        if grades:
+            lines = lines.where(FeeStructure.grade.in_(grades))
+
+        inserted = pg_insert(FeeInvoice).from_select(
+            ["student_id", "fee_structure_id", "grade", "fee_type", "academic_year", "amount",
+             "due_date", "issued_by", "issued_at"], lines
+        ).on_conflict_do_nothing(
+            index_elements=["student_id", "fee_structure_id"]
+        ).returning(FeeInvoice.student_id, FeeInvoice.amount).cte("inserted")
+
+        total = func.sum(inserted.c.amount)
+        billed = self.db.execute(
+            _balance_upsert(
+                select(inserted.c.student_id, total, cast(0, Numeric), total, cast(now, DateTime))
+                .group_by(inserted.c.student_id)
+            ).add_cte(inserted).returning(StudentFeeBalance.student_id)
+        ).all()
+        self.db.commit()
+        return len(billed)
+
+    def record_payment(self, student_id: int, amount: Decimal, method: str, received_by: int,
+                       reference: Optional[str] = None, invoice_id: Optional[int] = None) -> FeePayment:
+        payment = FeePayment(student_id=student_id, invoice_id=invoice_id, amount=amount, method=method,
+                             reference=reference, received_by=received_by)
+        self.db.add(payment)
+        self.db.flush()
+        self.db.execute(_balance_upsert(
+            select(cast(student_id, Integer), cast(0, Numeric), cast(amount, Numeric), cast(-amount, Numeric),
+                   cast(payment.paid_at, DateTime))
+        ))
+        self.db.commit()
+        self.db.refresh(payment)
+        return payment
+
+    def get_balance(self, student_id: int) -> Optional[StudentFeeBalance]:
+        return self.db.get(StudentFeeBalance, student_id)
+
+    def get_invoices(self, student_id: int) -> List[FeeInvoice]:
+        return self.db.query(FeeInvoice).filter(FeeInvoice.student_id == student_id).order_by(
+            FeeInvoice.issued_at.desc(), FeeInvoice.id.desc()
+        ).all()
+
+    def get_payments(self, student_id: int) -> List[FeePayment]:
+        return self.db.query(FeePayment).filter(FeePayment.student_id == student_id).order_by(
+            FeePayment.paid_at.desc(), FeePayment.id.desc()
+        ).all()
+
+    def get_outstanding(self, limit: int = 50) -> List[StudentFeeBalance]:
+        """Largest balances first"""
+        return self.db.query(StudentFeeBalance).filter(StudentFeeBalance.balance > 0).order_by(
+            StudentFeeBalance.balance.desc()
+        ).limit(limit).all()
+
+    def get_totals(self) -> FeeTotals:
+        row = self.db.execute(select(
+            func.count(StudentFeeBalance.student_id),
+            func.coalesce(func.sum(StudentFeeBalance.invoiced), 0),
+            func.coalesce(func.sum(StudentFeeBalance.paid), 0),
+            func.coalesce(func.sum(StudentFeeBalance.balance).filter(StudentFeeBalance.balance > 0), 0),
+        )).one()
+        return FeeTotals(*row)
+
+    def rebuild_balances(self) -> int:
+        """Recompute every student's totals from the invoices and payments"""
+        now = datetime.utcnow()
+        entries = union_all(
+            select(FeeInvoice.student_id, FeeInvoice.amount.label("invoiced"), cast(0, Numeric).label("paid")),
+            select(FeePayment.student_id, cast(0, Numeric), FeePayment.amount),
+        ).subquery()
+        invoiced, paid = func.sum(entries.c.invoiced), func.sum(entries.c.paid)
+        statement = pg_insert(StudentFeeBalance).from_select(
+            ["student_id", "invoiced", "paid", "balance", "updated_at"],
+            select(entries.c.student_id, invoiced, paid, invoiced - paid, cast(now, DateTime))
+            .group_by(entries.c.student_id),
+        )
+        statement = statement.on_conflict_do_update(index_elements=["student_id"], set_={
+            "invoiced": statement.excluded.invoiced,
+            "paid": statement.excluded.paid,
+            "balance": statement.excluded.balance,
+            "updated_at": statement.excluded.updated_at,
+        })
+        count = self.db.execute(statement).rowcount
+        self.db.commit()
+        return count
+
+
+if __name__ == "__main__":
+    import sys
+    from database import SessionLocals
+
+    if sys.argv[1:] != ["rebuild"]:
+        print("Usage: python -m repositories.fee_repository rebuild")
+        sys.exit(1)
+    db = SessionLocals["authority"]()
+    try:
+        count = FeeRepository(db).rebuild_balances()
+        print(f"[SUCCESS] Rebuilt fee balances for {count} students")
+    finally:
+        db.close()
@@ -0,0 +1,55 @@
+from typing import Iterable, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from models import GradeBand, GradingPolicy
+
+
+class GradingRepository:
+    def __init__(self, db: Session):
+        self.db = db
+
+    def get_active_policies(self, academic_year: str) -> List[GradingPolicy]:
+        """The year's active policy per exam type, bands loaded, the year-wide one (exam_type None) first"""
+        return self.db.query(GradingPolicy).filter(
+            GradingPolicy.academic_year == academic_year,
+            GradingPolicy.is_active == True,
+        ).order_by(GradingPolicy.exam_type.nullsfirst()).all()
+
+    def get_policy_history(self, academic_year: str) -> List[GradingPolicy]:
+        return self.db.query(GradingPolicy).filter(
+            GradingPolicy.academic_year == academic_year
+        ).order_by(GradingPolicy.exam_type.nullsfirst(), GradingPolicy.version.desc()).all()
+
+    def get_academic_years(self) -> List[str]:
+        rows = self.db.query(GradingPolicy.academic_year).distinct().order_by(GradingPolicy.academic_year.desc())
+        return [academic_year for academic_year, in rows]
+
+    def create_policy(self, academic_year: str, exam_type: Optional[str], bands: Iterable[Tuple[float, str]],
+                      created_by: int) -> GradingPolicy:
+        """
+        Add the next version of the year's policy for `exam_type` (None for
+        every exam type) and make it the active one.
+        """
+        same_scope = self.db.query(GradingPolicy).filter(
+            GradingPolicy.academic_year == academic_year,
+            GradingPolicy.exam_type.is_(None) if exam_type is None else GradingPolicy.exam_type == exam_type,
+        )
+        # Lock the earlier versions so two saves cannot both take the same number
+        previous = same_scope.with_for_update().all()
+        version = max((policy.version for policy in previous), default=0) + 1
+        for policy in previous:
+            policy.is_active = False
+
+        policy = GradingPolicy(
+            academic_year=academic_year,
+            exam_type=exam_type,
+            version=version,
+            is_active=True,
+            created_by=created_by,
+            bands=[GradeBand(min_percent=min_percent, grade=grade) for min_percent, grade in bands],
+        )
+        self.db.add(policy)
+        self.db.commit()
+        self.db.refresh(policy)
+        return policy
@@ -0,0 +1,132 @@
+import json
+import random
+from collections import namedtuple
+from datetime import datetime, timedelta
+from sqlalchemy import case, select, update
+from sqlalchemy.orm import Session
+from models import BackgroundJob
+from config import JOB_MAX_ATTEMPTS, JOB_RETRY_BASE_SECONDS, JOB_LEASE_SECONDS
+from typing import Any, Iterable, List, Optional
+
+# What a worker needs to run a claimed job
+ClaimedJob = namedtuple("ClaimedJob", "id kind payload attempts max_attempts")
+
+class JobRepository:
+    def __init__(self, db: Session):
+        self.db = db
+
+    def enqueue(self, kind: str, payload: Optional[dict] = None, submitted_by: Optional[int] = None,
+                priority: int = 0, max_attempts: int = JOB_MAX_ATTEMPTS,
+                run_after: Optional[datetime] = None) -> BackgroundJob:
+        job = BackgroundJob(kind=kind, payload=json.dumps(payload or {}), submitted_by=submitted_by,
+                            priority=priority, max_attempts=max_attempts,
+                            run_after=run_after or datetime.utcnow())
+        self.db.add(job)
+        self.db.commit()
+        self.db.refresh(job)
+        return job
+
+    def get_job(self, job_id: int) -> Optional[BackgroundJob]:
+        return self.db.query(BackgroundJob).filter(BackgroundJob.id == job_id).first()
+
+    def list_jobs(self, submitted_by: Optional[int] = None, limit: int = 50) -> List[BackgroundJob]:
+        query = self.db.query(BackgroundJob)
+        if submitted_by is not None:
+            query = query.filter(BackgroundJob.submitted_by == submitted_by)
+        return query.order_by(BackgroundJob.created_at.desc()).limit(limit).all()
+
+    def claim(self, worker_id: str, kinds: Iterable[str], limit: int = 1) -> List[ClaimedJob]:
+        """
+        Mark up to `limit` due jobs of these kinds as running for this worker.
+        SKIP LOCKED lets any number of workers claim concurrently without
+        waiting on, or double-claiming, each other's rows.
+        """
+        now = datetime.utcnow()
+        due = select(BackgroundJob.id).where(
+            BackgroundJob.status == "queued",
+            BackgroundJob.run_after <= now,
+            BackgroundJob.kind.in_(list(kinds)),
+        ).order_by(BackgroundJob.priority.desc(), BackgroundJob.id).limit(limit).with_for_update(skip_locked=True)
+        claimed = self.db.execute(
+            update(BackgroundJob).where(BackgroundJob.id.in_(due.scalar_subquery())).values(
+                status="running", locked_by=worker_id, locked_at=now, attempts=BackgroundJob.attempts + 1,
+                started_at=now, error=None,
+            ).returning(BackgroundJob.id, BackgroundJob.kind, BackgroundJob.payload, BackgroundJob.attempts,
+                        BackgroundJob.max_attempts)
+        ).all()
+        self.db.commit()
+        return [ClaimedJob(id, kind, json.loads(payload or "{}"), attempts, max_attempts)
+                for id, kind, payload, attempts, max_attempts in claimed]
+
+    def _held(self, job_id: int, worker_id: str, attempt: int):
+        """WHERE clause matching the job only while this worker still holds this attempt's lease"""
+        return (
+            BackgroundJob.id == job_id,
+            BackgroundJob.status == "running",
+            BackgroundJob.locked_by == worker_id,
+            BackgroundJob.attempts == attempt,
+        )
+
+    def report_progress(self, job_id: int, worker_id: str, attempt: int, fraction: float,
+                        message: Optional[str] = None) -> bool:
+        """Progress for the submitter; also renews the lease. False if the lease was lost"""
+        updated = self.db.execute(update(BackgroundJob).where(*self._held(job_id, worker_id, attempt)).values(
+            progress=min(max(fraction, 0.0), 1.0), progress_message=message, locked_at=datetime.utcnow()
+        )).rowcount
+        self.db.commit()
+        return bool(updated)
+
+    def renew_leases(self, worker_id: str, jobs: Iterable[ClaimedJob]) -> List[int]:
+        """Extend the lease of jobs this worker is running; returns the ids whose lease was lost"""
+        jobs = list(jobs)
+        if not jobs:
+            return []
+        renewed = {tuple(row) for row in self.db.execute(update(BackgroundJob).where(
+            BackgroundJob.id.in_([job.id for job in jobs]),
+            BackgroundJob.status == "running",
+            BackgroundJob.locked_by == worker_id,
+        ).values(locked_at=datetime.utcnow()).returning(BackgroundJob.id, BackgroundJob.attempts))}
+        self.db.commit()
+        return [job.id for job in jobs if (job.id, job.attempts) not in renewed]
+
+    def finish(self, job: ClaimedJob, worker_id: str, result: Any = None) -> bool:
+        """Record success; False (and nothing written) if the lease was lost"""
+        now = datetime.utcnow()
+        updated = self.db.execute(update(BackgroundJob).where(*self._held(job.id, worker_id, job.attempts)).values(
+            status="succeeded", progress=1.0, result=json.dumps(result), finished_at=now, locked_by=None,
+        )).rowcount
+        self.db.commit()
+        return bool(updated)
+
+    def fail(self, job: ClaimedJob, worker_id: str, error: str) -> bool:
+        """
+        Requeue with exponential backoff and jitter, or give up after
+        max_attempts. False (and nothing written) if the lease was lost
+        """
+        now = datetime.utcnow()
+        if job.attempts < job.max_attempts:
+            delay = JOB_RETRY_BASE_SECONDS * 2 ** (job.attempts - 1) * random.uniform(0.8, 1.2)
+            values = {"status": "queued", "run_after": now + timedelta(seconds=delay)}
+        else:
+            values = {"status": "failed", "finished_at": now}
+        updated = self.db.execute(update(BackgroundJob).where(*self._held(job.id, worker_id, job.attempts)).values(
+            error=error, locked_by=None, **values
+        )).rowcount
+        self.db.commit()
+        return bool(updated)
+
+    def requeue_stale(self) -> int:
+        """Running jobs whose worker stopped renewing the lease go back to the queue (or fail)"""
+        now = datetime.utcnow()
+        exhausted = BackgroundJob.attempts >= BackgroundJob.max_attempts
+        result = self.db.execute(update(BackgroundJob).where(
+            BackgroundJob.status == "running",
+            BackgroundJob.locked_at < now - timedelta(seconds=JOB_LEASE_SECONDS),
+        ).values(
+            status=case((exhausted, "failed"), else_="queued"),
+            finished_at=case((exhausted, now), else_=None),
+            error="Worker stopped responding",
+            locked_by=None,
+        ))
+        self.db.commit()
+        return result.rowcount
@@ -0,0 +1,253 @@
+"""
+Notices and who has read them.
+
+Unread counts are never computed by counting notices. notice_audience_counts
+keeps the number of active notices per target audience. Each reader's
+notice_read_states row keeps a watermark (every notice up to that id counts
+as read, set by "mark all read"), plus receipts for notices read one by one
+above it, plus read_count: how many active notices for the reader's
+audiences that covers. A user's unread count is then the sum of at most two
+audience counters minus their read_count, two primary key reads. Publishing
+or withdrawing a notice adjusts the counters in one statement each.
+
+Search runs on school_notices.search_vector, a tsvector column Postgres
+generates from the title and content on every write, through a GIN index.
+Matches are ranked with ts_rank_cd, and only the page that is shown gets
+ts_headline snippets.
+
+    python -m repositories.notice_repository rebuild        # recompute every counter
+    python -m repositories.notice_repository search-index   # add the search column to an existing table
+"""
+
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+from typing import Iterable, List, Optional
+
+from markupsafe import Markup, escape
+from sqlalchemy import cast, delete, exists, func, literal, or_, select, text, update
+from sqlalchemy.dialects.postgresql import REGCONFIG, insert as pg_insert
+from sqlalchemy.orm import Session
+
+from config import NOTICE_SEARCH_LANGUAGE, NOTICE_SEARCH_PAGE_SIZE
+from models import NOTICE_SEARCH_VECTOR, NoticeAudienceCount, NoticeReadState, NoticeReceipt, SchoolNotices
+
+# target_audience values each role sees
+NOTICE_AUDIENCES = {
+    "student": ("all", "students"),
+    "teacher": ("all", "teachers"),
+}
+
+# A notice as shown to one reader
+NoticeView = namedtuple("NoticeView", "notice is_read")
+
+# A search result: the notice, its rank (None without search terms) and the
+# title and content snippet with the matches in <mark>
+NoticeHit = namedtuple("NoticeHit", "notice rank title snippet")
+
+# ts_headline marks matches with these private-use characters, which no
+# notice contains, so the snippet can be HTML-escaped before they become tags
+_START, _STOP = "\ue000", "\ue001"
+_TITLE_HEADLINE = f"HighlightAll=true, StartSel={_START}, StopSel={_STOP}"
+_CONTENT_HEADLINE = f"MaxFragments=2, MinWords=8, MaxWords=25, FragmentDelimiter=\" ... \", StartSel={_START}, StopSel={_STOP}"
+
+
+def _readers_of(audience: str) -> List[str]:
+    return [role for role, audiences in NOTICE_AUDIENCES.items() if audience in audiences]
+
+
+def _highlighted(fragment: Optional[str]) -> Markup:
+    return Markup(str(escape(fragment or "")).replace(_START, "<mark>").replace(_STOP, "</mark>"))
+
+
+class NoticeRepository:
+    def __init__(self, db: Session):
+        self.db = db
+
+    def add_notice(self, notice: SchoolNotices) -> SchoolNotices:
+        self.db.add(notice)
+        self.db.flush()
+        if notice.is_active:
+            self._count(notice.target_audience, 1)
+        self.db.commit()
+        return notice
+
+    def set_active(self, notice: SchoolNotices, active: bool):
+        """Publish or withdraw a notice, moving it in and out of every reader's counts"""
+        if notice.is_active == active:
+            return
+        notice.is_active = active
+        delta = 1 if active else -1
+        self._count(notice.target_audience, delta)
+        receipts = select(NoticeReceipt.user_id).where(NoticeReceipt.notice_id == notice.id)
+        self.db.execute(update(NoticeReadState).where(
+            NoticeReadState.role.in_(_readers_of(notice.target_audience)),
+            or_(NoticeReadState.watermark >= notice.id, NoticeReadState.user_id.in_(receipts)),
+        ).values(read_count=NoticeReadState.read_count + delta))
+        self.db.commit()
+
+    def _count(self, audience: str, delta: int):
+        statement = pg_insert(NoticeAudienceCount).values(audience=audience, active=delta)
+        self.db.execute(statement.on_conflict_do_update(
+            index_elements=["audience"],
+            set_={"active": NoticeAudienceCount.active + statement.excluded.active},
+        ))
+
+    def unread_count(self, user_id: int, role: str) -> int:
+        audiences = NOTICE_AUDIENCES.get(role)
+        if not audiences:
+            return 0
+        active = select(func.coalesce(func.sum(NoticeAudienceCount.active), 0)).where(
+            NoticeAudienceCount.audience.in_(audiences)
+        ).scalar_subquery()
+        read = select(NoticeReadState.read_count).where(NoticeReadState.user_id == user_id).scalar_subquery()
+        return max(self.db.execute(select(active - func.coalesce(read, 0))).scalar(), 0)
+
+    def get_notices(self, user_id: int, role: str, limit: Optional[int] = None) -> List[NoticeView]:
+        """Active notices for the user's audiences, newest first, with whether each was read"""
+        watermark = select(NoticeReadState.watermark).where(NoticeReadState.user_id == user_id).scalar_subquery()
+        is_read = or_(
+            SchoolNotices.id <= func.coalesce(watermark, 0),
+            exists().where(NoticeReceipt.user_id == user_id, NoticeReceipt.notice_id == SchoolNotices.id),
+        )
+        query = select(SchoolNotices, is_read).where(
+            SchoolNotices.is_active == True,
+            SchoolNotices.target_audience.in_(NOTICE_AUDIENCES.get(role, ())),
+        ).order_by(SchoolNotices.created_at.desc(), SchoolNotices.id.desc()).limit(limit)
+        return [NoticeView(*row) for row in self.db.execute(query)]
+
+    def search(self, terms: str, audiences: Iterable[str], priority: Optional[str] = None,
+               start: Optional[date] = None, end: Optional[date] = None, active_only: bool = True,
+               offset: int = 0, limit: int = NOTICE_SEARCH_PAGE_SIZE) -> List[NoticeHit]:
+        """
+        Notices for `audiences` matching `terms` (web search syntax: words,
+        "quoted phrases", or, -excluded), best match first, created between
+        `start` and `end` inclusive. Without terms the filtered notices are
+        returned newest first.
+        """
+        filters = [SchoolNotices.target_audience.in_(list(audiences))]
+        if active_only:
+            filters.append(SchoolNotices.is_active == True)
+        if priority:
+            filters.append(SchoolNotices.priority == priority)
+        if start:
+            filters.append(SchoolNotices.created_at >= start)
+        if end:
+            filters.append(SchoolNotices.created_at < end + timedelta(days=1))
+
+        language = cast(literal(NOTICE_SEARCH_LANGUAGE), REGCONFIG)
+        terms = (terms or "").strip()
+        if not terms:
+            notices = self.db.query(SchoolNotices).filter(*filters).order_by(
+                SchoolNotices.created_at.desc(), SchoolNotices.id.desc()
+            ).offset(offset).limit(limit)
+            return [NoticeHit(notice, None, _highlighted(notice.title), None) for notice in notices]
+
+        query = func.websearch_to_tsquery(language, terms)
+        rank = func.ts_rank_cd(SchoolNotices.search_vector, query)
+        # Rank every match through the GIN index, then build snippets for
+        # the page only; ts_headline reparses the whole text
+        page = select(SchoolNotices.id, rank.label("rank")).where(
+            SchoolNotices.search_vector.op("@@")(query), *filters
+        ).order_by(rank.desc(), SchoolNotices.created_at.desc()).offset(offset).limit(limit).subquery()
+        rows = self.db.execute(
+            select(
+                SchoolNotices, page.c.rank,
+                func.ts_headline(language, SchoolNotices.title, query, _TITLE_HEADLINE),
+                func.ts_headline(language, SchoolNotices.content, query, _CONTENT_HEADLINE),
+            ).join(page, page.c.id == SchoolNotices.id)
+            .order_by(page.c.rank.desc(), SchoolNotices.created_at.desc())
+        )
+        return [NoticeHit(notice, rank, _highlighted(title), _highlighted(snippet))
+                for notice, rank, title, snippet in rows]
+
+    def _read_state(self, user_id: int, role: str) -> NoticeReadState:
+        """The user's row, created if needed and locked until commit"""
+        self.db.execute(pg_insert(NoticeReadState).values(
+            user_id=user_id, role=role, watermark=0, read_count=0
+        ).on_conflict_do_nothing(index_elements=["user_id"]))
+        return self.db.query(NoticeReadState).filter(NoticeReadState.user_id == user_id).with_for_update().one()
+
+    def mark_read(self, user_id: int, role: str, notice_id: int) -> bool:
+        """Record that the user read one notice; False if it was already read or is not theirs"""
+        notice = self.db.get(SchoolNotices, notice_id)
+        if not notice or not notice.is_active or notice.target_audience not in NOTICE_AUDIENCES.get(role, ()):
+            return False
+        state = self._read_state(user_id, role)
+        newly_read = notice_id > state.watermark and self.db.execute(
+            pg_insert(NoticeReceipt).values(user_id=user_id, notice_id=notice_id)
+            .on_conflict_do_nothing().returning(NoticeReceipt.notice_id)
+        ).first() is not None
+        if newly_read:
+            state.read_count = NoticeReadState.read_count + 1
+            state.updated_at = datetime.utcnow()
+        self.db.commit()
+        return newly_read
+
+    def mark_all_read(self, user_id: int, role: str):
+        """Move the user's watermark past every notice; their receipts below it are no longer needed"""
+        state = self._read_state(user_id, role)
+        state.watermark = self.db.execute(select(func.coalesce(func.max(SchoolNotices.id), 0))).scalar()
+        state.read_count = select(func.coalesce(func.sum(NoticeAudienceCount.active), 0)).where(
+            NoticeAudienceCount.audience.in_(NOTICE_AUDIENCES.get(role, ()))
+        ).scalar_subquery()
+        state.updated_at = datetime.utcnow()
+        self.db.execute(delete(NoticeReceipt).where(
+            NoticeReceipt.user_id == user_id, NoticeReceipt.notice_id <= state.watermark
+        ))
+        self.db.commit()
+
+    def rebuild(self) -> int:
+        """Recompute the audience counters and every read_count from the notices and receipts"""
+        self.db.execute(delete(NoticeAudienceCount))
+        self.db.execute(pg_insert(NoticeAudienceCount).from_select(
+            ["audience", "active"],
+            select(SchoolNotices.target_audience, func.count(SchoolNotices.id))
+            .where(SchoolNotices.is_active == True, SchoolNotices.target_audience.isnot(None))
+            .group_by(SchoolNotices.target_audience),
+        ))
+        updated = 0
+        for role, audiences in NOTICE_AUDIENCES.items():
+            read = select(func.count(SchoolNotices.id)).where(
+                SchoolNotices.is_active == True,
+                SchoolNotices.target_audience.in_(audiences),
+                or_(
+                    SchoolNotices.id <= NoticeReadState.watermark,
+                    exists().where(NoticeReceipt.user_id == NoticeReadState.user_id,
+                                   NoticeReceipt.notice_id == SchoolNotices.id).correlate_except(NoticeReceipt),
+                ),
+            ).scalar_subquery()
+            updated += self.db.execute(
+                update(NoticeReadState).where(NoticeReadState.role == role).values(read_count=read)
+            ).rowcount
+        self.db.commit()
+        return updated
+
+    def add_search_index(self):
+        """Add the generated search column and its index to a school_notices table created before search"""
+        self.db.execute(text(
+            "ALTER TABLE school_notices ADD COLUMN IF NOT EXISTS search_vector tsvector "
+            f"GENERATED ALWAYS AS ({NOTICE_SEARCH_VECTOR}) STORED"
+        ))
+        self.db.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_school_notices_search ON school_notices USING gin (search_vector)"
+        ))
+        self.db.commit()
+
+
+if __name__ == "__main__":
+    import sys
+    from database import SessionLocals
+
+    if sys.argv[1:] not in (["rebuild"], ["search-index"]):
+        print("Usage: python -m repositories.notice_repository rebuild|search-index")
+        sys.exit(1)
+    db = SessionLocals["authority"]()
+    try:
+        if sys.argv[1] == "rebuild":
+            count = NoticeRepository(db).rebuild()
+            print(f"[SUCCESS] Rebuilt notice counts for {count} readers")
+        else:
+            NoticeRepository(db).add_search_index()
+            print("[SUCCESS] school_notices is searchable")
+    finally:
+        db.close()
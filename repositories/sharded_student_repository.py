@@ -0,0 +1,230 @@
+"""
+StudentRepository over the shards of shards.py.
+
+Calls about one student go to the shard holding that student's bucket.
+Listings, counts, searches and exports run on every shard in parallel and
+merge the already ordered per-shard results, so pages and limits behave as
+they would on one database. Routes get either repository through the
+get_student_repository dependency and never see the difference.
+"""
+
+import heapq
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from itertools import chain, islice
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+
+from fastapi import Depends
+from sqlalchemy import select
+from sqlalchemy.orm import Session, sessionmaker
+
+from cache import TTLCache
+from config import STUDENT_SHARD_URLS
+from database import get_student_db
+from models import Student
+from repositories.student_repository import (
+    StudentRepository, StudentListItem, StudentDirectoryItem, STUDENT_LIST_COLUMNS, attach_contacts,
+)
+from repositories.user_repository import UserRepository
+from shards import allocate_student_id, shard_engines, shard_map, sharding_enabled
+
+_executor = ThreadPoolExecutor(max_workers=max(4, 2 * len(STUDENT_SHARD_URLS)), thread_name_prefix="shard")
+_session_factories = None
+# user_id -> Student.id, so per-user lookups hit one shard after the first
+_student_ids = TTLCache(3600, maxsize=100000)
+
+
+def _student_key(row) -> str:
+    return row.student_id or ""
+
+
+def _created_at(row) -> datetime:
+    return row.created_at or datetime.min
+
+
+def _raised_at(row) -> datetime:
+    return row.raised_at or datetime.min
+
+
+def _shard_sessions() -> List[sessionmaker]:
+    global _session_factories
+    if _session_factories is None:
+        _session_factories = [sessionmaker(autocommit=False, autoflush=False, bind=engine)
+                              for engine in shard_engines()]
+    return _session_factories
+
+
+class ShardedStudentRepository:
+    def __init__(self, directory_db: Session):
+        self.directory_db = directory_db
+        self.map = shard_map()
+        self._repos = {}
+
+    def close(self):
+        for repo in self._repos.values():
+            repo.db.close()
+        self._repos.clear()
+
+    def shard(self, index: int) -> StudentRepository:
+        repo = self._repos.get(index)
+        if repo is None:
+            repo = self._repos[index] = StudentRepository(_shard_sessions()[index]())
+        return repo
+
+    def for_student(self, student_id: int) -> StudentRepository:
+        return self.shard(self.map.shard_of(student_id))
+
+    def scatter(self, call: Callable[[StudentRepository], object]) -> list:
+        """`call` on every shard in parallel, results in shard order"""
+        repos = [self.shard(index) for index in range(len(_shard_sessions()))]
+        return list(_executor.map(call, repos))
+
+    def _merged(self, call: Callable[[StudentRepository], list], key, offset: Optional[int] = None,
+                limit: Optional[int] = None, reverse: bool = False) -> list:
+        # Each shard returns its first offset + limit rows; the page is a
+        # slice of their merge
+        merged = heapq.merge(*self.scatter(call), key=key, reverse=reverse)
+        start = offset or 0
+        return list(islice(merged, start, None if limit is None else start + limit))
+
+    def create_student(self, user_id: int, student_data: dict) -> Student:
+        student_id = allocate_student_id(self.directory_db)
+        self.directory_db.commit()
+        return self.for_student(student_id).create_student(user_id, dict(student_data, id=student_id))
+
+    def update_student(self, student: Student, changes: dict) -> Student:
+        return self.for_student(student.id).update_student(student, changes)
+
+    def get_student_by_user_id(self, user_id: int) -> Optional[Student]:
+        student_id = _student_ids.get(user_id)
+        if student_id is not None:
+            return self.for_student(student_id).get_student_by_user_id(user_id)
+        found = [student for student in self.scatter(lambda repo: repo.get_student_by_user_id(user_id)) if student]
+        if found:
+            _student_ids.set(user_id, found[0].id)
+            return found[0]
+        return None
+
+    def get_student_by_id(self, student_id: int) -> Optional[Student]:
+        return self.for_student(student_id).get_student_by_id(student_id)
+
+    def get_student_by_code(self, code: str) -> Optional[Student]:
+        found = [student for student in self.scatter(lambda repo: repo.get_student_by_code(code)) if student]
+        return found[0] if found else None
+
+    def get_students_by_ids(self, student_ids: Iterable[int]):
+        by_shard = {}
+        for student_id in set(student_ids):
+            by_shard.setdefault(self.map.shard_of(student_id), []).append(student_id)
+        students = {}
+        for index, ids in by_shard.items():
+            students.update(self.shard(index).get_students_by_ids(ids))
+        return students
+
+    def list_students(self, offset: Optional[int] = None, limit: Optional[int] = None) -> List[StudentListItem]:
+        window = None if limit is None else (offset or 0) + limit
+        return self._merged(lambda repo: repo.list_students(limit=window), _student_key, offset, limit)
+
+    def iter_students(self, batch_size: int = 1000, grade: Optional[str] = None) -> Iterator[StudentListItem]:
+        """Every student (or every student in `grade`) in ID order, one open cursor per shard"""
+        shards = [self.shard(index).iter_students(batch_size, grade) for index in range(len(_shard_sessions()))]
+        return heapq.merge(*shards, key=_student_key)
+
+    def list_students_with_users(self, public_db: Optional[Session] = None) -> List[StudentDirectoryItem]:
+        query = select(*STUDENT_LIST_COLUMNS, Student.user_id).order_by(Student.student_id)
+        students = self._merged(lambda repo: repo.db.execute(query).all(), _student_key)
+        contacts = UserRepository(public_db).get_contacts_by_ids(row.user_id for row in students)
+        return [StudentDirectoryItem(*row[:-1], *contacts.get(row.user_id, (None, None))) for row in students]
+
+    def iter_students_with_users(self, public_db: Optional[Session] = None, batch_size: int = 1000):
+        query = select(*STUDENT_LIST_COLUMNS, Student.user_id).order_by(Student.student_id)
+        shards = [self.shard(index).db.execute(query, execution_options={"yield_per": batch_size})
+                  for index in range(len(_shard_sessions()))]
+        return attach_contacts(heapq.merge(*shards, key=_student_key), public_db, batch_size)
+
+    def count_students(self, grade: Optional[str] = None) -> int:
+        return sum(self.scatter(lambda repo: repo.count_students(grade)))
+
+    def get_students_in_classes(self, classes: List[Tuple[str, Optional[str]]]) -> List[StudentListItem]:
+        return self._merged(lambda repo: repo.get_students_in_classes(classes),
+                            lambda s: (s.grade or "", s.section or "", s.student_id or ""))
+
+    def get_class_marks(self, classes: List[Tuple[str, Optional[str]]], start: Optional[datetime] = None,
+                        end: Optional[datetime] = None):
+        # A student's rows all live on one shard, so concatenating keeps them together
+        return list(chain.from_iterable(self.scatter(lambda repo: repo.get_class_marks(classes, start, end))))
+
+    def get_class_attendance_summaries(self, classes: List[Tuple[str, Optional[str]]],
+                                       start: Optional[datetime] = None, end: Optional[datetime] = None):
+        summaries = {}
+        for shard_summaries in self.scatter(lambda repo: repo.get_class_attendance_summaries(classes, start, end)):
+            summaries.update(shard_summaries)
+        return summaries
+
+    def get_class_assignments(self, classes: List[Tuple[str, Optional[str]]], start: Optional[datetime] = None,
+                              end: Optional[datetime] = None):
+        return list(chain.from_iterable(self.scatter(lambda repo: repo.get_class_assignments(classes, start, end))))
+
+    def search_students(self, query: str, offset: int = 0, limit: int = 20) -> List[StudentListItem]:
+        return self._merged(lambda repo: repo.search_students(query, 0, offset + limit),
+                            _student_key, offset, limit)
+
+    def get_student_marks(self, student_id: int, start: Optional[datetime] = None, end: Optional[datetime] = None):
+        return self.for_student(student_id).get_student_marks(student_id, start, end)
+
+    def get_student_marks_with_teachers(self, student_id: int, teacher_db: Optional[Session] = None,
+                                        start: Optional[datetime] = None, end: Optional[datetime] = None):
+        return self.for_student(student_id).get_student_marks_with_teachers(student_id, teacher_db, start, end)
+
+    def get_student_attendance(self, student_id: int, start: Optional[datetime] = None,
+                               end: Optional[datetime] = None):
+        return self.for_student(student_id).get_student_attendance(student_id, start, end)
+
+    def get_attendance_summary(self, student_id: int, start: Optional[datetime] = None,
+                               end: Optional[datetime] = None):
+        return self.for_student(student_id).get_attendance_summary(student_id, start, end)
+
+    def get_recent_marks_by_uploader(self, teacher_user_id: int, limit: int = 10):
+        return self._merged(lambda repo: repo.get_recent_marks_by_uploader(teacher_user_id, limit),
+                            _created_at, 0, limit, reverse=True)
+
+    def get_recent_attendance_by_uploader(self, teacher_user_id: int, limit: int = 10):
+        return self._merged(lambda repo: repo.get_recent_attendance_by_uploader(teacher_user_id, limit),
+                            _created_at, 0, limit, reverse=True)
+
+    def get_student_assignments(self, student_id: int):
+        return self.for_student(student_id).get_student_assignments(student_id)
+
+    def create_marks(self, marks_data: dict, teacher_user_id: int):
+        return self.for_student(marks_data["student_id"]).create_marks(marks_data, teacher_user_id)
+
+    def regrade_marks(self, new_grade, start: datetime, end: datetime, chunk_rows: int, on_chunk=None) -> int:
+        # Shards regrade in parallel; progress is reported per shard as it goes
+        return sum(self.scatter(lambda repo: repo.regrade_marks(new_grade, start, end, chunk_rows, on_chunk)))
+
+    def create_attendance(self, attendance_data: dict, teacher_user_id: int):
+        return self.for_student(attendance_data["student_id"]).create_attendance(attendance_data, teacher_user_id)
+
+    def get_absence_alerts(self, limit: int):
+        return self._merged(lambda repo: repo.get_absence_alerts(limit), _raised_at, 0, limit, reverse=True)
+
+    def dismiss_absence_alert(self, student_id: int, alert_id: int, dismissed_by: int) -> bool:
+        return self.for_student(student_id).dismiss_absence_alert(student_id, alert_id, dismissed_by)
+
+    def create_assignment(self, assignment_data: dict, teacher_user_id: int):
+        return self.for_student(assignment_data["student_id"]).create_assignment(assignment_data, teacher_user_id)
+
+
+def student_repository(student_db: Session):
+    """StudentRepository, or the sharded one when the student database is sharded (close() it after use)"""
+    return ShardedStudentRepository(student_db) if sharding_enabled() else StudentRepository(student_db)
+
+
+def get_student_repository(student_db: Session = Depends(get_student_db)):
+    """Request dependency version of student_repository()"""
+    repo = student_repository(student_db)
+    try:
+        yield repo
+    finally:
+        if isinstance(repo, ShardedStudentRepository):
+            repo.close()
@@ -1,6 +1,50 @@
+from collections import namedtuple
+from sqlalchemy import and_, or_, select, func, update
 from sqlalchemy.orm import Session
-from models import Student, StudentMarks, StudentAttendance, StudentAssignments
-from typing import List
+from models import Student, StudentMarks, StudentAttendance, StudentAssignments, Teacher, PublicUser
+from config import ATTENDANCE_STORE
+from database import is_consolidated
+from partitions import ensure_partition
+from repositories.absence_repository import AbsenceAlertItem, AbsenceRepository
+from repositories.attendance_repository import AttendanceBitmapRepository, AttendanceSummary, summarize_records
+from repositories.teacher_repository import TeacherRepository
+from repositories.user_repository import UserRepository
+from datetime import datetime
+from itertools import groupby, islice
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Read model for list pages and pickers (the StudentResponse fields). Selected
+# column by column, so rows skip ORM hydration and the identity map.
+StudentListItem = namedtuple("StudentListItem", "id student_id first_name last_name grade section")
+STUDENT_LIST_COLUMNS = (Student.id, Student.student_id, Student.first_name, Student.last_name,
+                        Student.grade, Student.section)
+
+# Enriched read models with data from another logical database. In
+# consolidated mode they come from one joined query; in split mode from one
+# query per database merged in Python.
+StudentDirectoryItem = namedtuple("StudentDirectoryItem", StudentListItem._fields + ("username", "email"))
+MarkListItem = namedtuple("MarkListItem", "id subject exam_type marks_obtained total_marks grade exam_date "
+                                          "uploaded_by created_at teacher_name")
+# Rows of a whole class, fetched in one query for batch work (report cards)
+ClassMarkItem = namedtuple("ClassMarkItem", "student_id subject exam_type marks_obtained total_marks grade exam_date")
+ClassAssignmentItem = namedtuple("ClassAssignmentItem", "student_id subject assignment_title due_date status marks")
+MARK_LIST_COLUMNS = (StudentMarks.id, StudentMarks.subject, StudentMarks.exam_type, StudentMarks.marks_obtained,
+                     StudentMarks.total_marks, StudentMarks.grade, StudentMarks.exam_date,
+                     StudentMarks.uploaded_by, StudentMarks.created_at)
+
+def _in_classes(classes: List[Tuple[str, Optional[str]]]):
+    return or_(*[
+        and_(Student.grade == grade, Student.section == section) if section else Student.grade == grade
+        for grade, section in classes
+    ])
+
+def attach_contacts(rows: Iterable, public_db: Session, batch_size: int) -> Iterator[StudentDirectoryItem]:
+    """StudentDirectoryItems from (list columns..., user_id) rows, one contacts query per batch"""
+    rows = iter(rows)
+    for batch in iter(lambda: list(islice(rows, batch_size)), []):
+        contacts = UserRepository(public_db).get_contacts_by_ids(row.user_id for row in batch)
+        for row in batch:
+            yield StudentDirectoryItem(*row[:-1], *contacts.get(row.user_id, (None, None)))
 
 class StudentRepository:
     def __init__(self, db: Session):
@@ -13,38 +57,267 @@ class StudentRepository:
         self.db.refresh(student)
         return student
 
+    def update_student(self, student: Student, changes: dict) -> Student:
+        for field, value in changes.items():
+            setattr(student, field, value)
+        self.db.commit()
+        return student
+
     def get_student_by_user_id(self, user_id: int) -> Student:
         return self.db.query(Student).filter(Student.user_id == user_id).first()
 
     def get_student_by_id(self, student_id: int) -> Student:
         return self.db.query(Student).filter(Student.id == student_id).first()
 
-    def get_all_students(self) -> List[Student]:
-        return self.db.query(Student).all()
+    def get_student_by_code(self, code: str) -> Optional[Student]:
+        """Student by the school's student ID (Student.student_id)"""
+        return self.db.query(Student).filter(Student.student_id == code).first()
+
+    def get_students_by_ids(self, student_ids: Iterable[int]) -> Dict[int, StudentListItem]:
+        """Student.id -> list item for `student_ids`, in one query"""
+        student_ids = set(student_ids)
+        if not student_ids:
+            return {}
+        query = select(*STUDENT_LIST_COLUMNS).where(Student.id.in_(student_ids))
+        return {row.id: StudentListItem(*row) for row in self.db.execute(query)}
+
+    def list_students(self, offset: Optional[int] = None, limit: Optional[int] = None) -> List[StudentListItem]:
+        query = select(*STUDENT_LIST_COLUMNS).order_by(Student.student_id).offset(offset).limit(limit)
+        return [StudentListItem(*row) for row in self.db.execute(query)]
+
+    def iter_students(self, batch_size: int = 1000, grade: Optional[str] = None) -> Iterator[StudentListItem]:
+        """Every student (or every student in `grade`) in ID order, streamed in batches for exports"""
+        query = select(*STUDENT_LIST_COLUMNS).order_by(Student.student_id)
+        if grade is not None:
+            query = query.where(Student.grade == grade)
+        for row in self.db.execute(query, execution_options={"yield_per": batch_size}):
+            yield StudentListItem(*row)
+
+    def list_students_with_users(self, public_db: Optional[Session] = None) -> List[StudentDirectoryItem]:
+        """Students with their login username and email"""
+        if is_consolidated():
+            query = select(*STUDENT_LIST_COLUMNS, PublicUser.username, PublicUser.email).outerjoin(
+                PublicUser, PublicUser.id == Student.user_id
+            ).order_by(Student.student_id)
+            return [StudentDirectoryItem(*row) for row in self.db.execute(query)]
+
+        rows = self.db.execute(select(*STUDENT_LIST_COLUMNS, Student.user_id).order_by(Student.student_id)).all()
+        contacts = UserRepository(public_db).get_contacts_by_ids(row.user_id for row in rows)
+        return [StudentDirectoryItem(*row[:-1], *contacts.get(row.user_id, (None, None))) for row in rows]
+
+    def iter_students_with_users(self, public_db: Optional[Session] = None,
+                                 batch_size: int = 1000) -> Iterator[StudentDirectoryItem]:
+        """list_students_with_users() from a server-side cursor, for streamed pages"""
+        if is_consolidated():
+            query = select(*STUDENT_LIST_COLUMNS, PublicUser.username, PublicUser.email).outerjoin(
+                PublicUser, PublicUser.id == Student.user_id
+            ).order_by(Student.student_id)
+            for row in self.db.execute(query, execution_options={"yield_per": batch_size}):
+                yield StudentDirectoryItem(*row)
+            return
+
+        query = select(*STUDENT_LIST_COLUMNS, Student.user_id).order_by(Student.student_id)
+        rows = self.db.execute(query, execution_options={"yield_per": batch_size})
+        yield from attach_contacts(rows, public_db, batch_size)
+
+    def count_students(self, grade: Optional[str] = None) -> int:
+        query = select(func.count(Student.id))
+        if grade is not None:
+            query = query.where(Student.grade == grade)
+        return self.db.execute(query).scalar()
 
-    def get_student_marks(self, student_id: int) -> List[StudentMarks]:
-        return self.db.query(StudentMarks).filter(StudentMarks.student_id == student_id).all()
+    def get_students_in_classes(self, classes: List[Tuple[str, Optional[str]]]) -> List[StudentListItem]:
+        """Students in any of the (grade, section) classes; a None section means the whole grade"""
+        if not classes:
+            return []
+        query = select(*STUDENT_LIST_COLUMNS).where(_in_classes(classes)).order_by(
+            Student.grade, Student.section, Student.student_id
+        )
+        return [StudentListItem(*row) for row in self.db.execute(query)]
 
-    def get_student_attendance(self, student_id: int) -> List[StudentAttendance]:
-        return self.db.query(StudentAttendance).filter(StudentAttendance.student_id == student_id).all()
+    def get_class_marks(self, classes: List[Tuple[str, Optional[str]]], start: Optional[datetime] = None,
+                        end: Optional[datetime] = None) -> List[ClassMarkItem]:
+        """Marks of every student in the classes, by student and exam date"""
+        if not classes:
+            return []
+        query = select(StudentMarks.student_id, StudentMarks.subject, StudentMarks.exam_type,
+                       StudentMarks.marks_obtained, StudentMarks.total_marks, StudentMarks.grade,
+                       StudentMarks.exam_date).where(
+            StudentMarks.student_id.in_(select(Student.id).where(_in_classes(classes)))
+        ).order_by(StudentMarks.student_id, StudentMarks.exam_date, StudentMarks.id)
+        if start:
+            query = query.where(StudentMarks.exam_date >= start)
+        if end:
+            query = query.where(StudentMarks.exam_date < end)
+        return [ClassMarkItem(*row) for row in self.db.execute(query)]
+
+    def get_class_attendance_summaries(self, classes: List[Tuple[str, Optional[str]]],
+                                       start: Optional[datetime] = None,
+                                       end: Optional[datetime] = None) -> Dict[int, AttendanceSummary]:
+        """Attendance summary of every student in the classes who has any, by Student.id"""
+        if not classes:
+            return {}
+        student_ids = select(Student.id).where(_in_classes(classes))
+        if ATTENDANCE_STORE == "bitmap":
+            return AttendanceBitmapRepository(self.db).get_summaries(student_ids, start, end)
+        query = select(StudentAttendance.student_id, StudentAttendance.date, StudentAttendance.status).where(
+            StudentAttendance.student_id.in_(student_ids)
+        ).order_by(StudentAttendance.student_id)
+        if start:
+            query = query.where(StudentAttendance.date >= start)
+        if end:
+            query = query.where(StudentAttendance.date < end)
+        rows = self.db.execute(query, execution_options={"yield_per": 10000})
+        return {student_id: summarize_records(records)
+                for student_id, records in groupby(rows, key=lambda row: row.student_id)}
+
+    def get_class_assignments(self, classes: List[Tuple[str, Optional[str]]], start: Optional[datetime] = None,
+                              end: Optional[datetime] = None) -> List[ClassAssignmentItem]:
+        """Assignments set in [start, end) for every student in the classes"""
+        if not classes:
+            return []
+        query = select(StudentAssignments.student_id, StudentAssignments.subject,
+                       StudentAssignments.assignment_title, StudentAssignments.due_date,
+                       StudentAssignments.status, StudentAssignments.marks).where(
+            StudentAssignments.student_id.in_(select(Student.id).where(_in_classes(classes)))
+        ).order_by(StudentAssignments.student_id, StudentAssignments.due_date)
+        if start:
+            query = query.where(StudentAssignments.assignment_date >= start)
+        if end:
+            query = query.where(StudentAssignments.assignment_date < end)
+        return [ClassAssignmentItem(*row) for row in self.db.execute(query)]
+
+    def search_students(self, query: str, offset: int = 0, limit: int = 20) -> List[StudentListItem]:
+        """Students whose ID or name contains `query`, ordered by student ID"""
+        pattern = "%" + query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        full_name = Student.first_name + " " + Student.last_name
+        statement = select(*STUDENT_LIST_COLUMNS).where(or_(
+            Student.student_id.ilike(pattern, escape="\\"),
+            full_name.ilike(pattern, escape="\\"),
+        )).order_by(Student.student_id).offset(offset).limit(limit)
+        return [StudentListItem(*row) for row in self.db.execute(statement)]
+
+    # Passing a date range lets PostgreSQL prune the partitions outside it
+    def get_student_marks(self, student_id: int, start: Optional[datetime] = None,
+                          end: Optional[datetime] = None) -> List[StudentMarks]:
+        query = self.db.query(StudentMarks).filter(StudentMarks.student_id == student_id)
+        if start:
+            query = query.filter(StudentMarks.exam_date >= start)
+        if end:
+            query = query.filter(StudentMarks.exam_date < end)
+        return query.all()
+
+    def get_student_marks_with_teachers(self, student_id: int, teacher_db: Optional[Session] = None,
+                                        start: Optional[datetime] = None,
+                                        end: Optional[datetime] = None) -> List[MarkListItem]:
+        """Marks in exam date order with the uploading teacher's name"""
+        query = select(*MARK_LIST_COLUMNS).where(StudentMarks.student_id == student_id).order_by(
+            StudentMarks.exam_date, StudentMarks.id
+        )
+        if start:
+            query = query.where(StudentMarks.exam_date >= start)
+        if end:
+            query = query.where(StudentMarks.exam_date < end)
+
+        if is_consolidated():
+            query = query.add_columns(Teacher.first_name + " " + Teacher.last_name).outerjoin(
+                Teacher, Teacher.user_id == StudentMarks.uploaded_by
+            )
+            return [MarkListItem(*row) for row in self.db.execute(query)]
+
+        rows = self.db.execute(query).all()
+        names = TeacherRepository(teacher_db).get_names_by_user_ids(row.uploaded_by for row in rows)
+        return [MarkListItem(*row, names.get(row.uploaded_by)) for row in rows]
+
+    def get_student_attendance(self, student_id: int, start: Optional[datetime] = None,
+                               end: Optional[datetime] = None) -> List[StudentAttendance]:
+        if ATTENDANCE_STORE == "bitmap":
+            return AttendanceBitmapRepository(self.db).get_attendance(student_id, start, end)
+        query = self.db.query(StudentAttendance).filter(StudentAttendance.student_id == student_id)
+        if start:
+            query = query.filter(StudentAttendance.date >= start)
+        if end:
+            query = query.filter(StudentAttendance.date < end)
+        return query.all()
+
+    def get_attendance_summary(self, student_id: int, start: Optional[datetime] = None,
+                               end: Optional[datetime] = None) -> AttendanceSummary:
+        if ATTENDANCE_STORE == "bitmap":
+            return AttendanceBitmapRepository(self.db).get_summary(student_id, start, end)
+        return summarize_records(self.get_student_attendance(student_id, start, end))
+
+    def get_recent_marks_by_uploader(self, teacher_user_id: int, limit: int = 10) -> List[StudentMarks]:
+        return self.db.query(StudentMarks).filter(
+            StudentMarks.uploaded_by == teacher_user_id
+        ).order_by(StudentMarks.created_at.desc()).limit(limit).all()
+
+    def get_recent_attendance_by_uploader(self, teacher_user_id: int, limit: int = 10) -> List[StudentAttendance]:
+        if ATTENDANCE_STORE == "bitmap":
+            return AttendanceBitmapRepository(self.db).get_recent_by_uploader(teacher_user_id, limit)
+        return self.db.query(StudentAttendance).filter(
+            StudentAttendance.uploaded_by == teacher_user_id
+        ).order_by(StudentAttendance.created_at.desc()).limit(limit).all()
 
     def get_student_assignments(self, student_id: int) -> List[StudentAssignments]:
         return self.db.query(StudentAssignments).filter(StudentAssignments.student_id == student_id).all()
 
     def create_marks(self, marks_data: dict, teacher_user_id: int) -> StudentMarks:
+        ensure_partition(self.db.get_bind(), "student_marks", marks_data["exam_date"])
         marks = StudentMarks(**marks_data, uploaded_by=teacher_user_id)
         self.db.add(marks)
         self.db.commit()
         self.db.refresh(marks)
         return marks
 
+    def regrade_marks(self, new_grade, start: datetime, end: datetime, chunk_rows: int,
+                      on_chunk: Optional[Callable[[float, int], None]] = None) -> int:
+        """
+        Set grade to the SQL expression `new_grade` on every mark with an
+        exam date in [start, end), one UPDATE and commit per `chunk_rows` ids.
+        Rows whose grade does not change are not written. Returns the number
+        of marks updated; on_chunk(fraction done, updated so far) after each
+        chunk.
+        """
+        in_range = (StudentMarks.exam_date >= start, StudentMarks.exam_date < end)
+        low, high = self.db.execute(select(func.min(StudentMarks.id), func.max(StudentMarks.id)).where(*in_range)).one()
+        self.db.commit()
+        if low is None:
+            return 0
+        updated = 0
+        for chunk_start in range(low, high + 1, chunk_rows):
+            updated += self.db.execute(
+                update(StudentMarks).where(
+                    *in_range,
+                    StudentMarks.id >= chunk_start,
+                    StudentMarks.id < chunk_start + chunk_rows,
+                    StudentMarks.total_marks > 0,
+                    StudentMarks.grade.is_distinct_from(new_grade),
+                ).values(grade=new_grade).execution_options(synchronize_session=False)
+            ).rowcount
+            self.db.commit()
+            if on_chunk:
+                on_chunk(min(chunk_start + chunk_rows - low, high + 1 - low) / (high + 1 - low), updated)
+        return updated
+
     def create_attendance(self, attendance_data: dict, teacher_user_id: int) -> StudentAttendance:
+        # The absence windows move in the same transaction as the attendance
+        AbsenceRepository(self.db).observe(attendance_data["student_id"], attendance_data["date"],
+                                           attendance_data["status"], attendance_data.get("subject"))
+        if ATTENDANCE_STORE == "bitmap":
+            return AttendanceBitmapRepository(self.db).record(uploaded_by=teacher_user_id, **attendance_data)
+        ensure_partition(self.db.get_bind(), "student_attendance", attendance_data["date"])
         attendance = StudentAttendance(**attendance_data, uploaded_by=teacher_user_id)
         self.db.add(attendance)
         self.db.commit()
         self.db.refresh(attendance)
         return attendance
 
+    def get_absence_alerts(self, limit: int) -> List[AbsenceAlertItem]:
+        return AbsenceRepository(self.db).get_open_alerts(limit)
+
+    def dismiss_absence_alert(self, student_id: int, alert_id: int, dismissed_by: int) -> bool:
+        return AbsenceRepository(self.db).dismiss(student_id, alert_id, dismissed_by)
+
     def create_assignment(self, assignment_data: dict, teacher_user_id: int) -> StudentAssignments:
         assignment = StudentAssignments(**assignment_data, uploaded_by=teacher_user_id)
         self.db.add(assignment)
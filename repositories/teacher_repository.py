@@ -0,0 +1,50 @@
+from collections import namedtuple
+from sqlalchemy import select, func
+from sqlalchemy.orm import Session
+from models import Teacher, TeacherSubjects
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Read models for list pages (the TeacherResponse fields) and class
+# assignments, selected column by column without ORM hydration
+TeacherListItem = namedtuple("TeacherListItem", "id teacher_id first_name last_name subjects")
+TEACHER_LIST_COLUMNS = (Teacher.id, Teacher.teacher_id, Teacher.first_name, Teacher.last_name, Teacher.subjects)
+ClassAssignment = namedtuple("ClassAssignment", "subject_name grade section")
+
+class TeacherRepository:
+    def __init__(self, db: Session):
+        self.db = db
+
+    def get_teacher_by_user_id(self, user_id: int) -> Optional[Teacher]:
+        return self.db.query(Teacher).filter(Teacher.user_id == user_id).first()
+
+    def get_teacher_by_code(self, code: str) -> Optional[Teacher]:
+        """Teacher by the school's teacher ID (Teacher.teacher_id)"""
+        return self.db.query(Teacher).filter(Teacher.teacher_id == code).first()
+
+    def list_teachers(self, offset: Optional[int] = None, limit: Optional[int] = None) -> List[TeacherListItem]:
+        query = select(*TEACHER_LIST_COLUMNS).order_by(Teacher.teacher_id).offset(offset).limit(limit)
+        return [TeacherListItem(*row) for row in self.db.execute(query)]
+
+    def iter_teachers(self, batch_size: int = 1000) -> Iterator[TeacherListItem]:
+        """Every teacher in ID order from a server-side cursor, for streamed pages"""
+        query = select(*TEACHER_LIST_COLUMNS).order_by(Teacher.teacher_id)
+        for row in self.db.execute(query, execution_options={"yield_per": batch_size}):
+            yield TeacherListItem(*row)
+
+    def count_teachers(self) -> int:
+        return self.db.execute(select(func.count(Teacher.id))).scalar()
+
+    def get_class_assignments(self, teacher_user_id: int) -> List[ClassAssignment]:
+        """(subject, grade, section) rows from teacher_subjects for the teacher with this user id"""
+        query = select(TeacherSubjects.subject_name, TeacherSubjects.grade, TeacherSubjects.section).join(
+            Teacher, Teacher.id == TeacherSubjects.teacher_id
+        ).where(Teacher.user_id == teacher_user_id)
+        return [ClassAssignment(*row) for row in self.db.execute(query)]
+
+    def get_names_by_user_ids(self, user_ids: Iterable[int]) -> Dict[int, str]:
+        """user_id -> "First Last" for the teachers among `user_ids`, in one query"""
+        user_ids = {user_id for user_id in user_ids if user_id is not None}
+        if not user_ids:
+            return {}
+        query = select(Teacher.user_id, Teacher.first_name, Teacher.last_name).where(Teacher.user_id.in_(user_ids))
+        return {user_id: f"{first_name} {last_name}" for user_id, first_name, last_name in self.db.execute(query)}
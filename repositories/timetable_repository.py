@@ -0,0 +1,129 @@
+"""
+Storage for timetable.py: the inputs (TeacherSubjects, subject_periods,
+timetable_rooms, teacher_unavailability) as a Problem, and the solved week
+in timetable_entries.
+"""
+
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import delete, insert, select, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from config import TIMETABLE_DAYS, TIMETABLE_PERIODS_PER_DAY, TIMETABLE_DEFAULT_PERIODS
+from models import SubjectPeriods, Teacher, TeacherSubjects, TeacherUnavailability, TimetableEntry, TimetableRoom
+from timetable import Lesson, Problem, Requirement
+
+
+def _entry_row(lesson: Lesson, now: datetime) -> dict:
+    return {"grade": lesson.grade, "section": lesson.section, "day": lesson.day, "period": lesson.period,
+            "subject_name": lesson.subject, "teacher_id": lesson.teacher_id, "room_type": lesson.room_type,
+            "updated_at": now}
+
+
+class TimetableRepository:
+    def __init__(self, db: Session):
+        self.db = db
+
+    def load_problem(self) -> Problem:
+        """
+        The week to solve. A class with several teachers for one subject is
+        taught by the first one assigned.
+        """
+        periods = {(row.grade, row.subject_name): row for row in self.db.query(SubjectPeriods)}
+        requirements = {}
+        assignments = self.db.execute(select(
+            TeacherSubjects.teacher_id, TeacherSubjects.subject_name, TeacherSubjects.grade, TeacherSubjects.section
+        ).where(TeacherSubjects.teacher_id.isnot(None)).order_by(TeacherSubjects.id))
+        for teacher_id, subject, grade, section in assignments:
+            key = (grade, section or None, subject)
+            if key in requirements:
+                continue
+            setting = periods.get((grade, subject))
+            count = setting.periods_per_week if setting else TIMETABLE_DEFAULT_PERIODS
+            if count > 0:
+                requirements[key] = Requirement(grade, section or None, subject, teacher_id, count,
+                                                setting.room_type if setting else None)
+
+        unavailable: Dict[int, int] = {}
+        for teacher_id, day, period in self.db.execute(select(
+            TeacherUnavailability.teacher_id, TeacherUnavailability.day, TeacherUnavailability.period
+        )):
+            if 0 <= day < TIMETABLE_DAYS and 0 <= period < TIMETABLE_PERIODS_PER_DAY:
+                unavailable[teacher_id] = unavailable.get(teacher_id, 0) | 1 << (day * TIMETABLE_PERIODS_PER_DAY
+                                                                                 + period)
+        rooms = {row.room_type: row.rooms for row in self.db.query(TimetableRoom)}
+        return Problem(TIMETABLE_DAYS, TIMETABLE_PERIODS_PER_DAY, list(requirements.values()), rooms, unavailable)
+
+    def add_unavailability(self, teacher_id: int, slots: Iterable[Tuple[int, int]], reason: Optional[str] = None):
+        rows = [{"teacher_id": teacher_id, "day": day, "period": period, "reason": reason} for day, period in slots]
+        if rows:
+            self.db.execute(pg_insert(TeacherUnavailability).values(rows).on_conflict_do_nothing(
+                index_elements=["teacher_id", "day", "period"]
+            ))
+            self.db.commit()
+
+    def get_unavailability(self, teacher_id: int) -> List[TeacherUnavailability]:
+        return self.db.query(TeacherUnavailability).filter(TeacherUnavailability.teacher_id == teacher_id).order_by(
+            TeacherUnavailability.day, TeacherUnavailability.period
+        ).all()
+
+    def get_lessons(self) -> List[Lesson]:
+        rows = self.db.execute(select(
+            TimetableEntry.grade, TimetableEntry.section, TimetableEntry.day, TimetableEntry.period,
+            TimetableEntry.subject_name, TimetableEntry.teacher_id, TimetableEntry.room_type,
+        ))
+        return [Lesson(*row) for row in rows]
+
+    def replace_lessons(self, lessons: List[Lesson]):
+        """Swap in a whole new timetable in one transaction"""
+        now = datetime.utcnow()
+        self.db.execute(delete(TimetableEntry))
+        if lessons:
+            self.db.execute(insert(TimetableEntry), [_entry_row(lesson, now) for lesson in lessons])
+        self.db.commit()
+
+    def apply_lessons(self, current: Iterable[Lesson], lessons: Iterable[Lesson]) -> int:
+        """Write only the difference between `current` and `lessons`; returns the number of changed rows"""
+        old, new = set(current), set(lessons)
+        removed, added = old - new, new - old
+        # A class has one lesson per period, so (grade, section, day, period) identifies a row
+        keyed = [(l.grade, l.section, l.day, l.period) for l in removed if l.section is not None]
+        if keyed:
+            self.db.execute(delete(TimetableEntry).where(tuple_(
+                TimetableEntry.grade, TimetableEntry.section, TimetableEntry.day, TimetableEntry.period
+            ).in_(keyed)))
+        # tuple IN never matches a NULL section
+        for lesson in removed:
+            if lesson.section is None:
+                self.db.execute(delete(TimetableEntry).where(
+                    TimetableEntry.grade == lesson.grade, TimetableEntry.section.is_(None),
+                    TimetableEntry.day == lesson.day, TimetableEntry.period == lesson.period,
+                ))
+        if added:
+            now = datetime.utcnow()
+            self.db.execute(insert(TimetableEntry), [_entry_row(lesson, now) for lesson in added])
+        self.db.commit()
+        return len(removed) + len(added)
+
+    def get_classes(self) -> List[Tuple[str, Optional[str]]]:
+        """(grade, section) of every class in the timetable"""
+        return list(self.db.execute(select(TimetableEntry.grade, TimetableEntry.section).distinct().order_by(
+            TimetableEntry.grade, TimetableEntry.section
+        )).tuples())
+
+    def get_class_week(self, grade: str, section: Optional[str]) -> List[Tuple[TimetableEntry, Optional[str]]]:
+        """A class's lessons with the teacher's name"""
+        return list(self.db.execute(
+            select(TimetableEntry, Teacher.first_name + " " + Teacher.last_name)
+            .outerjoin(Teacher, Teacher.id == TimetableEntry.teacher_id)
+            .where(TimetableEntry.grade == grade, TimetableEntry.section.is_(None) if section is None
+                   else TimetableEntry.section == section)
+            .order_by(TimetableEntry.day, TimetableEntry.period)
+        ).tuples())
+
+    def get_teacher_week(self, teacher_id: int) -> List[TimetableEntry]:
+        return self.db.query(TimetableEntry).filter(TimetableEntry.teacher_id == teacher_id).order_by(
+            TimetableEntry.day, TimetableEntry.period
+        ).all()
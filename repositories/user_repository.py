@@ -1,5 +1,7 @@
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 from models import PublicUser
+from typing import Dict, Iterable, Tuple
 from passlib.context import CryptContext
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -27,6 +29,14 @@ class UserRepository:
     def get_user_by_id(self, user_id: int) -> PublicUser:
         return self.db.query(PublicUser).filter(PublicUser.id == user_id).first()
 
+    def get_contacts_by_ids(self, user_ids: Iterable[int]) -> Dict[int, Tuple[str, str]]:
+        """user_id -> (username, email) for `user_ids`, in one query"""
+        user_ids = {user_id for user_id in user_ids if user_id is not None}
+        if not user_ids:
+            return {}
+        query = select(PublicUser.id, PublicUser.username, PublicUser.email).where(PublicUser.id.in_(user_ids))
+        return {user_id: (username, email) for user_id, username, email in self.db.execute(query)}
+
     def verify_password(self, plain_password: str, hashed_password: str) -> bool:
         return pwd_context.verify(plain_password, hashed_password)
 
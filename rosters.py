@@ -0,0 +1,83 @@
+"""
+Teacher rosters: the students in the classes a teacher takes, worked out
+from teacher_subjects (subject, grade, section) and cached per teacher so
+the forms and dashboard do not load the whole school on every request.
+Students outside the roster are reached through the paginated search
+endpoint instead.
+"""
+
+from dataclasses import dataclass, field
+from typing import FrozenSet, List, Optional
+
+from sqlalchemy.orm import Session
+
+from cache import TTLCache
+from config import ROSTER_CACHE_SECONDS
+from database import current_databases
+from repositories.student_repository import StudentRepository, StudentListItem
+from repositories.teacher_repository import TeacherRepository
+
+
+@dataclass
+class RosterClass:
+    grade: str
+    section: Optional[str]  # None means every section of the grade
+    subjects: List[str]
+    students: List[StudentListItem] = field(default_factory=list)
+
+    @property
+    def label(self) -> str:
+        return f"Grade {self.grade} - {self.section}" if self.section else f"Grade {self.grade}"
+
+
+@dataclass
+class Roster:
+    classes: List[RosterClass]
+    students: List[StudentListItem]
+    student_ids: FrozenSet[int]
+
+    @property
+    def subjects(self) -> List[str]:
+        return sorted({subject for roster_class in self.classes for subject in roster_class.subjects})
+
+    def __contains__(self, student_id: int) -> bool:
+        return student_id in self.student_ids
+
+
+_rosters = TTLCache(ROSTER_CACHE_SECONDS)
+
+
+def build_roster(teacher_db: Session, student_repo: StudentRepository, teacher_user_id: int) -> Roster:
+    # Plain tuples throughout, so cached rosters never hold on to a session
+    rows = TeacherRepository(teacher_db).get_class_assignments(teacher_user_id)
+
+    classes = {}
+    for subject, grade, section in rows:
+        if not grade:
+            continue
+        roster_class = classes.setdefault((grade, section or None), RosterClass(grade, section or None, []))
+        if subject and subject not in roster_class.subjects:
+            roster_class.subjects.append(subject)
+
+    students = {}
+    if classes:
+        for student in student_repo.get_students_in_classes(list(classes)):
+            students[student.id] = student
+            for key in ((student.grade, student.section), (student.grade, None)):
+                if key in classes:
+                    classes[key].students.append(student)
+
+    ordered = sorted(classes.values(), key=lambda c: (c.grade, c.section or ""))
+    return Roster(ordered, sorted(students.values(), key=lambda s: (s.grade or "", s.section or "", s.student_id or "")),
+                  frozenset(students))
+
+
+def get_roster(teacher_db: Session, student_repo: StudentRepository, teacher_user_id: int) -> Roster:
+    """Cached roster of the teacher with this user id"""
+    key = (current_databases().name, teacher_user_id)
+    return _rosters.get_or_set(key, lambda: build_roster(teacher_db, student_repo, teacher_user_id))
+
+
+def invalidate_rosters(teacher_user_id: Optional[int] = None):
+    """Call when class assignments or student grade/section change"""
+    _rosters.invalidate(None if teacher_user_id is None else (current_databases().name, teacher_user_id))
@@ -1,18 +1,21 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Form, Request
 from fastapi.responses import HTMLResponse, RedirectResponse
-from fastapi.templating import Jinja2Templates
 from sqlalchemy.orm import Session
 from datetime import datetime, timedelta
 from jose import JWTError, jwt
 from starlette.middleware.sessions import SessionMiddleware
 
-from database import get_public_db, get_student_db, get_teacher_db, get_authority_db
+from audit import audit
+from database import current_databases, get_public_db, get_teacher_db, get_authority_db
 from models import Teacher, Student, Authority
+from repositories.sharded_student_repository import get_student_repository
+from repositories.student_repository import StudentRepository
 from repositories.user_repository import UserRepository
+from session_profile import remember_profile
 from tables import UserCreate, UserLogin, Token
 from config import SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES
+from templating import templates
 
-templates = Jinja2Templates(directory="templates")
 router = APIRouter()
 
 def create_access_token(data: dict, expires_delta: timedelta = None):
@@ -29,6 +32,9 @@ def get_current_user(request: Request):
     user_id = request.session.get('user_id')
     if not user_id:
         return None
+    # A session belongs to the school it logged in to (tenants.py)
+    if request.session.get('tenant', 'default') != current_databases().name:
+        return None
     return user_id
 
 def require_auth(request: Request):
@@ -61,7 +67,7 @@ async def signup(
     last_name: str = Form(...),
     phone: str = Form(...),
     public_db: Session = Depends(get_public_db),
-    student_db: Session = Depends(get_student_db),
+    student_repo: StudentRepository = Depends(get_student_repository),
     teacher_db: Session = Depends(get_teacher_db),
     authority_db: Session = Depends(get_authority_db)
 ):
@@ -79,20 +85,17 @@ async def signup(
     
     # Create role-specific entry
     if role == "student":
-        student = Student(
-            user_id=user.id,
-            student_id=f"STU{user.id:04d}",
-            first_name=first_name,
-            last_name=last_name,
-            grade="",  # To be filled later
-            section="",
-            phone=phone,
-            address="",
-            guardian_name="",
-            guardian_phone=""
-        )
-        student_db.add(student)
-        student_db.commit()
+        student_repo.create_student(user.id, {
+            "student_id": f"STU{user.id:04d}",
+            "first_name": first_name,
+            "last_name": last_name,
+            "grade": "",  # To be filled later
+            "section": "",
+            "phone": phone,
+            "address": "",
+            "guardian_name": "",
+            "guardian_phone": ""
+        })
     elif role == "teacher":
         teacher = Teacher(
             user_id=user.id,
@@ -117,6 +120,9 @@ async def signup(
         authority_db.add(authority)
         authority_db.commit()
     
+    audit(request, "user.signup", "public_users", user.id,
+          after={"username": username, "email": email, "role": role}, actor_id=user.id, actor_role=role)
+    
     return RedirectResponse(url="/login?msg=Registration successful", status_code=303)
 
 @router.post("/login")
@@ -124,7 +130,10 @@ async def login(
     request: Request,
     username: str = Form(...),
     password: str = Form(...),
-    public_db: Session = Depends(get_public_db)
+    public_db: Session = Depends(get_public_db),
+    student_repo: StudentRepository = Depends(get_student_repository),
+    teacher_db: Session = Depends(get_teacher_db),
+    authority_db: Session = Depends(get_authority_db)
 ):
     user_repo = UserRepository(public_db)
     user = user_repo.authenticate_user(username, password)
@@ -139,6 +148,15 @@ async def login(
     request.session['user_id'] = user.id
     request.session['username'] = user.username
     request.session['role'] = user.role
+    request.session['tenant'] = current_databases().name
+    
+    # Snapshot the role profile so later requests need not look it up
+    profile_models = {"teacher": (teacher_db, Teacher), "authority": (authority_db, Authority)}
+    if user.role == "student":
+        remember_profile(request, user.role, student_repo.get_student_by_user_id(user.id))
+    elif user.role in profile_models:
+        db, model = profile_models[user.role]
+        remember_profile(request, user.role, db.query(model).filter(model.user_id == user.id).first())
     
     # Redirect based on role
     if user.role == "student":
@@ -1,36 +1,77 @@
 from fastapi import APIRouter, Depends, HTTPException, Request, Form
 from fastapi.responses import HTMLResponse, RedirectResponse
-from fastapi.templating import Jinja2Templates
+from sqlalchemy import func, select
 from sqlalchemy.orm import Session
+from collections import namedtuple
 from datetime import datetime
+from decimal import Decimal, InvalidOperation
 from typing import List, Optional
+from urllib.parse import quote
+import time
 
-from database import get_authority_db, get_student_db, get_teacher_db, get_public_db
-from models import Authority, SchoolNotices, FeeStructure, Student, Teacher
+from academic_calendar import academic_year_bounds, academic_year_of
+from config import (
+    ABSENCE_ALERT_RATE, ABSENCE_ALERTS_SHOWN, ABSENCE_WINDOW_DAYS, STREAM_BATCH_ROWS, TIMETABLE_PERIODS_PER_DAY,
+)
+from audit import audit
+from database import get_authority_db, get_teacher_db
+from models import Authority, SchoolNotices, FeeStructure
+from repositories.fee_repository import FeeRepository
+from repositories.grading_repository import GradingRepository
+from repositories.notice_repository import NoticeRepository
+from repositories.student_repository import StudentRepository
+from repositories.sharded_student_repository import (
+    ShardedStudentRepository, get_student_repository, student_repository,
+)
+from repositories.teacher_repository import TeacherRepository
+from repositories.timetable_repository import TimetableRepository
 from repositories.user_repository import UserRepository
+import exports  # noqa: F401  (registers the job handlers)
+import reports  # noqa: F401
+from grading import DEFAULT_SCALE, invalidate_scales, parse_bands
+from jobs import enqueue
+from permissions import require_role
 from routes.auth import require_auth
+from routes.notices import search_page
+from session_profile import current_profile
+from streaming import stream_template, streamed_rows
+from templating import templates
+from timetable import DAY_NAMES, reschedule
 
-templates = Jinja2Templates(directory="templates")
-router = APIRouter()
+router = APIRouter(dependencies=[Depends(require_role("authority"))])
+
+# Summary cards on the notices page
+NoticeStats = namedtuple("NoticeStats", "active high everyone total")
+
+
+def _student_directory(student_db: Session, public_db: Session):
+    repo = student_repository(student_db)
+    try:
+        yield from repo.iter_students_with_users(public_db, STREAM_BATCH_ROWS)
+    finally:
+        if isinstance(repo, ShardedStudentRepository):
+            repo.close()
 
 @router.get("/dashboard", response_class=HTMLResponse)
 async def authority_dashboard(
     request: Request,
     authority_db: Session = Depends(get_authority_db),
-    student_db: Session = Depends(get_student_db),
-    teacher_db: Session = Depends(get_teacher_db),
-    public_db: Session = Depends(get_public_db)
+    student_repo: StudentRepository = Depends(get_student_repository),
+    teacher_db: Session = Depends(get_teacher_db)
 ):
     user_id = require_auth(request)
     
-    # Get authority data
-    authority = authority_db.query(Authority).filter(Authority.user_id == user_id).first()
+    # Who the caller is comes from the session snapshot
+    authority = current_profile(
+        request, "authority",
+        lambda: authority_db.query(Authority).filter(Authority.user_id == user_id).first()
+    )
     if not authority:
         raise HTTPException(status_code=404, detail="Authority profile not found")
     
     # Get statistics
-    total_students = student_db.query(Student).count()
-    total_teachers = teacher_db.query(Teacher).count()
+    total_students = student_repo.count_students()
+    total_teachers = TeacherRepository(teacher_db).count_teachers()
     active_notices = authority_db.query(SchoolNotices).filter(SchoolNotices.is_active == True).count()
     
     # Get recent notices
@@ -38,20 +79,32 @@ async def authority_dashboard(
         SchoolNotices.created_by == user_id
     ).order_by(SchoolNotices.created_at.desc()).limit(5).all()
     
-    # Get user info
-    user_repo = UserRepository(public_db)
-    user = user_repo.get_user_by_id(user_id)
-    
     return templates.TemplateResponse("authority_dashboard.html", {
         "request": request,
         "authority": authority,
-        "user": user,
         "total_students": total_students,
         "total_teachers": total_teachers,
         "active_notices": active_notices,
-        "recent_notices": recent_notices
+        "recent_notices": recent_notices,
+        "absence_alerts": student_repo.get_absence_alerts(ABSENCE_ALERTS_SHOWN),
+        "absence_alert_rate": ABSENCE_ALERT_RATE,
+        "absence_window_days": ABSENCE_WINDOW_DAYS
     })
 
+@router.post("/absence-alerts/{alert_id}/dismiss")
+async def dismiss_absence_alert(
+    request: Request,
+    alert_id: int,
+    student_id: int = Form(...),
+    student_repo: StudentRepository = Depends(get_student_repository)
+):
+    user_id = require_auth(request)
+    
+    if student_repo.dismiss_absence_alert(student_id, alert_id, user_id):
+        audit(request, "absence_alert.dismiss", "absence_alerts", alert_id, after={"student_id": student_id})
+    
+    return RedirectResponse(url="/authority/dashboard", status_code=303)
+
 @router.get("/notices", response_class=HTMLResponse)
 async def manage_notices(
     request: Request,
@@ -59,13 +112,41 @@ async def manage_notices(
 ):
     user_id = require_auth(request)
     
-    notices = authority_db.query(SchoolNotices).order_by(SchoolNotices.created_at.desc()).all()
+    # The list is streamed; the summary cards come from one aggregate query
+    notice_stats = authority_db.execute(select(
+        func.count(SchoolNotices.id).filter(SchoolNotices.is_active == True),
+        func.count(SchoolNotices.id).filter(SchoolNotices.priority == "high"),
+        func.count(SchoolNotices.id).filter(SchoolNotices.target_audience == "all"),
+        func.count(SchoolNotices.id),
+    )).one()
+    notices = streamed_rows(request, ["authority"], lambda db: db.query(SchoolNotices).order_by(
+        SchoolNotices.created_at.desc()
+    ).yield_per(STREAM_BATCH_ROWS))
     
-    return templates.TemplateResponse("authority_notices.html", {
+    return stream_template("authority_notices.html", {
         "request": request,
-        "notices": notices
+        "notices": notices,
+        "notice_stats": NoticeStats(*notice_stats)
     })
 
+@router.get("/notices/search", response_class=HTMLResponse)
+async def search_all_notices(
+    request: Request,
+    q: str = "",
+    audience: Optional[str] = None,
+    priority: Optional[str] = None,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    page: int = 1,
+    authority_db: Session = Depends(get_authority_db)
+):
+    user_id = require_auth(request)
+    
+    # Every notice, inactive ones included
+    audiences = [audience] if audience else ["all", "students", "teachers"]
+    return search_page(request, authority_db, audiences, False, q, priority, start, end, page,
+                       "/authority/notices/search", audience=audience)
+
 @router.get("/add-notice", response_class=HTMLResponse)
 async def add_notice_form(request: Request):
     user_id = require_auth(request)
@@ -99,8 +180,15 @@ async def add_notice(
         created_by=user_id
     )
     
-    authority_db.add(notice)
-    authority_db.commit()
+    # Also counts it in the readers' unread badges
+    notice_id = NoticeRepository(authority_db).add_notice(notice).id
+    audit(request, "notice.create", "school_notices", notice_id, after={
+        "title": title,
+        "content": content,
+        "priority": priority,
+        "target_audience": target_audience,
+        "expires_at": expires_datetime
+    })
     
     return RedirectResponse(url="/authority/notices?msg=Notice added successfully", status_code=303)
 
@@ -112,10 +200,12 @@ async def toggle_notice(
 ):
     user_id = require_auth(request)
     
-    notice = authority_db.query(SchoolNotices).filter(SchoolNotices.id == notice_id).first()
+    notice = authority_db.query(SchoolNotices).filter(SchoolNotices.id == notice_id).with_for_update().first()
     if notice:
-        notice.is_active = not notice.is_active
-        authority_db.commit()
+        was_active = notice.is_active
+        NoticeRepository(authority_db).set_active(notice, not was_active)
+        audit(request, "notice.toggle", "school_notices", notice_id,
+              before={"is_active": was_active}, after={"is_active": not was_active})
     
     return RedirectResponse(url="/authority/notices", status_code=303)
 
@@ -161,34 +251,333 @@ async def add_fee(
     )
     
     authority_db.add(fee)
+    authority_db.flush()
+    fee_id = fee.id
     authority_db.commit()
+    audit(request, "fee_structure.create", "fee_structure", fee_id, after={
+        "grade": grade,
+        "fee_type": fee_type,
+        "amount": amount,
+        "academic_year": academic_year
+    })
     
     return RedirectResponse(url="/authority/fee-structure?msg=Fee structure added successfully", status_code=303)
 
-@router.get("/students", response_class=HTMLResponse)
-async def view_all_students(
+@router.get("/grading", response_class=HTMLResponse)
+async def grading_policies(
+    request: Request,
+    year: Optional[str] = None,
+    error: Optional[str] = None,
+    authority_db: Session = Depends(get_authority_db)
+):
+    user_id = require_auth(request)
+    
+    repo = GradingRepository(authority_db)
+    academic_year = (year or "").strip() or academic_year_of()
+    policies = repo.get_policy_history(academic_year)
+    
+    return templates.TemplateResponse("authority_grading.html", {
+        "request": request,
+        "academic_year": academic_year,
+        "academic_years": sorted(set(repo.get_academic_years()) | {academic_year_of(), academic_year}, reverse=True),
+        "policies": policies,
+        "has_year_policy": any(policy.exam_type is None and policy.is_active for policy in policies),
+        "default_bands": DEFAULT_SCALE.bands,
+        "error": error
+    })
+
+@router.post("/grading")
+async def save_grading_policy(
     request: Request,
-    student_db: Session = Depends(get_student_db)
+    academic_year: str = Form(...),
+    exam_type: Optional[str] = Form(None),
+    bands: str = Form(...),
+    regrade: bool = Form(False),
+    authority_db: Session = Depends(get_authority_db)
+):
+    user_id = require_auth(request)
+    
+    academic_year = academic_year.strip()
+    exam_type = (exam_type or "").strip() or None
+    try:
+        academic_year_bounds(academic_year)
+    except ValueError:
+        error = "Academic years look like 2024-2025"
+        return RedirectResponse(url=f"/authority/grading?error={quote(error)}", status_code=303)
+    try:
+        scale = parse_bands(bands)
+    except ValueError as exc:
+        return RedirectResponse(url=f"/authority/grading?year={quote(academic_year)}&error={quote(str(exc))}",
+                                status_code=303)
+    
+    policy = GradingRepository(authority_db).create_policy(academic_year, exam_type, scale.bands, created_by=user_id)
+    invalidate_scales(academic_year)
+    audit(request, "grading_policy.create", "grading_policies", policy.id, after={
+        "academic_year": academic_year,
+        "exam_type": exam_type,
+        "version": policy.version,
+        "bands": scale.bands
+    })
+    
+    if regrade:
+        job = enqueue(authority_db, "grading.regrade", {"academic_year": academic_year}, submitted_by=user_id)
+        audit(request, "job.enqueue", "background_jobs", job.id, after={"kind": job.kind})
+        return RedirectResponse(url="/jobs", status_code=303)
+    
+    msg = f"Saved version {policy.version} of the {exam_type or 'year-wide'} scale for {academic_year}"
+    return RedirectResponse(url=f"/authority/grading?year={quote(academic_year)}&msg={quote(msg)}", status_code=303)
+
+@router.post("/grading/regrade")
+async def regrade_marks(
+    request: Request,
+    academic_year: str = Form(...),
+    authority_db: Session = Depends(get_authority_db)
 ):
     user_id = require_auth(request)
     
-    students = student_db.query(Student).all()
+    job = enqueue(authority_db, "grading.regrade", {"academic_year": academic_year.strip()}, submitted_by=user_id)
+    audit(request, "job.enqueue", "background_jobs", job.id, after={"kind": job.kind})
     
-    return templates.TemplateResponse("authority_students.html", {
+    return RedirectResponse(url="/jobs", status_code=303)
+
+@router.get("/fees", response_class=HTMLResponse)
+async def fee_accounts(
+    request: Request,
+    student: Optional[str] = None,
+    authority_db: Session = Depends(get_authority_db),
+    student_repo: StudentRepository = Depends(get_student_repository)
+):
+    user_id = require_auth(request)
+    
+    fee_repo = FeeRepository(authority_db)
+    academic_year = academic_year_of()
+    outstanding = fee_repo.get_outstanding()
+    names = student_repo.get_students_by_ids(balance.student_id for balance in outstanding)
+    
+    # One student's account: a single-row balance read plus their ledger
+    account = None
+    if student:
+        found = student_repo.get_student_by_code(student.strip())
+        if found:
+            account = {
+                "student": found,
+                "balance": fee_repo.get_balance(found.id),
+                "invoices": fee_repo.get_invoices(found.id),
+                "payments": fee_repo.get_payments(found.id)
+            }
+    
+    return templates.TemplateResponse("authority_fees.html", {
+        "request": request,
+        "academic_year": academic_year,
+        "billed_grades": fee_repo.get_billed_grades(academic_year),
+        "totals": fee_repo.get_totals(),
+        "outstanding": [(balance, names.get(balance.student_id)) for balance in outstanding],
+        "lookup": student,
+        "account": account
+    })
+
+@router.post("/fees/invoices")
+async def generate_fee_invoices(
+    request: Request,
+    academic_year: str = Form(...),
+    grade: Optional[str] = Form(None),
+    due_date: Optional[str] = Form(None),
+    authority_db: Session = Depends(get_authority_db),
+    student_repo: StudentRepository = Depends(get_student_repository)
+):
+    user_id = require_auth(request)
+    
+    started = time.perf_counter()
+    run = {
+        "academic_year": academic_year.strip(),
+        "grades": [grade.strip()] if grade and grade.strip() else None,
+        "due_date": datetime.strptime(due_date, "%Y-%m-%d").date() if due_date else None
+    }
+    billed = FeeRepository(authority_db).generate_invoices(
+        run["academic_year"], issued_by=user_id, grades=run["grades"], student_repo=student_repo,
+        due_date=run["due_date"]
+    )
+    audit(request, "fees.invoice", "fee_invoices", after=dict(run, students_billed=billed))
+    
+    msg = f"Invoiced {billed} students in {time.perf_counter() - started:.1f}s"
+    return RedirectResponse(url=f"/authority/fees?msg={quote(msg)}", status_code=303)
+
+@router.post("/fees/payments")
+async def record_fee_payment(
+    request: Request,
+    student_code: str = Form(...),
+    amount: str = Form(...),
+    method: str = Form(...),
+    reference: Optional[str] = Form(None),
+    authority_db: Session = Depends(get_authority_db),
+    student_repo: StudentRepository = Depends(get_student_repository)
+):
+    user_id = require_auth(request)
+    
+    student = student_repo.get_student_by_code(student_code.strip())
+    if not student:
+        return RedirectResponse(url=f"/authority/fees?msg={quote('No student with ID ' + student_code)}",
+                                status_code=303)
+    try:
+        paid = Decimal(amount).quantize(Decimal("0.01"))
+        valid = paid > 0
+    except InvalidOperation:
+        valid = False
+    if not valid:
+        return RedirectResponse(url=f"/authority/fees?student={quote(student.student_id)}"
+                                    f"&msg={quote('Enter an amount above zero')}", status_code=303)
+    
+    payment = FeeRepository(authority_db).record_payment(student.id, paid, method, received_by=user_id,
+                                                         reference=reference or None)
+    audit(request, "fees.payment", "fee_payments", payment.id, after={
+        "student_id": student.id,
+        "amount": paid,
+        "method": method,
+        "reference": reference or None
+    })
+    
+    return RedirectResponse(url=f"/authority/fees?student={quote(student.student_id)}&msg=Payment recorded",
+                            status_code=303)
+
+@router.get("/students", response_class=HTMLResponse)
+async def view_all_students(request: Request):
+    user_id = require_auth(request)
+    
+    students = streamed_rows(request, ["student", "public"], _student_directory)
+    
+    return stream_template("authority_students.html", {
         "request": request,
         "students": students
     })
 
+@router.post("/students/export")
+async def export_students(
+    request: Request,
+    authority_db: Session = Depends(get_authority_db)
+):
+    user_id = require_auth(request)
+    
+    # Written by a background worker; the jobs page shows progress and the file
+    job = enqueue(authority_db, "students.export", submitted_by=user_id)
+    audit(request, "job.enqueue", "background_jobs", job.id, after={"kind": job.kind})
+    
+    return RedirectResponse(url="/jobs", status_code=303)
+
+@router.get("/report-cards", response_class=HTMLResponse)
+async def report_cards_form(request: Request):
+    user_id = require_auth(request)
+    
+    return templates.TemplateResponse("authority_report_cards.html", {
+        "request": request,
+        "academic_year": academic_year_of()
+    })
+
+@router.post("/report-cards")
+async def generate_report_cards(
+    request: Request,
+    grade: str = Form(...),
+    section: Optional[str] = Form(None),
+    academic_year: str = Form(...),
+    authority_db: Session = Depends(get_authority_db)
+):
+    user_id = require_auth(request)
+    
+    payload = {
+        "grade": grade.strip(),
+        "section": (section or "").strip() or None,
+        "academic_year": academic_year.strip()
+    }
+    job = enqueue(authority_db, "reports.report_cards", payload, submitted_by=user_id)
+    audit(request, "job.enqueue", "background_jobs", job.id, after=dict(payload, kind=job.kind))
+    
+    return RedirectResponse(url="/jobs", status_code=303)
+
 @router.get("/teachers", response_class=HTMLResponse)
-async def view_all_teachers(
+async def view_all_teachers(request: Request):
+    user_id = require_auth(request)
+    
+    teachers = streamed_rows(request, ["teacher"],
+                             lambda db: TeacherRepository(db).iter_teachers(STREAM_BATCH_ROWS))
+    
+    return stream_template("authority_teachers.html", {
+        "request": request,
+        "teachers": teachers
+    })
+
+@router.get("/timetable", response_class=HTMLResponse)
+async def view_timetable(
     request: Request,
+    grade: Optional[str] = None,
+    section: Optional[str] = None,
+    error: Optional[str] = None,
     teacher_db: Session = Depends(get_teacher_db)
 ):
     user_id = require_auth(request)
     
-    teachers = teacher_db.query(Teacher).all()
+    repo = TimetableRepository(teacher_db)
+    classes = repo.get_classes()
+    if grade is None and classes:
+        grade, section = classes[0]
+    cells = {}
+    if grade is not None:
+        for entry, teacher_name in repo.get_class_week(grade, section or None):
+            cells[(entry.day, entry.period)] = (entry.subject_name, teacher_name)
     
-    return templates.TemplateResponse("authority_teachers.html", {
+    return templates.TemplateResponse("timetable.html", {
         "request": request,
-        "teachers": teachers
-    })
\ No newline at end of file
+        "heading": f"Timetable - Grade {grade}{'-' + section if section else ''}" if grade else "Timetable",
+        "classes": classes,
+        "grade": grade,
+        "section": section or None,
+        "day_names": DAY_NAMES,
+        "periods": range(TIMETABLE_PERIODS_PER_DAY),
+        "cells": cells,
+        "error": error
+    })
+
+@router.post("/timetable/generate")
+async def generate_timetable(
+    request: Request,
+    authority_db: Session = Depends(get_authority_db)
+):
+    user_id = require_auth(request)
+    
+    job = enqueue(authority_db, "timetable.generate", submitted_by=user_id)
+    audit(request, "job.enqueue", "background_jobs", job.id, after={"kind": job.kind})
+    
+    return RedirectResponse(url="/jobs", status_code=303)
+
+@router.post("/timetable/absence")
+async def record_teacher_absence(
+    request: Request,
+    teacher_code: str = Form(...),
+    day: int = Form(...),
+    periods: Optional[str] = Form(None),
+    reason: Optional[str] = Form(None),
+    teacher_db: Session = Depends(get_teacher_db)
+):
+    user_id = require_auth(request)
+    
+    teacher = TeacherRepository(teacher_db).get_teacher_by_code(teacher_code.strip())
+    if not teacher:
+        return RedirectResponse(url=f"/authority/timetable?error={quote('No teacher with ID ' + teacher_code)}",
+                                status_code=303)
+    try:
+        # "1, 2, 3" in the form is periods 1-3 of the day; blank is the whole day
+        blocked = sorted({int(value) - 1 for value in (periods or "").replace(",", " ").split()}) or \
+            list(range(TIMETABLE_PERIODS_PER_DAY))
+    except ValueError:
+        blocked = []
+    if not 0 <= day < len(DAY_NAMES) or not blocked or not all(0 <= p < TIMETABLE_PERIODS_PER_DAY for p in blocked):
+        return RedirectResponse(url=f"/authority/timetable?error={quote('Invalid day or periods')}", status_code=303)
+    
+    # Only the lessons that clash with the absence (and what they displace) move
+    result = reschedule(teacher.id, [(day, period) for period in blocked], (reason or "").strip() or None)
+    audit(request, "timetable.absence", "teacher_unavailability", teacher.id, after={
+        "day": day, "periods": blocked, "reason": reason, "changed_entries": result["changed"]
+    })
+    msg = f"Rescheduled around {teacher.first_name} {teacher.last_name}'s absence: {result['changed']} entries changed"
+    if result["unplaced"]:
+        msg += f", {result['unplaced']} lessons could not be placed"
+    
+    return RedirectResponse(url=f"/authority/timetable?msg={quote(msg)}", status_code=303)
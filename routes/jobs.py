@@ -0,0 +1,80 @@
+import json
+import os
+
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import HTMLResponse, JSONResponse, FileResponse
+from sqlalchemy.orm import Session
+
+from database import get_authority_db
+from exports import output_file
+from models import BackgroundJob
+from permissions import Authorization, require_role
+from repositories.job_repository import JobRepository
+from templating import templates
+
+router = APIRouter()
+
+# Anyone signed in can follow the jobs they queued
+require_user = require_role("student", "teacher", "authority")
+
+
+def job_status(job: BackgroundJob) -> dict:
+    return {
+        "id": job.id,
+        "kind": job.kind,
+        "status": job.status,
+        "progress": round(job.progress or 0.0, 4),
+        "message": job.progress_message,
+        "attempts": job.attempts,
+        "max_attempts": job.max_attempts,
+        "result": json.loads(job.result) if job.result else None,
+        "error": job.error.strip().splitlines()[-1] if job.error else None,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+def get_visible_job(job_id: int, authorization: Authorization, authority_db: Session) -> BackgroundJob:
+    job = JobRepository(authority_db).get_job(job_id)
+    if not job or (job.submitted_by != authorization.user_id and authorization.role != "authority"):
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@router.get("/", response_class=HTMLResponse)
+async def list_jobs(
+    request: Request,
+    authorization: Authorization = Depends(require_user),
+    authority_db: Session = Depends(get_authority_db)
+):
+    jobs = JobRepository(authority_db).list_jobs(authorization.user_id)
+
+    return templates.TemplateResponse("jobs.html", {
+        "request": request,
+        "jobs": [job_status(job) for job in jobs]
+    })
+
+
+@router.get("/{job_id}")
+async def get_job(
+    job_id: int,
+    authorization: Authorization = Depends(require_user),
+    authority_db: Session = Depends(get_authority_db)
+):
+    return JSONResponse(job_status(get_visible_job(job_id, authorization, authority_db)))
+
+
+@router.get("/{job_id}/download")
+async def download_job_output(
+    job_id: int,
+    authorization: Authorization = Depends(require_user),
+    authority_db: Session = Depends(get_authority_db)
+):
+    job = get_visible_job(job_id, authorization, authority_db)
+    result = json.loads(job.result) if job.status == "succeeded" and job.result else None
+    if not isinstance(result, dict) or "file" not in result:
+        raise HTTPException(status_code=404, detail="This job has no file to download")
+    path = output_file(job.id, os.path.basename(result["file"]))
+    if not os.path.exists(path):
+        raise HTTPException(status_code=410, detail="The file has been removed")
+    return FileResponse(path, filename=result["file"])
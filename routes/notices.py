@@ -0,0 +1,97 @@
+from datetime import date
+from typing import Iterable, Optional
+
+from fastapi import APIRouter, Depends, Request
+from fastapi.responses import HTMLResponse, RedirectResponse
+from sqlalchemy.orm import Session
+
+from config import NOTICE_SEARCH_PAGE_SIZE
+from database import get_authority_db
+from permissions import Authorization, require_role
+from repositories.notice_repository import NOTICE_AUDIENCES, NoticeRepository
+from templating import templates
+
+router = APIRouter()
+
+# Notices are addressed to students and teachers
+require_reader = require_role("student", "teacher")
+
+
+def _parse_date(value: Optional[str]) -> Optional[date]:
+    try:
+        return date.fromisoformat(value) if value else None
+    except ValueError:
+        return None
+
+
+def search_page(request: Request, authority_db: Session, audiences: Iterable[str], active_only: bool,
+                q: str, priority: Optional[str], start: Optional[str], end: Optional[str], page: int,
+                search_url: str, audience: Optional[str] = None):
+    """The notice search page; shared with the authority's search over every notice"""
+    page = max(page, 1)
+    start_date, end_date = _parse_date(start), _parse_date(end)
+    # One extra row tells whether there is a next page
+    hits = NoticeRepository(authority_db).search(
+        q, audiences, priority or None, start_date, end_date, active_only=active_only,
+        offset=(page - 1) * NOTICE_SEARCH_PAGE_SIZE, limit=NOTICE_SEARCH_PAGE_SIZE + 1
+    )
+    
+    return templates.TemplateResponse("notice_search.html", {
+        "request": request,
+        "hits": hits[:NOTICE_SEARCH_PAGE_SIZE],
+        "has_more": len(hits) > NOTICE_SEARCH_PAGE_SIZE,
+        "page": page,
+        "search_url": search_url,
+        "q": q,
+        "audience": audience or "",
+        "priority": priority or "",
+        "start": start_date.isoformat() if start_date else "",
+        "end": end_date.isoformat() if end_date else ""
+    })
+
+
+@router.get("/", response_class=HTMLResponse)
+async def list_notices(
+    request: Request,
+    authorization: Authorization = Depends(require_reader),
+    authority_db: Session = Depends(get_authority_db)
+):
+    notices = NoticeRepository(authority_db).get_notices(authorization.user_id, authorization.role)
+    
+    return templates.TemplateResponse("notices.html", {
+        "request": request,
+        "notices": notices
+    })
+
+@router.get("/search", response_class=HTMLResponse)
+async def search_notices(
+    request: Request,
+    q: str = "",
+    priority: Optional[str] = None,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    page: int = 1,
+    authorization: Authorization = Depends(require_reader),
+    authority_db: Session = Depends(get_authority_db)
+):
+    return search_page(request, authority_db, NOTICE_AUDIENCES[authorization.role], True,
+                       q, priority, start, end, page, "/notices/search")
+
+@router.post("/{notice_id}/read")
+async def mark_notice_read(
+    notice_id: int,
+    authorization: Authorization = Depends(require_reader),
+    authority_db: Session = Depends(get_authority_db)
+):
+    NoticeRepository(authority_db).mark_read(authorization.user_id, authorization.role, notice_id)
+    
+    return RedirectResponse(url="/notices", status_code=303)
+
+@router.post("/read-all")
+async def mark_all_notices_read(
+    authorization: Authorization = Depends(require_reader),
+    authority_db: Session = Depends(get_authority_db)
+):
+    NoticeRepository(authority_db).mark_all_read(authorization.user_id, authorization.role)
+    
+    return RedirectResponse(url="/notices?msg=All notices marked as read", status_code=303)
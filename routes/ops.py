@@ -0,0 +1,26 @@
+"""
+Operator endpoints, served outside any school (TenantMiddleware skips the
+/ops/ prefix) and only to requests carrying OPS_TOKEN.
+"""
+
+import secrets
+
+from fastapi import APIRouter, Depends, HTTPException, Request
+
+from config import OPS_TOKEN
+from tenants import registry
+
+
+def require_ops_token(request: Request):
+    supplied = request.headers.get("authorization", "").removeprefix("Bearer ")
+    if not OPS_TOKEN or not secrets.compare_digest(supplied.encode(), OPS_TOKEN.encode()):
+        raise HTTPException(status_code=404, detail="Not Found")
+
+
+router = APIRouter(dependencies=[Depends(require_ops_token)])
+
+
+@router.get("/tenants")
+async def tenant_pools():
+    """Connection budget use and per-school pool state of this process"""
+    return registry.snapshot()
@@ -1,68 +1,101 @@
 from fastapi import APIRouter, Depends, HTTPException, Request, Form
 from fastapi.responses import HTMLResponse, RedirectResponse
-from fastapi.templating import Jinja2Templates
 from sqlalchemy.orm import Session
 from typing import List
 
-from database import get_student_db, get_authority_db, get_public_db
-from models import SchoolNotices
+from academic_calendar import current_academic_year_bounds
+from archive import archived_years, get_reader
+from audit import audit, snapshot
+from database import get_teacher_db, get_authority_db, get_public_db
+from repositories.fee_repository import FeeRepository
+from repositories.notice_repository import NoticeRepository
 from repositories.student_repository import StudentRepository
+from repositories.sharded_student_repository import get_student_repository
+from repositories.attendance_repository import summarize_records
 from repositories.user_repository import UserRepository
+from rosters import invalidate_rosters
+from permissions import require_role
 from routes.auth import require_auth
+from session_profile import current_profile, remember_profile
+from templating import templates
 
-templates = Jinja2Templates(directory="templates")
-router = APIRouter()
+router = APIRouter(dependencies=[Depends(require_role("student"))])
 
 @router.get("/dashboard", response_class=HTMLResponse)
 async def student_dashboard(
     request: Request,
-    student_db: Session = Depends(get_student_db),
-    authority_db: Session = Depends(get_authority_db),
-    public_db: Session = Depends(get_public_db)
+    student_repo: StudentRepository = Depends(get_student_repository),
+    teacher_db: Session = Depends(get_teacher_db),
+    authority_db: Session = Depends(get_authority_db)
 ):
     user_id = require_auth(request)
     
-    # Get student data
-    student_repo = StudentRepository(student_db)
-    student = student_repo.get_student_by_user_id(user_id)
+    # Who the caller is comes from the session snapshot
+    student = current_profile(request, "student", lambda: student_repo.get_student_by_user_id(user_id))
     
     if not student:
         raise HTTPException(status_code=404, detail="Student profile not found")
     
-    # Get student performance data
-    marks = student_repo.get_student_marks(student.id)
-    attendance = student_repo.get_student_attendance(student.id)
+    # Get student performance data (attendance for the current academic
+    # year only, so older partitions are pruned)
+    year_start, year_end = current_academic_year_bounds()
+    marks = student_repo.get_student_marks_with_teachers(student.id, teacher_db)
+    attendance = student_repo.get_student_attendance(student.id, year_start, year_end)
+    attendance_summary = summarize_records(attendance)
     assignments = student_repo.get_student_assignments(student.id)
+    fee_balance = FeeRepository(authority_db).get_balance(student.id)
     
-    # Get notices from authority database
-    notices = authority_db.query(SchoolNotices).filter(
-        SchoolNotices.is_active == True,
-        SchoolNotices.target_audience.in_(["all", "students"])
-    ).order_by(SchoolNotices.created_at.desc()).limit(10).all()
-    
-    # Get user info
-    user_repo = UserRepository(public_db)
-    user = user_repo.get_user_by_id(user_id)
+    # Latest notices, with whether the student has read them
+    notices = NoticeRepository(authority_db).get_notices(user_id, "student", limit=10)
     
     return templates.TemplateResponse("student_dashboard.html", {
         "request": request,
         "student": student,
-        "user": user,
         "marks": marks,
         "attendance": attendance,
+        "attendance_summary": attendance_summary,
         "assignments": assignments,
-        "notices": notices
+        "notices": notices,
+        "fee_balance": fee_balance,
+        "archived_years": archived_years()
+    })
+
+@router.get("/history/{academic_year}", response_class=HTMLResponse)
+async def student_history(
+    request: Request,
+    academic_year: str,
+    student_repo: StudentRepository = Depends(get_student_repository)
+):
+    user_id = require_auth(request)
+    
+    student = current_profile(request, "student", lambda: student_repo.get_student_by_user_id(user_id))
+    if not student:
+        raise HTTPException(status_code=404, detail="Student profile not found")
+    
+    # Closed years live in the archive, not the live tables
+    reader = get_reader(academic_year) if academic_year in archived_years() else None
+    if not reader:
+        raise HTTPException(status_code=404, detail="Academic year not archived")
+    history = reader.student_history(student.id)
+    
+    return templates.TemplateResponse("student_history.html", {
+        "request": request,
+        "student": student,
+        "academic_year": academic_year,
+        "marks": history["marks"],
+        "attendance": history["attendance"],
+        "attendance_summary": summarize_records(history["attendance"]),
+        "assignments": history["assignments"]
     })
 
 @router.get("/profile", response_class=HTMLResponse)
 async def student_profile(
     request: Request,
-    student_db: Session = Depends(get_student_db),
+    student_repo: StudentRepository = Depends(get_student_repository),
     public_db: Session = Depends(get_public_db)
 ):
     user_id = require_auth(request)
     
-    student_repo = StudentRepository(student_db)
     student = student_repo.get_student_by_user_id(user_id)
     
     user_repo = UserRepository(public_db)
@@ -83,21 +116,26 @@ async def update_student_profile(
     address: str = Form(...),
     guardian_name: str = Form(...),
     guardian_phone: str = Form(...),
-    student_db: Session = Depends(get_student_db)
+    student_repo: StudentRepository = Depends(get_student_repository)
 ):
     user_id = require_auth(request)
     
-    student_repo = StudentRepository(student_db)
     student = student_repo.get_student_by_user_id(user_id)
     
     if student:
-        student.grade = grade
-        student.section = section
-        student.phone = phone
-        student.address = address
-        student.guardian_name = guardian_name
-        student.guardian_phone = guardian_phone
-        
-        student_db.commit()
+        changes = {
+            "grade": grade,
+            "section": section,
+            "phone": phone,
+            "address": address,
+            "guardian_name": guardian_name,
+            "guardian_phone": guardian_phone
+        }
+        before, student_id = snapshot(student, changes), student.id
+        student_repo.update_student(student, changes)
+        audit(request, "student.update_profile", "students", student_id, before=before, after=changes)
+        remember_profile(request, "student", student)
+        # Grade or section may have moved the student between rosters
+        invalidate_rosters()
     
     return RedirectResponse(url="/student/profile?msg=Profile updated successfully", status_code=303)
\ No newline at end of file
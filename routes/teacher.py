@@ -1,88 +1,151 @@
 from fastapi import APIRouter, Depends, HTTPException, Request, Form
-from fastapi.responses import HTMLResponse, RedirectResponse
-from fastapi.templating import Jinja2Templates
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
 from sqlalchemy.orm import Session
 from datetime import datetime
 from typing import List
 
-from database import get_student_db, get_teacher_db, get_public_db
+from audit import audit
+from academic_calendar import academic_year_of
+from config import STUDENT_SEARCH_PAGE_SIZE, TEACHER_CLASS_SCOPE, TIMETABLE_PERIODS_PER_DAY
+from database import get_authority_db, get_teacher_db, get_public_db
+from grading import DEFAULT_SCALE, grade_for, year_scales
 from models import Teacher, Student, StudentMarks, StudentAttendance, StudentAssignments
 from repositories.student_repository import StudentRepository
+from repositories.sharded_student_repository import get_student_repository
+from repositories.teacher_repository import TeacherRepository
+from repositories.timetable_repository import TimetableRepository
 from repositories.user_repository import UserRepository
+from rosters import get_roster
+from permissions import require_role, require_class_scope
 from routes.auth import require_auth
+from session_profile import current_profile
+from templating import templates
+from timetable import DAY_NAMES
 
-templates = Jinja2Templates(directory="templates")
-router = APIRouter()
+router = APIRouter(dependencies=[Depends(require_role("teacher"))])
 
 @router.get("/dashboard", response_class=HTMLResponse)
 async def teacher_dashboard(
     request: Request,
     teacher_db: Session = Depends(get_teacher_db),
-    student_db: Session = Depends(get_student_db),
-    public_db: Session = Depends(get_public_db)
+    student_repo: StudentRepository = Depends(get_student_repository)
 ):
     user_id = require_auth(request)
     
-    # Get teacher data
-    teacher = teacher_db.query(Teacher).filter(Teacher.user_id == user_id).first()
+    # Who the caller is comes from the session snapshot
+    teacher_repo = TeacherRepository(teacher_db)
+    teacher = current_profile(request, "teacher", lambda: teacher_repo.get_teacher_by_user_id(user_id))
     if not teacher:
         raise HTTPException(status_code=404, detail="Teacher profile not found")
     
-    # Get all students
-    student_repo = StudentRepository(student_db)
-    students = student_repo.get_all_students()
+    # Students in this teacher's classes
+    roster = get_roster(teacher_db, student_repo, user_id)
     
     # Get recent uploads by this teacher
-    recent_marks = student_db.query(StudentMarks).filter(
-        StudentMarks.uploaded_by == user_id
-    ).order_by(StudentMarks.created_at.desc()).limit(10).all()
-    
-    recent_attendance = student_db.query(StudentAttendance).filter(
-        StudentAttendance.uploaded_by == user_id
-    ).order_by(StudentAttendance.created_at.desc()).limit(10).all()
-    
-    # Get user info
-    user_repo = UserRepository(public_db)
-    user = user_repo.get_user_by_id(user_id)
+    recent_marks = student_repo.get_recent_marks_by_uploader(user_id)
+    recent_attendance = student_repo.get_recent_attendance_by_uploader(user_id)
     
     return templates.TemplateResponse("teacher_dashboard.html", {
         "request": request,
         "teacher": teacher,
-        "user": user,
-        "students": students,
+        "students": roster.students,
+        "roster": roster,
         "recent_marks": recent_marks,
         "recent_attendance": recent_attendance
     })
 
+@router.get("/timetable", response_class=HTMLResponse)
+async def teacher_timetable(
+    request: Request,
+    teacher_db: Session = Depends(get_teacher_db)
+):
+    user_id = require_auth(request)
+    
+    teacher_repo = TeacherRepository(teacher_db)
+    teacher = current_profile(request, "teacher", lambda: teacher_repo.get_teacher_by_user_id(user_id))
+    if not teacher:
+        raise HTTPException(status_code=404, detail="Teacher profile not found")
+    
+    entries = TimetableRepository(teacher_db).get_teacher_week(teacher.id)
+    
+    return templates.TemplateResponse("timetable.html", {
+        "request": request,
+        "heading": "My Timetable",
+        "day_names": DAY_NAMES,
+        "periods": range(TIMETABLE_PERIODS_PER_DAY),
+        "cells": {(entry.day, entry.period): (entry.subject_name,
+                                              f"{entry.grade}{'-' + entry.section if entry.section else ''}")
+                  for entry in entries}
+    })
+
 @router.get("/students", response_class=HTMLResponse)
 async def view_students(
     request: Request,
     teacher_db: Session = Depends(get_teacher_db),
-    student_db: Session = Depends(get_student_db)
+    student_repo: StudentRepository = Depends(get_student_repository)
 ):
     user_id = require_auth(request)
     
-    student_repo = StudentRepository(student_db)
-    students = student_repo.get_all_students()
+    roster = get_roster(teacher_db, student_repo, user_id)
     
     return templates.TemplateResponse("teacher_students.html", {
         "request": request,
-        "students": students
+        "roster": roster
+    })
+
+@router.get("/students/search")
+async def search_students(
+    request: Request,
+    q: str = "",
+    page: int = 1,
+    teacher_db: Session = Depends(get_teacher_db),
+    student_repo: StudentRepository = Depends(get_student_repository)
+):
+    user_id = require_auth(request)
+    
+    # Typeahead for students outside the roster, one page at a time
+    q = q.strip()
+    page = max(page, 1)
+    if len(q) < 2:
+        return JSONResponse({"results": [], "page": page, "has_more": False})
+    
+    roster = get_roster(teacher_db, student_repo, user_id)
+    students = student_repo.search_students(q, (page - 1) * STUDENT_SEARCH_PAGE_SIZE, STUDENT_SEARCH_PAGE_SIZE + 1)
+    
+    return JSONResponse({
+        "results": [{
+            "id": student.id,
+            "student_id": student.student_id,
+            "name": f"{student.first_name} {student.last_name}",
+            "grade": student.grade,
+            "section": student.section,
+            "in_roster": student.id in roster
+        } for student in students[:STUDENT_SEARCH_PAGE_SIZE]],
+        "page": page,
+        "has_more": len(students) > STUDENT_SEARCH_PAGE_SIZE
     })
 
 @router.get("/add-marks", response_class=HTMLResponse)
 async def add_marks_form(
     request: Request,
-    student_db: Session = Depends(get_student_db)
+    teacher_db: Session = Depends(get_teacher_db),
+    authority_db: Session = Depends(get_authority_db),
+    student_repo: StudentRepository = Depends(get_student_repository)
 ):
     user_id = require_auth(request)
     
-    student_repo = StudentRepository(student_db)
-    students = student_repo.get_all_students()
+    roster = get_roster(teacher_db, student_repo, user_id)
+    # This year's scales, so the form can preview the grade the server will give
+    scales = year_scales(authority_db, academic_year_of())
+    grade_scales = {exam_type or "": scale.bands for exam_type, scale in scales.items()}
+    grade_scales.setdefault("", DEFAULT_SCALE.bands)
     
     return templates.TemplateResponse("teacher_add_marks.html", {
         "request": request,
-        "students": students
+        "roster": roster,
+        "grade_scales": grade_scales,
+        # Off-roster students cannot be picked when writes are class scoped
+        "student_search": not TEACHER_CLASS_SCOPE
     })
 
 @router.post("/add-marks")
@@ -93,40 +156,46 @@ async def add_marks(
     exam_type: str = Form(...),
     marks_obtained: float = Form(...),
     total_marks: float = Form(...),
-    grade: str = Form(...),
     exam_date: str = Form(...),
-    student_db: Session = Depends(get_student_db)
+    teacher_db: Session = Depends(get_teacher_db),
+    authority_db: Session = Depends(get_authority_db),
+    student_repo: StudentRepository = Depends(get_student_repository)
 ):
     user_id = require_auth(request)
+    require_class_scope(request, teacher_db, student_repo, student_id)
     
-    student_repo = StudentRepository(student_db)
+    exam_day = datetime.strptime(exam_date, "%Y-%m-%d")
+    # The grade comes from the grading policy, never from the form
     marks_data = {
         "student_id": student_id,
         "subject": subject,
         "exam_type": exam_type,
         "marks_obtained": marks_obtained,
         "total_marks": total_marks,
-        "grade": grade,
-        "exam_date": datetime.strptime(exam_date, "%Y-%m-%d")
+        "grade": grade_for(authority_db, exam_type, exam_day, marks_obtained, total_marks),
+        "exam_date": exam_day
     }
     
-    student_repo.create_marks(marks_data, user_id)
+    marks = student_repo.create_marks(marks_data, user_id)
+    audit(request, "marks.create", "student_marks", marks.id, after=marks_data)
     
     return RedirectResponse(url="/teacher/dashboard?msg=Marks added successfully", status_code=303)
 
 @router.get("/add-attendance", response_class=HTMLResponse)
 async def add_attendance_form(
     request: Request,
-    student_db: Session = Depends(get_student_db)
+    teacher_db: Session = Depends(get_teacher_db),
+    student_repo: StudentRepository = Depends(get_student_repository)
 ):
     user_id = require_auth(request)
     
-    student_repo = StudentRepository(student_db)
-    students = student_repo.get_all_students()
+    roster = get_roster(teacher_db, student_repo, user_id)
     
     return templates.TemplateResponse("teacher_add_attendance.html", {
         "request": request,
-        "students": students
+        "roster": roster,
+        # Off-roster students cannot be picked when writes are class scoped
+        "student_search": not TEACHER_CLASS_SCOPE
     })
 
 @router.post("/add-attendance")
@@ -136,11 +205,12 @@ async def add_attendance(
     date: str = Form(...),
     status: str = Form(...),
     subject: str = Form(...),
-    student_db: Session = Depends(get_student_db)
+    teacher_db: Session = Depends(get_teacher_db),
+    student_repo: StudentRepository = Depends(get_student_repository)
 ):
     user_id = require_auth(request)
+    require_class_scope(request, teacher_db, student_repo, student_id)
     
-    student_repo = StudentRepository(student_db)
     attendance_data = {
         "student_id": student_id,
         "date": datetime.strptime(date, "%Y-%m-%d"),
@@ -148,23 +218,24 @@ async def add_attendance(
         "subject": subject
     }
     
-    student_repo.create_attendance(attendance_data, user_id)
+    record = student_repo.create_attendance(attendance_data, user_id)
+    audit(request, "attendance.record", "student_attendance", getattr(record, "id", None), after=attendance_data)
     
     return RedirectResponse(url="/teacher/dashboard?msg=Attendance added successfully", status_code=303)
 
 @router.get("/add-assignment", response_class=HTMLResponse)
 async def add_assignment_form(
     request: Request,
-    student_db: Session = Depends(get_student_db)
+    teacher_db: Session = Depends(get_teacher_db),
+    student_repo: StudentRepository = Depends(get_student_repository)
 ):
     user_id = require_auth(request)
     
-    student_repo = StudentRepository(student_db)
-    students = student_repo.get_all_students()
+    roster = get_roster(teacher_db, student_repo, user_id)
     
     return templates.TemplateResponse("teacher_add_assignment.html", {
         "request": request,
-        "students": students
+        "roster": roster
     })
 
 @router.post("/add-assignment")
@@ -176,11 +247,10 @@ async def add_assignment(
     assignment_date: str = Form(...),
     due_date: str = Form(...),
     status: str = Form(...),
-    student_db: Session = Depends(get_student_db)
+    student_repo: StudentRepository = Depends(get_student_repository)
 ):
     user_id = require_auth(request)
     
-    student_repo = StudentRepository(student_db)
     assignment_data = {
         "student_id": student_id,
         "assignment_title": assignment_title,
@@ -190,6 +260,7 @@ async def add_assignment(
         "status": status
     }
     
-    student_repo.create_assignment(assignment_data, user_id)
+    assignment = student_repo.create_assignment(assignment_data, user_id)
+    audit(request, "assignment.create", "student_assignments", assignment.id, after=assignment_data)
     
     return RedirectResponse(url="/teacher/dashboard?msg=Assignment added successfully", status_code=303)
\ No newline at end of file
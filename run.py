@@ -63,14 +63,14 @@ def install_requirements():
         return False
 
 def start_server():
-    """Start the FastAPI server"""
+    """Start the FastAPI server (the multi-worker one with --production)"""
     print("Starting School Management Portal...")
     print("Server will be available at: http://localhost:8000")
     print("Press Ctrl+C to stop the server")
     
+    script = "serve.py" if "--production" in sys.argv else "main.py"
     try:
-        os.chdir("app")
-        subprocess.run([sys.executable, "main.py"])
+        subprocess.run([sys.executable, script], cwd=os.path.dirname(os.path.abspath(__file__)))
     except KeyboardInterrupt:
         print("\nServer stopped by user")
     except Exception as e:
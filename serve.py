@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Production entry point: gunicorn with WEB_WORKERS uvicorn workers (the
+core count by default), settings in gunicorn.conf.py.
+
+    python serve.py
+    python serve.py --workers 8 --bind 0.0.0.0:8080
+
+Windows has no gunicorn; there the app runs under uvicorn's own process
+manager instead, without preloading or memory recycling.
+"""
+
+import argparse
+import os
+import signal
+import sys
+
+from config import WEB_BIND, WEB_WORKERS, WORKER_MAX_MEMORY_MB
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+try:
+    from uvicorn.workers import UvicornWorker
+except ImportError:  # gunicorn is not installed (Windows)
+    UvicornWorker = None
+
+
+def resident_memory_mb() -> float:
+    """Current resident set size of this process"""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError):
+        import resource
+
+        # Peak rather than current, in kilobytes on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+if UvicornWorker is not None:
+    class PortalWorker(UvicornWorker):
+        """
+        Uvicorn worker on uvloop and httptools that restarts itself once it
+        holds more than WORKER_MAX_MEMORY_MB. The check rides on the
+        heartbeat uvicorn already sends the master; the restart is a normal
+        graceful shutdown, so in-flight requests finish first.
+        """
+
+        CONFIG_KWARGS = {"loop": "uvloop", "http": "httptools"}
+
+        recycling = False
+
+        async def callback_notify(self):
+            self.notify()
+            if not self.recycling and WORKER_MAX_MEMORY_MB and resident_memory_mb() > WORKER_MAX_MEMORY_MB:
+                self.recycling = True
+                self.log.info("Worker %s uses over %s MB, restarting", self.pid, WORKER_MAX_MEMORY_MB)
+                os.kill(self.pid, signal.SIGTERM)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the School Management Portal in production")
+    parser.add_argument("--workers", type=int, default=WEB_WORKERS)
+    parser.add_argument("--bind", default=WEB_BIND)
+    args = parser.parse_args()
+
+    os.chdir(BASE_DIR)
+    if UvicornWorker is None:
+        import uvicorn
+
+        host, _, port = args.bind.rpartition(":")
+        uvicorn.run("main:app", host=host or "0.0.0.0", port=int(port), workers=args.workers)
+        return
+
+    os.execvp(sys.executable, [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py",
+                               "--workers", str(args.workers), "--bind", args.bind, "main:app"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""
+Profile snapshot kept in the signed session cookie.
+
+At login the caller's role profile (Student, Teacher or Authority) is
+reduced to its primary key and the fields pages display about the caller,
+and stored under session["profile"]. Handlers read it back with
+current_profile() instead of looking the profile up on every request, and
+only query for the data a page actually shows. Sessions created before the
+snapshot existed fall back to a lookup once and are upgraded in place.
+"""
+
+from types import SimpleNamespace
+from typing import Callable, Optional
+
+from fastapi import Request
+
+# Display fields per role, besides the primary key
+PROFILE_FIELDS = {
+    "student": ("student_id", "first_name", "last_name", "grade", "section"),
+    "teacher": ("teacher_id", "first_name", "last_name", "subjects"),
+    "authority": ("first_name", "last_name", "position"),
+}
+
+
+def profile_snapshot(role: str, profile) -> dict:
+    snapshot = {"role": role, "id": profile.id}
+    for field in PROFILE_FIELDS.get(role, ()):
+        snapshot[field] = getattr(profile, field)
+    return snapshot
+
+
+def remember_profile(request: Request, role: str, profile):
+    """Store (or refresh, after a profile update) the caller's snapshot"""
+    if profile is None:
+        request.session.pop("profile", None)
+    else:
+        request.session["profile"] = profile_snapshot(role, profile)
+
+
+def current_profile(request: Request, role: str, loader: Optional[Callable] = None) -> Optional[SimpleNamespace]:
+    """
+    The caller's profile snapshot for `role`, with the same attribute names
+    as the model. `loader` returns the ORM profile when the session has no
+    snapshot yet; None means there is no such profile.
+    """
+    snapshot = request.session.get("profile")
+    if not snapshot or snapshot.get("role") != role:
+        profile = loader() if loader else None
+        if profile is None:
+            return None
+        remember_profile(request, role, profile)
+        snapshot = request.session["profile"]
+    return SimpleNamespace(**{key: value for key, value in snapshot.items() if key != "role"})
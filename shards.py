@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+Hash sharding of the student database.
+
+With STUDENT_SHARD_URLS set, students and everything keyed by them (marks,
+attendance, attendance months, assignments, absence windows and alerts) live
+on N PostgreSQL shards. A student's bucket is Student.id %
+STUDENT_SHARD_BUCKETS and the bucket map (STUDENT_SHARD_MAP) says which
+shard holds each bucket, so adding a shard moves whole buckets instead of
+rehashing every student. Ids come from the students sequence of the
+configured "student" database (the directory), so they stay unique across
+shards; the other tables' sequences get a disjoint range per shard so rows
+keep their ids when a bucket moves.
+
+ShardedStudentRepository (repositories/sharded_student_repository.py) does
+the routing. Rebalancing is offline: stop the app, add the URL to
+STUDENT_SHARD_URLS, then
+
+    python shards.py init          # create tables on new shards, write the map
+    python shards.py rebalance     # move buckets onto the new shards
+    python shards.py status
+"""
+
+import argparse
+import json
+import os
+import threading
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from sqlalchemy import func, insert, select, delete, text
+from sqlalchemy.orm import Session
+
+from config import STUDENT_SHARD_URLS, STUDENT_SHARD_BUCKETS, STUDENT_SHARD_MAP
+from database import Base, _create_engine, current_databases, default_databases
+from models import (
+    Student, StudentMarks, StudentAttendance, AttendanceMonth, AttendanceException, StudentAssignments,
+    AttendanceWindow, AbsenceAlert,
+)
+from partitions import PARTITION_COLUMNS, ensure_partitions, ensure_range
+
+# Each shard's own sequences start at shard index * SHARD_ID_RANGE and stop
+# before the next shard's range. Ids are int4 (SERIAL), so there can be at
+# most MAX_SHARDS shards of up to SHARD_ID_RANGE - 1 (about 134 million) rows
+# per table each.
+SHARD_ID_RANGE = 1 << 27
+MAX_SHARDS = (1 << 31) // SHARD_ID_RANGE
+MOVE_BATCH_SIZE = 5000
+
+# Tables moved with a bucket, parents first, and the column holding the student
+SHARDED_TABLES = [
+    (Student, "id"),
+    (AttendanceMonth, "student_id"),
+    (AttendanceException, None),  # follows its attendance month
+    (StudentMarks, "student_id"),
+    (StudentAttendance, "student_id"),
+    (StudentAssignments, "student_id"),
+    (AttendanceWindow, "student_id"),
+    (AbsenceAlert, "student_id"),
+]
+
+
+def bucket_of(student_id: int) -> int:
+    return student_id % STUDENT_SHARD_BUCKETS
+
+
+@dataclass
+class ShardMap:
+    buckets: List[int]  # bucket -> shard index
+
+    def shard_of(self, student_id: int) -> int:
+        return self.buckets[bucket_of(student_id)]
+
+    def buckets_of(self, shard: int) -> List[int]:
+        return [bucket for bucket, owner in enumerate(self.buckets) if owner == shard]
+
+    @classmethod
+    def spread(cls, shard_count: int) -> "ShardMap":
+        return cls([bucket % shard_count for bucket in range(STUDENT_SHARD_BUCKETS)])
+
+    def rebalanced(self, shard_count: int) -> "ShardMap":
+        """
+        Even spread over `shard_count` shards that keeps as many buckets in
+        place as possible: only the surplus of overfull shards moves.
+        """
+        target, extra = divmod(STUDENT_SHARD_BUCKETS, shard_count)
+        quota = [target + (1 if shard < extra else 0) for shard in range(shard_count)]
+        buckets = list(self.buckets)
+        counts = [0] * shard_count
+        surplus = []
+        for bucket, owner in enumerate(buckets):
+            if owner < shard_count and counts[owner] < quota[owner]:
+                counts[owner] += 1
+            else:
+                surplus.append(bucket)
+        for shard in range(shard_count):
+            while counts[shard] < quota[shard]:
+                buckets[surplus.pop()] = shard
+                counts[shard] += 1
+        return ShardMap(buckets)
+
+    @classmethod
+    def load(cls, path: str = STUDENT_SHARD_MAP) -> Optional["ShardMap"]:
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            data = json.load(f)
+        if len(data["buckets"]) != STUDENT_SHARD_BUCKETS:
+            raise ValueError(f"{path} has {len(data['buckets'])} buckets, expected {STUDENT_SHARD_BUCKETS}")
+        return cls(data["buckets"])
+
+    def save(self, path: str = STUDENT_SHARD_MAP):
+        with open(path + ".tmp", "w") as f:
+            json.dump({"buckets": self.buckets}, f)
+        os.replace(path + ".tmp", path)
+
+
+_engines = None
+_shard_map = None
+_lock = threading.Lock()
+
+
+def sharding_enabled() -> bool:
+    """Sharding covers the deployment's own split databases, not hosted schools"""
+    databases = current_databases()
+    return bool(STUDENT_SHARD_URLS) and databases is default_databases and not databases.consolidated
+
+
+def shard_engines() -> list:
+    global _engines
+    if _engines is None:
+        with _lock:
+            if _engines is None:
+                _engines = [_create_engine(url, False) for url in STUDENT_SHARD_URLS]
+    return _engines
+
+
+def dispose_engines(close: bool = True):
+    for engine in _engines or []:
+        engine.dispose(close=close)
+
+
+def shard_map() -> ShardMap:
+    global _shard_map
+    if _shard_map is None:
+        loaded = ShardMap.load()
+        if loaded is None:
+            raise RuntimeError(f"No student shard map at {STUDENT_SHARD_MAP}, run `python shards.py init`")
+        if max(loaded.buckets) >= len(STUDENT_SHARD_URLS):
+            raise RuntimeError("The shard map uses more shards than STUDENT_SHARD_URLS lists")
+        _shard_map = loaded
+    return _shard_map
+
+
+def allocate_student_id(directory_db: Session) -> int:
+    """Next Student.id from the directory's sequence"""
+    return directory_db.execute(text("SELECT nextval(pg_get_serial_sequence('students', 'id'))")).scalar()
+
+
+def init_shard(engine, index: int):
+    """Create the student tables, partitions and change tracking on a shard and move its sequences into its id range"""
+    from snapshots import install_change_tracking
+
+    if index >= MAX_SHARDS:
+        raise ValueError(f"At most {MAX_SHARDS} shards fit the int4 id ranges, shard {index} does not")
+    tables = [model.__table__ for model, _ in SHARDED_TABLES]
+    Base.metadata.create_all(bind=engine, tables=tables)
+    ensure_partitions(engine)
+    install_change_tracking(engine)
+    with engine.begin() as conn:
+        for model, _ in SHARDED_TABLES[1:]:
+            # Attendance windows are keyed by student and subject, no id sequence
+            if "id" not in model.__table__.c:
+                continue
+            table = model.__tablename__
+            start = max(index * SHARD_ID_RANGE, 1)
+            sequence = conn.execute(text(f"SELECT pg_get_serial_sequence('{table}', 'id')")).scalar()
+            # Running out of the range fails the insert instead of reusing the next shard's ids
+            conn.execute(text(f"ALTER SEQUENCE {sequence} MAXVALUE {(index + 1) * SHARD_ID_RANGE - 1}"))
+            # Only on a fresh shard, or one still below its range
+            conn.execute(text(
+                f"SELECT setval('{sequence}', :start, false) "
+                f"WHERE (SELECT coalesce(max(id), 0) FROM {table}) < :start"
+            ), {"start": start})
+
+
+def _bucket_filter(model, column: Optional[str], buckets: List[int]):
+    if column is None:
+        months = select(AttendanceMonth.id).where((AttendanceMonth.student_id % STUDENT_SHARD_BUCKETS).in_(buckets))
+        return AttendanceException.month_id.in_(months)
+    return (getattr(model, column) % STUDENT_SHARD_BUCKETS).in_(buckets)
+
+
+def move_buckets(source, target, buckets: List[int]) -> Dict[str, int]:
+    """
+    Copy every row of `buckets` from the source shard to the target shard in
+    batches, then delete them from the source. Run with the app stopped.
+    """
+    moved = {}
+    with source.connect() as reader:
+        # Partitions first: creating them inside the copy transaction would
+        # wait on that transaction's own locks on the parent table
+        for table_name, date_column in PARTITION_COLUMNS.items():
+            table = Base.metadata.tables[f"student.{table_name}"]
+            low, high = reader.execute(select(func.min(table.c[date_column]), func.max(table.c[date_column])).where(
+                (table.c.student_id % STUDENT_SHARD_BUCKETS).in_(buckets)
+            )).one()
+            if low is not None:
+                ensure_range(target, table_name, low, high)
+
+        with target.begin() as writer:
+            # Leftovers of an interrupted earlier move of these buckets
+            for model, column in reversed(SHARDED_TABLES):
+                writer.execute(delete(model.__table__).where(_bucket_filter(model, column, buckets)))
+            for model, column in SHARDED_TABLES:
+                table = model.__table__
+                count = 0
+                result = reader.execution_options(stream_results=True).execute(
+                    select(table).where(_bucket_filter(model, column, buckets))
+                )
+                for rows in result.mappings().partitions(MOVE_BATCH_SIZE):
+                    writer.execute(insert(table), [dict(row) for row in rows])
+                    count += len(rows)
+                moved[table.name] = count
+
+    with source.begin() as conn:
+        for model, column in reversed(SHARDED_TABLES):
+            conn.execute(delete(model.__table__).where(_bucket_filter(model, column, buckets)))
+    return moved
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage student database shards")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("init", help="Create tables on every shard and write the bucket map if missing")
+    sub.add_parser("rebalance", help="Spread buckets evenly over STUDENT_SHARD_URLS (app must be stopped)")
+    sub.add_parser("status", help="Buckets and students per shard")
+    args = parser.parse_args()
+
+    if not STUDENT_SHARD_URLS:
+        print("[ERROR] STUDENT_SHARD_URLS is empty, the student database is not sharded")
+        return
+    engines = shard_engines()
+    current = ShardMap.load()
+
+    if args.command == "init":
+        for index, engine in enumerate(engines):
+            init_shard(engine, index)
+        if current is None:
+            ShardMap.spread(len(engines)).save()
+        print(f"[SUCCESS] {len(engines)} shards ready, map at {STUDENT_SHARD_MAP}")
+    elif current is None:
+        print("[ERROR] No shard map yet, run `python shards.py init` first")
+    elif args.command == "rebalance":
+        planned = current.rebalanced(len(engines))
+        moves: Dict[tuple, List[int]] = {}
+        for bucket, (old, new) in enumerate(zip(current.buckets, planned.buckets)):
+            if old != new:
+                moves.setdefault((old, new), []).append(bucket)
+        for (old, new), buckets in sorted(moves.items()):
+            moved = move_buckets(engines[old], engines[new], buckets)
+            # Save after every move so an interrupted run resumes where it stopped
+            for bucket in buckets:
+                current.buckets[bucket] = new
+            current.save()
+            print(f"  shard {old} -> {new}: {len(buckets)} buckets, {moved['students']} students")
+        print(f"[SUCCESS] Buckets spread over {len(engines)} shards")
+    elif args.command == "status":
+        for index, engine in enumerate(engines):
+            with engine.connect() as conn:
+                students = conn.execute(select(func.count(Student.id))).scalar()
+            print(f"shard {index}: {len(current.buckets_of(index)):>5} buckets {students:>10} students")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""
+Incremental change snapshots for downstream reporting.
+
+Every table has updated_at and change_seq (models.ChangeTracked). A BEFORE
+INSERT OR UPDATE trigger gives each written row the next value of its
+table's <table>_change_seq sequence, so "what changed since last night" is a
+range scan on the change_seq index instead of a copy of the whole table.
+
+An export writes one gzipped JSON lines file per table, holding the rows
+whose change_seq is above that table's watermark in the previous snapshot,
+in change_seq order, and then manifest.json with the new watermarks, into
+SNAPSHOT_DIR/<UTC timestamp>/. A table without a watermark (the first run, a
+new table, or a database restored to an older sequence) is exported in
+full. The upper bound of each table is read from its sequence before the
+export waits for the transactions running at that moment, so a row that
+commits late with a lower change_seq is never skipped. A row changed again
+after the bound appears in the next snapshot instead.
+
+Deletes are not captured; compare primary keys with an `export --full` to
+find them. Run `install` once on existing databases, and again after
+`partitions.py migrate`, which replaces the table. Triggers on partitioned
+tables need PostgreSQL 13 or later.
+
+    python snapshots.py install
+    python snapshots.py export
+    python snapshots.py export --full
+    python snapshots.py list
+"""
+
+import argparse
+import gzip
+import json
+import os
+import shutil
+import time
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import or_, select, text
+from sqlalchemy.engine import Connection, Engine
+
+from config import SNAPSHOT_BATCH_ROWS, SNAPSHOT_DIR, SNAPSHOT_WAIT_SECONDS
+from database import Base, DatabaseSet, current_databases
+from shards import SHARDED_TABLES, shard_engines, sharding_enabled
+
+FORMAT_VERSION = 1
+# Serialises installs from several processes on one database
+INSTALL_LOCK_KEY = 7412004
+
+TRIGGER_FUNCTION = """
+CREATE OR REPLACE FUNCTION track_change() RETURNS trigger AS $$
+BEGIN
+    -- Take a transaction id before the sequence value, so an export that
+    -- has read the sequence sees this transaction as running
+    PERFORM pg_current_xact_id();
+    NEW.change_seq := nextval(TG_ARGV[0]::regclass);
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql
+"""
+
+
+def _json_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f"Cannot serialise {type(value).__name__}")
+
+
+def _live_tables(conn: Connection) -> Dict[str, Tuple[str, bool]]:
+    """Model tables present on this database: name -> (schema, whether the trigger is installed)"""
+    names = sorted({table.name for table in Base.metadata.tables.values()})
+    rows = conn.execute(text(
+        "SELECT c.relname, n.nspname, EXISTS ("
+        "    SELECT 1 FROM pg_trigger t WHERE t.tgrelid = c.oid AND t.tgname = 'track_change'"
+        ") "
+        "FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace "
+        "WHERE c.relname = ANY(:names) AND c.relkind IN ('r', 'p') AND pg_table_is_visible(c.oid)"
+    ), {"names": names})
+    return {name: (schema, tracked) for name, schema, tracked in rows}
+
+
+def install_change_tracking(engine: Engine) -> List[str]:
+    """Add the change_seq column, sequence, index and trigger to each table on `engine` that lacks them"""
+    tokens = {table.name: table.schema for table in Base.metadata.tables.values()}
+    with engine.begin() as conn:
+        conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": INSTALL_LOCK_KEY})
+        missing = {name: schema for name, (schema, tracked) in _live_tables(conn).items() if not tracked}
+        if not missing:
+            return []
+        conn.execute(text(TRIGGER_FUNCTION))
+        for name, schema in sorted(missing.items()):
+            table, sequence = f"{schema}.{name}", f"{schema}.{name}_change_seq"
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS updated_at timestamp"))
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS change_seq bigint"))
+            # Not owned by the column, so values keep rising if the table is replaced
+            conn.execute(text(f"CREATE SEQUENCE IF NOT EXISTS {sequence}"))
+            conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_{tokens[name]}_{name}_change_seq ON {table} (change_seq)"))
+            conn.execute(text(
+                f"CREATE TRIGGER track_change BEFORE INSERT OR UPDATE ON {table} "
+                f"FOR EACH ROW EXECUTE FUNCTION track_change('{sequence}')"
+            ))
+    return sorted(missing)
+
+
+def tracked_engines() -> list:
+    """Every physical database of the current school: the primaries, plus the student shards"""
+    return current_databases().primary_engines() + (shard_engines() if sharding_enabled() else [])
+
+
+def _sources(databases: DatabaseSet) -> List[Tuple[str, Engine, list]]:
+    """
+    (source name, engine, tables) to export: each logical database's own
+    tables, with the student tables moved to the shards when sharded
+    """
+    on_shards = [model.__table__ for model, _ in SHARDED_TABLES]
+    sharded = sharding_enabled()
+    sources = []
+    for db_name, engine in databases.engines.items():
+        tables = [table for table in Base.metadata.sorted_tables if table.schema == db_name]
+        if db_name == "student" and sharded:
+            tables = [table for table in tables if table not in on_shards]
+        sources.append((db_name, engine, tables))
+    if sharded:
+        for index, engine in enumerate(shard_engines()):
+            sources.append((f"shard{index}", engine, on_shards))
+    return sources
+
+
+def _wait_for(conn: Connection, xids: List[str], source: str):
+    """Block until none of the transactions `xids` is still running"""
+    deadline = time.monotonic() + SNAPSHOT_WAIT_SECONDS
+    while xids:
+        xids = conn.execute(text(
+            "SELECT CAST(x AS text) FROM unnest(CAST(:xids AS xid8[])) AS x "
+            "WHERE pg_xact_status(x) = 'in progress'"
+        ), {"xids": xids}).scalars().all()
+        conn.commit()
+        if not xids:
+            return
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"Transactions {', '.join(xids)} on {source} are still running "
+                               f"after {SNAPSHOT_WAIT_SECONDS}s")
+        time.sleep(1)
+
+
+def _export_table(conn: Connection, source: str, table, since: Optional[int], bound: int, staging: str) -> dict:
+    # Generated columns (the notice search vector) are left out
+    columns = [column for column in table.columns if column.computed is None]
+    query = select(*columns).order_by(table.c.change_seq)
+    if since is None:
+        query = query.where(or_(table.c.change_seq.is_(None), table.c.change_seq <= bound))
+    else:
+        query = query.where(table.c.change_seq > since, table.c.change_seq <= bound)
+
+    file_name = f"{source}.{table.name}.jsonl.gz"
+    rows = 0
+    with gzip.open(os.path.join(staging, file_name), "wt", encoding="utf-8") as f:
+        result = conn.execution_options(stream_results=True).execute(query)
+        for batch in result.mappings().partitions(SNAPSHOT_BATCH_ROWS):
+            f.writelines(json.dumps(dict(row), default=_json_value) + "\n" for row in batch)
+            rows += len(batch)
+    return {"source": source, "table": table.name, "file": file_name, "rows": rows,
+            "from_seq": since, "to_seq": bound, "full": since is None}
+
+
+def _export_source(source: str, engine: Engine, tables: list, watermarks: Dict[Tuple[str, str], int],
+                   full: bool, staging: str) -> List[dict]:
+    with engine.connect() as conn:
+        live = _live_tables(conn)
+        tables = [table for table in tables if table.name in live]
+        untracked = [table.name for table in tables if not live[table.name][1]]
+        if untracked:
+            raise RuntimeError(f"Change tracking is not installed on {', '.join(untracked)} ({source}), "
+                               f"run python snapshots.py install")
+        bounds = {}
+        for table in tables:
+            schema = live[table.name][0]
+            bounds[table.name] = conn.execute(text(
+                f"SELECT CASE WHEN is_called THEN last_value ELSE last_value - 1 END "
+                f"FROM {schema}.{table.name}_change_seq"
+            )).scalar()
+        running = conn.execute(text(
+            "SELECT CAST(x AS text) FROM pg_snapshot_xip(pg_current_snapshot()) AS x"
+        )).scalars().all()
+        conn.commit()
+        _wait_for(conn, running, source)
+
+        # One snapshot for every table of the source, so references between them hold
+        conn.execution_options(isolation_level="REPEATABLE READ")
+        entries = []
+        for table in tables:
+            bound = bounds[table.name]
+            since = None if full else watermarks.get((source, table.name))
+            if since is not None and since > bound:
+                since = None
+            entries.append(_export_table(conn, source, table, since, bound, staging))
+        conn.commit()
+    return entries
+
+
+def snapshot_root() -> str:
+    """SNAPSHOT_DIR for the deployment's own databases, a subdirectory per hosted school"""
+    name = current_databases().name
+    return SNAPSHOT_DIR if name == "default" else os.path.join(SNAPSHOT_DIR, "tenants", name)
+
+
+def list_snapshots() -> List[str]:
+    """Completed snapshots, oldest first"""
+    root = snapshot_root()
+    if not os.path.isdir(root):
+        return []
+    return sorted(name for name in os.listdir(root)
+                  if os.path.exists(os.path.join(root, name, "manifest.json")))
+
+
+def read_manifest(name: str) -> dict:
+    with open(os.path.join(snapshot_root(), name, "manifest.json")) as f:
+        return json.load(f)
+
+
+def export_snapshot(full: bool = False) -> dict:
+    """
+    Write the rows changed since the latest snapshot (every row with
+    `full`). The manifest is written last and the directory renamed into
+    place, so an interrupted export leaves the previous watermarks in use.
+    """
+    snapshots = list_snapshots()
+    previous = read_manifest(snapshots[-1]) if snapshots else None
+    watermarks = {(entry["source"], entry["table"]): entry["to_seq"] for entry in previous["tables"]} \
+        if previous else {}
+
+    now = datetime.utcnow()
+    name = now.strftime("%Y%m%dT%H%M%SZ")
+    if name in snapshots:
+        raise RuntimeError(f"Snapshot {name} already exists")
+    target = os.path.join(snapshot_root(), name)
+    staging = target + ".partial"
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+
+    manifest = {
+        "format": FORMAT_VERSION,
+        "name": name,
+        "created_at": now.isoformat(),
+        "previous": previous["name"] if previous else None,
+        "tables": [],
+    }
+    for source, engine, tables in _sources(current_databases()):
+        manifest["tables"].extend(_export_source(source, engine, tables, watermarks, full, staging))
+    with open(os.path.join(staging, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(staging, target)
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Change tracking and incremental snapshots for reporting")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("install", help="Add change tracking to every table")
+    export = sub.add_parser("export", help="Write the rows changed since the last snapshot")
+    export.add_argument("--full", action="store_true", help="Write every row, ignoring the last snapshot")
+    sub.add_parser("list", help="List snapshots")
+    args = parser.parse_args()
+
+    if args.command == "install":
+        installed = []
+        for engine in tracked_engines():
+            installed.extend(install_change_tracking(engine))
+        print(f"[SUCCESS] Change tracking installed on {len(installed)} tables")
+    elif args.command == "export":
+        manifest = export_snapshot(args.full)
+        for entry in manifest["tables"]:
+            if entry["rows"]:
+                print(f"  {entry['source'] + '.' + entry['table']:<40} {entry['rows']:>10} rows")
+        total = sum(entry["rows"] for entry in manifest["tables"])
+        print(f"[SUCCESS] Wrote {total} changed rows to {os.path.join(snapshot_root(), manifest['name'])}")
+    elif args.command == "list":
+        for name in list_snapshots():
+            manifest = read_manifest(name)
+            rows = sum(entry["rows"] for entry in manifest["tables"])
+            kind = "full" if all(entry["full"] for entry in manifest["tables"]) else "incremental"
+            print(f"{name}  {kind:<12} {rows:>10} rows")
+
+
+if __name__ == "__main__":
+    main()
@@ -81,50 +81,93 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     });
 
-    // Dynamic grade calculation for marks form
-    const marksForm = document.querySelector('form[action*="add-marks"]');
-    if (marksForm) {
-        const marksObtained = marksForm.querySelector('#marks_obtained');
-        const totalMarks = marksForm.querySelector('#total_marks');
-        const gradeSelect = marksForm.querySelector('#grade');
-        
-        if (marksObtained && totalMarks && gradeSelect) {
-            function calculateGrade() {
-                const obtained = parseFloat(marksObtained.value);
-                const total = parseFloat(totalMarks.value);
-                
-                if (obtained && total && total > 0) {
-                    const percentage = (obtained / total) * 100;
-                    let grade = 'F';
-                    
-                    if (percentage >= 90) grade = 'A+';
-                    else if (percentage >= 85) grade = 'A';
-                    else if (percentage >= 75) grade = 'B+';
-                    else if (percentage >= 65) grade = 'B';
-                    else if (percentage >= 55) grade = 'C+';
-                    else if (percentage >= 45) grade = 'C';
-                    else if (percentage >= 35) grade = 'D';
-                    
-                    gradeSelect.value = grade;
-                    
-                    // Add visual feedback
-                    const percentageDisplay = document.getElementById('percentage-display');
-                    if (percentageDisplay) {
-                        percentageDisplay.textContent = percentage.toFixed(1) + '%';
-                        percentageDisplay.className = 'badge ' + getGradeBadgeClass(grade);
-                    }
-                }
-            }
-            
-            marksObtained.addEventListener('input', calculateGrade);
-            totalMarks.addEventListener('input', calculateGrade);
-        }
-    }
-
     // Notice priority color coding
     updateNoticePriority();
+
+    // Student pickers on the teacher forms
+    initStudentPickers();
+
+    // Live progress of queued and running background jobs
+    initJobProgress();
 });
 
+// Student picker: the teacher's roster is rendered into the <select>, anyone
+// else is found through the paginated /teacher/students/search endpoint
+function initStudentPickers() {
+    document.querySelectorAll('[data-student-search]').forEach(function(input) {
+        const select = document.getElementById(input.dataset.studentSearch);
+        const results = select.querySelector('[data-search-results]');
+        const more = input.parentElement.querySelector('[data-search-more]');
+        let timer = null;
+        let page = 1;
+
+        function load(reset) {
+            const query = input.value.trim();
+            if (reset) {
+                page = 1;
+                results.innerHTML = '';
+            }
+            if (query.length < 2) {
+                results.hidden = true;
+                more.classList.add('d-none');
+                return;
+            }
+            fetch('/teacher/students/search?q=' + encodeURIComponent(query) + '&page=' + page)
+                .then(function(response) { return response.json(); })
+                .then(function(data) {
+                    // Ignore answers to a query the user has already changed
+                    if (input.value.trim() !== query) return;
+                    data.results.forEach(function(student) {
+                        if (student.in_roster) return;
+                        const option = document.createElement('option');
+                        option.value = student.id;
+                        option.textContent = student.student_id + ' - ' + student.name +
+                            ' (Grade ' + (student.grade || '?') + ' ' + (student.section || '') + ')';
+                        results.appendChild(option);
+                    });
+                    results.hidden = results.children.length === 0;
+                    more.classList.toggle('d-none', !data.has_more);
+                });
+        }
+
+        input.addEventListener('input', function() {
+            clearTimeout(timer);
+            timer = setTimeout(function() { load(true); }, 250);
+        });
+        more.addEventListener('click', function() {
+            page += 1;
+            load(false);
+        });
+    });
+}
+
+// Job list: poll /jobs/<id> for every job that is not finished yet
+function initJobProgress() {
+    const badgeClasses = {queued: 'bg-secondary', running: 'bg-primary', succeeded: 'bg-success', failed: 'bg-danger'};
+    document.querySelectorAll('[data-job-id]').forEach(function(row) {
+        if (row.dataset.jobStatus === 'succeeded' || row.dataset.jobStatus === 'failed') return;
+
+        function poll() {
+            fetch('/jobs/' + row.dataset.jobId)
+                .then(function(response) { return response.json(); })
+                .then(function(job) {
+                    row.querySelector('[data-job-progress]').style.width = (job.progress * 100) + '%';
+                    row.querySelector('[data-job-message]').textContent = (job.status === 'failed' ? job.error : job.message) || '';
+                    const badge = row.querySelector('[data-job-badge]');
+                    badge.textContent = job.status;
+                    badge.className = 'badge ' + badgeClasses[job.status];
+                    if (job.result && job.result.file) {
+                        row.querySelector('[data-job-download]').classList.remove('d-none');
+                    }
+                    if (job.status !== 'succeeded' && job.status !== 'failed') {
+                        setTimeout(poll, 2000);
+                    }
+                });
+        }
+        setTimeout(poll, 1000);
+    });
+}
+
 // Helper functions
 function refreshDashboardStats() {
     // This would typically make an AJAX call to refresh dashboard statistics
@@ -0,0 +1,100 @@
+"""
+Streamed HTML for pages that list every row of a table.
+
+TemplateResponse runs the whole query, renders the whole page into one
+string and only then sends it. stream_template() instead renders with
+Jinja's generate() and sends the page as a chunked response while it is
+being rendered. Its row sources (streamed_rows) read from a server-side
+cursor a batch at a time. The first bytes (head, navigation) go out before
+the query has returned anything, and memory holds one batch of rows and one
+chunk of HTML however long the list is.
+
+    students = streamed_rows(request, ["student"], lambda db: StudentRepository(db).iter_students())
+    return stream_template("page.html", {"request": request, "students": students})
+
+The rows open and close their own sessions, so they stay valid for as long
+as the response is being streamed.
+"""
+
+from typing import Callable, Iterable, Iterator, List
+
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+
+from config import STREAM_CHUNK_BYTES
+from database import open_request_session
+from templating import templates
+
+_EMPTY = object()
+
+
+class StreamedRows:
+    """
+    Single-pass row iterator for templates. Truthiness (`{% if rows %}`)
+    peeks at the first row instead of counting, so it does not consume the
+    stream; |length and other multi-pass filters are not available.
+    """
+
+    def __init__(self, rows: Iterable):
+        self._rows = iter(rows)
+        self._first = None
+
+    def __bool__(self) -> bool:
+        if self._first is None:
+            self._first = next(self._rows, _EMPTY)
+        return self._first is not _EMPTY
+
+    def __iter__(self) -> Iterator:
+        if self._first is None:
+            self._first = next(self._rows, _EMPTY)
+        if self._first is not _EMPTY:
+            first, self._first = self._first, _EMPTY
+            yield first
+        yield from self._rows
+
+
+def streamed_rows(request: Request, db_names: List[str], fetch: Callable[..., Iterable]) -> StreamedRows:
+    """
+    Rows of fetch(*sessions) for a streamed page. The sessions (one per name
+    in `db_names`, replica routed like the request's own) are created here,
+    while the school and request session are at hand, but only connect when
+    the template first touches the rows; they are closed when the rows run
+    out or the client goes away.
+    """
+    sessions = [open_request_session(name, request) for name in db_names]
+
+    def rows():
+        try:
+            yield from fetch(*sessions)
+        finally:
+            for session in sessions:
+                session.close()
+
+    return StreamedRows(rows())
+
+
+def _chunks(fragments: Iterator[str], size: int) -> Iterator[bytes]:
+    # generate() yields many tiny strings; send them in chunks of ~size bytes
+    buffer: List[str] = []
+    length = 0
+    for fragment in fragments:
+        buffer.append(fragment)
+        length += len(fragment)
+        if length >= size:
+            yield "".join(buffer).encode("utf-8")
+            buffer, length = [], 0
+    if buffer:
+        yield "".join(buffer).encode("utf-8")
+
+
+def stream_template(name: str, context: dict, status_code: int = 200,
+                    chunk_size: int = STREAM_CHUNK_BYTES) -> StreamingResponse:
+    """TemplateResponse, but rendered and sent incrementally"""
+    request = context["request"]
+    for context_processor in templates.context_processors:
+        context.update(context_processor(request))
+    template = templates.get_template(name)
+    # A sync iterator: Starlette advances it on the threadpool, so the
+    # blocking cursor reads stay off the event loop
+    return StreamingResponse(_chunks(template.generate(context), chunk_size), status_code=status_code,
+                             media_type="text/html")
@@ -0,0 +1,63 @@
+"""
+Shared Jinja2 templates for the routers.
+
+A hosted school (tenants.py) may override any template by putting a file
+with the same name in its own `templates` directory; everything else falls
+back to templates/. Every template also gets `tenant` (None when the app
+serves a single school) and, for students and teachers, `unread_notices`
+for the navbar badge.
+"""
+
+import threading
+from typing import Any, Dict
+
+from fastapi import Request
+from fastapi.templating import Jinja2Templates
+
+from database import current_databases, open_request_session
+from repositories.notice_repository import NOTICE_AUDIENCES, NoticeRepository
+from tenants import current_tenant
+
+TEMPLATE_DIR = "templates"
+
+
+def tenant_context(request: Request) -> Dict[str, Any]:
+    return {"tenant": current_tenant()}
+
+
+def notice_context(request: Request) -> Dict[str, Any]:
+    # Two primary key reads (see repositories/notice_repository.py)
+    session = request.scope.get("session") or {}
+    if session.get("role") not in NOTICE_AUDIENCES or not session.get("user_id"):
+        return {"unread_notices": None}
+    # A session belongs to the school it logged in to, as in get_current_user
+    if session.get("tenant", "default") != current_databases().name:
+        return {"unread_notices": None}
+    db = open_request_session("authority", request)
+    try:
+        return {"unread_notices": NoticeRepository(db).unread_count(session["user_id"], session["role"])}
+    finally:
+        db.close()
+
+
+class TenantTemplates(Jinja2Templates):
+    def __init__(self, directory: str, **env_options):
+        super().__init__(directory, context_processors=[tenant_context, notice_context], **env_options)
+        self.directory = directory
+        self._tenant_envs = {}
+        self._lock = threading.Lock()
+
+    def get_template(self, name: str):
+        tenant = current_tenant()
+        if tenant is None or not tenant.templates:
+            return self.env.get_template(name)
+        env = self._tenant_envs.get(tenant.slug)
+        if env is None:
+            with self._lock:
+                env = self._tenant_envs.get(tenant.slug)
+                if env is None:
+                    env = self._tenant_envs[tenant.slug] = self._create_env([tenant.templates, self.directory])
+        return env.get_template(name)
+
+
+templates = TenantTemplates(directory=TEMPLATE_DIR)
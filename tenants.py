@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+"""
+Hosting several schools on one deployment.
+
+Each school (tenant) has its own four databases, or one consolidated
+database, listed in TENANTS_CONFIG (see tenants.example.json). Requests
+are matched to a school by host name or by a leading /<slug> path segment
+(TENANT_RESOLUTION). The school's DatabaseSet is made current for the
+request, so repositories, sessions and caches need no changes.
+
+Connection pools are opened on a school's first request, kept small
+(TENANT_POOL_SIZE + TENANT_MAX_OVERFLOW per engine) and closed again when
+the school has been idle for TENANT_IDLE_SECONDS, or earlier, least
+recently used first, when opening another school would exceed
+TENANT_CONNECTION_BUDGET. Without a tenants file nothing here runs and the
+app serves the school in config.py.
+
+    python tenants.py list
+    python tenants.py init greenfield     # create tables and partitions
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from starlette.datastructures import Headers
+from starlette.responses import PlainTextResponse
+
+from config import (
+    TENANTS_CONFIG, TENANT_RESOLUTION, TENANT_CONNECTION_BUDGET, TENANT_POOL_SIZE, TENANT_MAX_OVERFLOW,
+    TENANT_IDLE_SECONDS,
+)
+from database import DatabaseSet, use_databases, reset_databases
+
+TENANT_COOKIE = "tenant"
+# How often idle schools' pools are closed
+SWEEP_SECONDS = 60
+# Requests under this prefix are served outside any school (routes/ops.py)
+OPS_PREFIX = "/ops/"
+
+
+@dataclass
+class Tenant:
+    slug: str
+    name: str
+    databases: Dict[str, str] = field(default_factory=dict)
+    replicas: Dict[str, List[str]] = field(default_factory=dict)
+    database: Optional[str] = None  # one consolidated database instead of four
+    hosts: List[str] = field(default_factory=list)
+    templates: Optional[str] = None  # directory of template overrides
+
+    def open_databases(self) -> DatabaseSet:
+        return DatabaseSet(self.slug, self.databases or dict.fromkeys(("student", "teacher", "authority", "public")),
+                           self.replicas, self.database, pool_size=TENANT_POOL_SIZE,
+                           max_overflow=TENANT_MAX_OVERFLOW, pool_pre_ping=True)
+
+
+@dataclass
+class TenantStats:
+    requests: int = 0
+    active: int = 0
+    last_used: float = 0.0
+    pool_opens: int = 0
+
+
+class TenantCapacityError(Exception):
+    """Every open school is busy and the connection budget leaves no room for another"""
+
+
+def load_tenants(path: str = TENANTS_CONFIG) -> Dict[str, Tenant]:
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        entries = json.load(f)
+    base = os.path.dirname(os.path.abspath(path))
+    tenants = {}
+    for entry in entries:
+        tenant = Tenant(**entry)
+        if tenant.slug == "default":
+            raise ValueError('"default" names the deployment\'s own databases, pick another slug')
+        if tenant.templates:
+            tenant.templates = os.path.join(base, tenant.templates)
+        if not tenant.database and set(tenant.databases) != {"student", "teacher", "authority", "public"}:
+            raise ValueError(f"Tenant {tenant.slug} needs a 'database' URL or all four 'databases'")
+        tenants[tenant.slug] = tenant
+    return tenants
+
+
+class TenantRegistry:
+    def __init__(self, tenants: Dict[str, Tenant], budget: int = TENANT_CONNECTION_BUDGET,
+                 idle_seconds: float = TENANT_IDLE_SECONDS):
+        self.tenants = tenants
+        self.budget = budget
+        self.idle_seconds = idle_seconds
+        self.hosts = {host.lower(): tenant for tenant in tenants.values() for host in tenant.hosts}
+        self.stats = {slug: TenantStats() for slug in tenants}
+        # Open database sets, least recently used first
+        self._open: "OrderedDict[str, DatabaseSet]" = OrderedDict()
+        self._last_sweep = time.monotonic()
+        self._lock = threading.Lock()
+        self._sweeper = None
+        self._stop_sweeping = threading.Event()
+
+    def resolve_host(self, host: str) -> Optional[Tenant]:
+        host = host.split(":", 1)[0].lower()
+        return self.hosts.get(host) or self.tenants.get(host.split(".", 1)[0])
+
+    def connections_in_use(self) -> int:
+        return sum(databases.max_connections() for databases in self._open.values())
+
+    def acquire(self, tenant: Tenant) -> DatabaseSet:
+        """The tenant's databases, opened if needed; pair with release()"""
+        now = time.monotonic()
+        to_close = []
+        with self._lock:
+            if now - self._last_sweep > SWEEP_SECONDS:
+                to_close = self._make_room(0, now)
+                self._last_sweep = now
+            stats = self.stats[tenant.slug]
+            databases = self._open.get(tenant.slug)
+            if databases is None:
+                databases = tenant.open_databases()
+                try:
+                    to_close += self._make_room(databases.max_connections(), now)
+                except TenantCapacityError:
+                    databases.dispose()
+                    raise
+                self._open[tenant.slug] = databases
+                stats.pool_opens += 1
+            self._open.move_to_end(tenant.slug)
+            stats.requests += 1
+            stats.active += 1
+            stats.last_used = now
+        for evicted in to_close:
+            evicted.dispose()
+        return databases
+
+    def release(self, tenant: Tenant):
+        with self._lock:
+            stats = self.stats[tenant.slug]
+            stats.active -= 1
+            stats.last_used = time.monotonic()
+
+    def _make_room(self, needed: int, now: float) -> List[DatabaseSet]:
+        """Drop idle schools' pools until `needed` more connections fit the budget"""
+        closed = []
+        for slug in list(self._open):
+            stats = self.stats[slug]
+            over_budget = self.connections_in_use() + needed > self.budget
+            if stats.active == 0 and (over_budget or now - stats.last_used > self.idle_seconds):
+                closed.append(self._open.pop(slug))
+        if self.connections_in_use() + needed > self.budget:
+            raise TenantCapacityError("No connections left for another school, try again shortly")
+        return closed
+
+    def close_idle(self):
+        """Close pools of schools idle for longer than idle_seconds"""
+        with self._lock:
+            closed = self._make_room(0, time.monotonic())
+        for databases in closed:
+            databases.dispose()
+
+    def start_sweeper(self):
+        """Close idle schools' pools every SWEEP_SECONDS, even when no requests arrive"""
+        if self._sweeper is not None or not self.tenants:
+            return
+        self._stop_sweeping.clear()
+        self._sweeper = threading.Thread(target=self._sweep, name="tenant-sweeper", daemon=True)
+        self._sweeper.start()
+
+    def _sweep(self):
+        while not self._stop_sweeping.wait(SWEEP_SECONDS):
+            self.close_idle()
+
+    def dispose(self, close: bool = True):
+        self._stop_sweeping.set()
+        self._sweeper = None
+        with self._lock:
+            closed = list(self._open.values())
+            self._open.clear()
+        for databases in closed:
+            databases.dispose(close)
+
+    def snapshot(self) -> dict:
+        """Connection budget use and per-school request counters and pool state"""
+        now = time.monotonic()
+        with self._lock:
+            return {
+                "budget": self.budget,
+                "connections_in_use": self.connections_in_use(),
+                "schools": {
+                    slug: {"requests": stats.requests, "active": stats.active, "pool_opens": stats.pool_opens,
+                           "open": slug in self._open,
+                           "idle_seconds": round(now - stats.last_used) if stats.last_used else None}
+                    for slug, stats in self.stats.items()
+                },
+            }
+
+
+registry = TenantRegistry(load_tenants())
+
+_current_tenant: ContextVar[Optional[Tenant]] = ContextVar("current_tenant", default=None)
+
+
+def current_tenant() -> Optional[Tenant]:
+    """The school being served, or None when the app hosts a single school"""
+    return _current_tenant.get()
+
+
+def current_tenant_slug() -> str:
+    tenant = _current_tenant.get()
+    return tenant.slug if tenant else "default"
+
+
+class TenantMiddleware:
+    """
+    Pure ASGI middleware that picks the school for each request and makes
+    its databases current. In "path" mode the /<slug> prefix is moved into
+    root_path, so routes and url_for() work unchanged, and a cookie remembers
+    the school for the app's absolute redirects and links.
+    """
+
+    def __init__(self, app, registry: TenantRegistry = registry, resolution: str = TENANT_RESOLUTION):
+        self.app = app
+        self.registry = registry
+        self.resolution = resolution
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket") or not self.registry.tenants \
+                or scope["path"].startswith(OPS_PREFIX):
+            await self.app(scope, receive, send)
+            return
+
+        tenant, scope, set_cookie = self._resolve(scope)
+        if tenant is None:
+            await PlainTextResponse("Unknown school", status_code=404)(scope, receive, send)
+            return
+        try:
+            databases = self.registry.acquire(tenant)
+        except TenantCapacityError as error:
+            await PlainTextResponse(str(error), status_code=503, headers={"Retry-After": "5"})(scope, receive, send)
+            return
+
+        if set_cookie:
+            send = self._with_cookie(send, tenant)
+        scope.setdefault("state", {})["tenant"] = tenant
+        tenant_token = _current_tenant.set(tenant)
+        databases_token = use_databases(databases)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            reset_databases(databases_token)
+            _current_tenant.reset(tenant_token)
+            self.registry.release(tenant)
+
+    def _resolve(self, scope):
+        headers = Headers(scope=scope)
+        if self.resolution == "host":
+            return self.registry.resolve_host(headers.get("host", "")), scope, False
+
+        path = scope["path"]
+        slug, _, rest = path.lstrip("/").partition("/")
+        tenant = self.registry.tenants.get(slug)
+        if tenant is not None:
+            prefix = f"/{slug}"
+            scope = dict(scope, path="/" + rest, root_path=scope.get("root_path", "") + prefix)
+            if "raw_path" in scope and scope["raw_path"]:
+                scope["raw_path"] = scope["raw_path"][len(prefix):] or b"/"
+            cookie = _read_cookie(headers.get("cookie", ""), TENANT_COOKIE)
+            return tenant, scope, cookie != slug
+        cookie = _read_cookie(headers.get("cookie", ""), TENANT_COOKIE)
+        return self.registry.tenants.get(cookie), scope, False
+
+    @staticmethod
+    def _with_cookie(send, tenant: Tenant):
+        async def send_with_cookie(message):
+            if message["type"] == "http.response.start":
+                cookie = f"{TENANT_COOKIE}={tenant.slug}; Path=/; HttpOnly; SameSite=lax"
+                message["headers"] = list(message.get("headers", [])) + [(b"set-cookie", cookie.encode("latin-1"))]
+            await send(message)
+        return send_with_cookie
+
+
+def _read_cookie(header: str, name: str) -> Optional[str]:
+    for part in header.split(";"):
+        key, _, value = part.strip().partition("=")
+        if key == name:
+            return value
+    return None
+
+
+def init_tenant(tenant: Tenant):
+    """Create a school's tables, current partitions and change tracking"""
+    from database import create_all_tables
+    from partitions import ensure_partitions
+    from snapshots import install_change_tracking
+
+    databases = tenant.open_databases()
+    try:
+        create_all_tables(databases)
+        ensure_partitions(databases.engines["student"])
+        for engine in databases.primary_engines():
+            install_change_tracking(engine)
+    finally:
+        databases.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage hosted schools")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("list", help="List configured schools")
+    init = sub.add_parser("init", help="Create tables and partitions for schools")
+    init.add_argument("slugs", nargs="*", help="Schools to initialise (default: all)")
+    args = parser.parse_args()
+
+    tenants = registry.tenants
+    if not tenants:
+        print(f"[ERROR] No schools configured in {TENANTS_CONFIG}")
+        return
+    if args.command == "list":
+        for tenant in tenants.values():
+            mode = "consolidated" if tenant.database else "split"
+            print(f"{tenant.slug:<20} {tenant.name:<40} {mode:<13} {', '.join(tenant.hosts)}")
+    elif args.command == "init":
+        for slug in args.slugs or list(tenants):
+            if slug not in tenants:
+                print(f"[ERROR] Unknown school {slug}")
+                continue
+            init_tenant(tenants[slug])
+            print(f"[SUCCESS] Initialised {slug}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,450 @@
+#!/usr/bin/env python3
+"""
+Weekly timetable generation.
+
+The problem comes from the database (repositories/timetable_repository.py):
+every TeacherSubjects row is a class (grade and section) that needs a
+subject from a teacher, for the subject_periods count of periods a week.
+Shared rooms such as labs are limited to the number in timetable_rooms, and
+teachers are never put in a period listed in teacher_unavailability.
+
+The week has at most 64 periods, so the solver keeps every class's,
+teacher's and room type's occupied periods as one int bitmask. Finding the
+periods still open to a lesson is a few AND/OR operations. Construction
+places the most constrained requirement first: the one with the fewest open
+periods left per lesson still to place. Each lesson goes to the period that
+spreads the subject over the week. Lessons that do not fit are then
+repaired by a min-conflicts search: a lesson takes the period where it
+displaces the fewest others, the displaced lessons go back in the queue,
+and a tabu list stops them from moving straight back.
+
+When a teacher becomes unavailable, reschedule() starts from the stored
+timetable, unplaces only that teacher's lessons in the blocked periods and
+repairs from there. Everything else stays where it was, and only the
+entries that changed are written.
+
+    python timetable.py generate
+    python timetable.py absence T001 --day 2 [--periods 0 1 2] [--reason "Training"]
+"""
+
+import argparse
+import random
+import time
+from dataclasses import dataclass, field
+from heapq import heapify, heappop, heappush
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from config import TIMETABLE_DAILY_LIMIT, TIMETABLE_DAYS, TIMETABLE_MAX_SECONDS
+from database import open_session
+from jobs import JobContext, job
+
+# Unplaced lessons are repaired for at most this many moves per lesson
+REPAIR_MOVES_PER_LESSON = 200
+# Moves for which a displaced lesson may not return to the period it left
+TABU_TENURE = 10
+
+DAY_NAMES = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"][:TIMETABLE_DAYS]
+
+ClassKey = Tuple[str, Optional[str]]  # (grade, section)
+
+
+@dataclass(frozen=True)
+class Requirement:
+    grade: str
+    section: Optional[str]
+    subject: str
+    teacher_id: int
+    periods: int
+    room_type: Optional[str] = None
+
+    @property
+    def class_key(self) -> ClassKey:
+        return (self.grade, self.section)
+
+
+@dataclass
+class Problem:
+    days: int
+    periods_per_day: int
+    requirements: List[Requirement]
+    rooms: Dict[str, int] = field(default_factory=dict)  # room type -> rooms of that type
+    unavailable: Dict[int, int] = field(default_factory=dict)  # teacher id -> bitmask of blocked slots
+    daily_limit: int = TIMETABLE_DAILY_LIMIT
+
+    @property
+    def slots(self) -> int:
+        return self.days * self.periods_per_day
+
+    def slot(self, day: int, period: int) -> int:
+        return day * self.periods_per_day + period
+
+
+@dataclass(frozen=True)
+class Lesson:
+    """A placed lesson, in the shape of a timetable_entries row"""
+    grade: str
+    section: Optional[str]
+    day: int
+    period: int
+    subject: str
+    teacher_id: int
+    room_type: Optional[str]
+
+
+@dataclass
+class Solution:
+    lessons: List[Lesson]
+    unplaced: List[Requirement]  # one item per lesson that could not be placed
+    seconds: float
+    moves: int  # repair moves made
+
+
+def _bits(mask: int) -> Iterable[int]:
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+class Solver:
+    """Placement state of one problem; see the module docstring for the method"""
+
+    def __init__(self, problem: Problem, seed: int = 0):
+        if problem.slots > 64:
+            raise ValueError("A week may have at most 64 periods")
+        self.problem = problem
+        self.random = random.Random(seed)
+        self.full = (1 << problem.slots) - 1
+        self.day_masks = [((1 << problem.periods_per_day) - 1) << (day * problem.periods_per_day)
+                          for day in range(problem.days)]
+
+        requirements = problem.requirements
+        classes = {key: index for index, key in enumerate(dict.fromkeys(r.class_key for r in requirements))}
+        teachers = {key: index for index, key in enumerate(dict.fromkeys(r.teacher_id for r in requirements))}
+        subjects = {key: index for index, key in enumerate(dict.fromkeys((r.class_key, r.subject)
+                                                                          for r in requirements))}
+        self.req_class = [classes[r.class_key] for r in requirements]
+        self.req_teacher = [teachers[r.teacher_id] for r in requirements]
+        self.req_subject = [subjects[(r.class_key, r.subject)] for r in requirements]
+        self.blocked = [0] * len(teachers)
+        for teacher_id, index in teachers.items():
+            self.blocked[index] = problem.unavailable.get(teacher_id, 0) & self.full
+
+        # One unit per lesson to place; unit_slot is -1 while unplaced
+        self.unit_req = [index for index, r in enumerate(requirements) for _ in range(r.periods)]
+        self.unit_slot = [-1] * len(self.unit_req)
+        self.class_busy = [0] * len(classes)
+        self.teacher_busy = [0] * len(teachers)
+        self.class_at: List[Dict[int, int]] = [{} for _ in classes]  # slot -> unit
+        self.teacher_at: List[Dict[int, int]] = [{} for _ in teachers]
+        self.subject_days = [[0] * problem.days for _ in subjects]
+        self.room_units: Dict[str, List[Set[int]]] = {
+            room: [set() for _ in range(problem.slots)] for room in problem.rooms
+        }
+        self.room_full = {room: 0 if rooms > 0 else self.full for room, rooms in problem.rooms.items()}
+        self.moves = 0
+
+    # State changes
+
+    def place(self, unit: int, slot: int):
+        req = self.unit_req[unit]
+        c, t, s = self.req_class[req], self.req_teacher[req], self.req_subject[req]
+        bit = 1 << slot
+        self.unit_slot[unit] = slot
+        self.class_busy[c] |= bit
+        self.teacher_busy[t] |= bit
+        self.class_at[c][slot] = unit
+        self.teacher_at[t][slot] = unit
+        self.subject_days[s][slot // self.problem.periods_per_day] += 1
+        room = self.problem.requirements[req].room_type
+        if room in self.room_units:
+            units = self.room_units[room][slot]
+            units.add(unit)
+            if len(units) >= self.problem.rooms[room]:
+                self.room_full[room] |= bit
+
+    def remove(self, unit: int):
+        slot = self.unit_slot[unit]
+        req = self.unit_req[unit]
+        c, t, s = self.req_class[req], self.req_teacher[req], self.req_subject[req]
+        bit = 1 << slot
+        self.unit_slot[unit] = -1
+        self.class_busy[c] &= ~bit
+        self.teacher_busy[t] &= ~bit
+        del self.class_at[c][slot]
+        del self.teacher_at[t][slot]
+        self.subject_days[s][slot // self.problem.periods_per_day] -= 1
+        room = self.problem.requirements[req].room_type
+        if room in self.room_units:
+            units = self.room_units[room][slot]
+            units.discard(unit)
+            if len(units) < self.problem.rooms[room]:
+                self.room_full[room] &= ~bit
+
+    # Queries
+
+    def _day_limit_mask(self, req: int) -> int:
+        days = self.subject_days[self.req_subject[req]]
+        mask = 0
+        for day, count in enumerate(days):
+            if count >= self.problem.daily_limit:
+                mask |= self.day_masks[day]
+        return mask
+
+    def open_slots(self, req: int) -> int:
+        """Periods where a lesson of `req` fits without moving anything"""
+        taken = (self.class_busy[self.req_class[req]] | self.teacher_busy[self.req_teacher[req]]
+                 | self.blocked[self.req_teacher[req]] | self._day_limit_mask(req))
+        room = self.problem.requirements[req].room_type
+        if room in self.room_full:
+            taken |= self.room_full[room]
+        return self.full & ~taken
+
+    def _best_slot(self, req: int, slots: int) -> int:
+        # Spread the subject over the week, then fill the class's lighter
+        # days; ties are broken at random so classes do not all stack up
+        # on the first periods
+        days = self.subject_days[self.req_subject[req]]
+        busy = self.class_busy[self.req_class[req]]
+        per_day = self.problem.periods_per_day
+        best, best_score = -1, None
+        for slot in _bits(slots):
+            day = slot // per_day
+            score = (days[day], bin(busy & self.day_masks[day]).count("1"), self.random.random())
+            if best_score is None or score < best_score:
+                best, best_score = slot, score
+        return best
+
+    # Construction
+
+    def construct(self) -> List[int]:
+        """Greedy most-constrained-first placement; returns the units that did not fit"""
+        pending: Dict[int, List[int]] = {}
+        for unit, req in enumerate(self.unit_req):
+            if self.unit_slot[unit] < 0:
+                pending.setdefault(req, []).append(unit)
+
+        def slack(req: int) -> int:
+            return bin(self.open_slots(req)).count("1") - len(pending[req])
+
+        heap = [(slack(req), req) for req in pending]
+        heapify(heap)
+        unplaced = []
+        while heap:
+            key, req = heappop(heap)
+            current = slack(req)
+            if current > key and heap and current > heap[0][0]:
+                # Placements elsewhere changed this requirement; look again later
+                heappush(heap, (current, req))
+                continue
+            unit = pending[req].pop()
+            slots = self.open_slots(req)
+            if slots:
+                self.place(unit, self._best_slot(req, slots))
+            else:
+                unplaced.append(unit)
+            if pending[req]:
+                heappush(heap, (slack(req), req))
+        return unplaced
+
+    # Repair
+
+    def _conflicts(self, req: int, slot: int) -> List[int]:
+        """Placed units that must move for a lesson of `req` to take `slot`"""
+        conflicts = set()
+        unit = self.class_at[self.req_class[req]].get(slot)
+        if unit is not None:
+            conflicts.add(unit)
+        unit = self.teacher_at[self.req_teacher[req]].get(slot)
+        if unit is not None:
+            conflicts.add(unit)
+        room = self.problem.requirements[req].room_type
+        if room in self.room_units and len(self.room_units[room][slot] - conflicts) >= self.problem.rooms[room]:
+            conflicts.add(min(self.room_units[room][slot] - conflicts))
+        return list(conflicts)
+
+    def repair(self, unplaced: List[int], deadline: float) -> List[int]:
+        """Min-conflicts search with a tabu list; returns the units still unplaced"""
+        queue = list(unplaced)
+        stuck = []
+        tabu: Dict[Tuple[int, int], int] = {}
+        budget = REPAIR_MOVES_PER_LESSON * max(len(queue), 1)
+        moves = 0
+        while queue and moves < budget and time.monotonic() < deadline:
+            unit = queue.pop(self.random.randrange(len(queue)))
+            req = self.unit_req[unit]
+            allowed = self.full & ~(self.blocked[self.req_teacher[req]] | self._day_limit_mask(req))
+            room = self.problem.requirements[req].room_type
+            if room in self.room_units and not self.problem.rooms[room]:
+                allowed = 0
+            best, best_cost, best_conflicts = -1, None, None
+            for slot in _bits(allowed):
+                conflicts = self._conflicts(req, slot)
+                cost = len(conflicts)
+                if cost and tabu.get((req, slot), -1) >= moves:
+                    cost += 10
+                cost += self.random.random()
+                if best_cost is None or cost < best_cost:
+                    best, best_cost, best_conflicts = slot, cost, conflicts
+            if best < 0:
+                # The teacher is blocked whenever the subject could still go
+                # on; moving other lessons cannot help
+                stuck.append(unit)
+                continue
+            for other in best_conflicts:
+                tabu[(self.unit_req[other], self.unit_slot[other])] = moves + TABU_TENURE
+                self.remove(other)
+                queue.append(other)
+            self.place(unit, best)
+            moves += 1
+        self.moves += moves
+        return queue + stuck
+
+    # Results
+
+    def load(self, lessons: Iterable[Lesson]) -> int:
+        """Place stored lessons that still match a requirement; returns how many were placed"""
+        free_units: Dict[Tuple[ClassKey, str, int], List[int]] = {}
+        for unit, req in enumerate(self.unit_req):
+            r = self.problem.requirements[req]
+            free_units.setdefault((r.class_key, r.subject, r.teacher_id), []).append(unit)
+        placed = 0
+        for lesson in lessons:
+            units = free_units.get(((lesson.grade, lesson.section), lesson.subject, lesson.teacher_id))
+            if not units or not (0 <= lesson.day < self.problem.days
+                                 and 0 <= lesson.period < self.problem.periods_per_day):
+                continue
+            slot = self.problem.slot(lesson.day, lesson.period)
+            req = self.unit_req[units[-1]]
+            if self._conflicts(req, slot):
+                continue
+            self.place(units.pop(), slot)
+            placed += 1
+        return placed
+
+    def lessons(self) -> List[Lesson]:
+        per_day = self.problem.periods_per_day
+        result = []
+        for unit, slot in enumerate(self.unit_slot):
+            if slot >= 0:
+                r = self.problem.requirements[self.unit_req[unit]]
+                result.append(Lesson(r.grade, r.section, slot // per_day, slot % per_day, r.subject,
+                                     r.teacher_id, r.room_type))
+        return result
+
+    def solution(self, unplaced: List[int], started: float) -> Solution:
+        return Solution(self.lessons(), [self.problem.requirements[self.unit_req[unit]] for unit in unplaced],
+                        time.monotonic() - started, self.moves)
+
+
+def solve(problem: Problem, seed: int = 0, max_seconds: float = TIMETABLE_MAX_SECONDS) -> Solution:
+    """A full timetable from scratch"""
+    started = time.monotonic()
+    solver = Solver(problem, seed)
+    unplaced = solver.construct()
+    if unplaced:
+        unplaced = solver.repair(unplaced, started + max_seconds)
+    return solver.solution(unplaced, started)
+
+
+def resolve(problem: Problem, lessons: Iterable[Lesson], seed: int = 0,
+            max_seconds: float = TIMETABLE_MAX_SECONDS) -> Solution:
+    """
+    Repair an existing timetable against `problem`: stored lessons stay
+    where they are unless they now clash with a blocked period or were
+    displaced by a lesson that had to move.
+    """
+    started = time.monotonic()
+    solver = Solver(problem, seed)
+    # Lessons in newly blocked periods are simply not loaded
+    solver.load(lesson for lesson in lessons
+                if not problem.unavailable.get(lesson.teacher_id, 0) >> problem.slot(lesson.day, lesson.period) & 1)
+    unplaced = [unit for unit, slot in enumerate(solver.unit_slot) if slot < 0]
+    if unplaced:
+        unplaced = solver.repair(unplaced, started + max_seconds)
+    return solver.solution(unplaced, started)
+
+
+def _summary(solution: Solution, changed: Optional[int] = None) -> dict:
+    result = {
+        "lessons": len(solution.lessons),
+        "unplaced": len(solution.unplaced),
+        "seconds": round(solution.seconds, 2),
+        "repair_moves": solution.moves,
+    }
+    if changed is not None:
+        result["changed"] = changed
+    if solution.unplaced:
+        missing = {}
+        for r in solution.unplaced:
+            name = f"{r.grade}{'-' + r.section if r.section else ''} {r.subject}"
+            missing[name] = missing.get(name, 0) + 1
+        result["missing"] = missing
+    return result
+
+
+@job("timetable.generate")
+def generate_timetable(ctx: JobContext, seed: int = 0):
+    """Solve the whole week and replace the stored timetable"""
+    from repositories.timetable_repository import TimetableRepository
+
+    db = open_session("teacher")
+    try:
+        repo = TimetableRepository(db)
+        problem = repo.load_problem()
+        ctx.progress(0.0, f"Scheduling {sum(r.periods for r in problem.requirements)} lessons", force=True)
+        solution = solve(problem, seed)
+        repo.replace_lessons(solution.lessons)
+        return _summary(solution)
+    finally:
+        db.close()
+
+
+def reschedule(teacher_id: int, slots: List[Tuple[int, int]], reason: Optional[str] = None) -> dict:
+    """Block `slots` ((day, period) pairs) for a teacher and move only the lessons that must move"""
+    from repositories.timetable_repository import TimetableRepository
+
+    db = open_session("teacher")
+    try:
+        repo = TimetableRepository(db)
+        repo.add_unavailability(teacher_id, slots, reason)
+        current = repo.get_lessons()
+        solution = resolve(repo.load_problem(), current)
+        changed = repo.apply_lessons(current, solution.lessons)
+        return _summary(solution, changed)
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate or repair the weekly timetable")
+    sub = parser.add_subparsers(dest="command", required=True)
+    generate = sub.add_parser("generate", help="Solve the whole week and replace the stored timetable")
+    generate.add_argument("--seed", type=int, default=0)
+    absence = sub.add_parser("absence", help="Block a teacher's periods and reschedule their lessons")
+    absence.add_argument("teacher", help="Teacher ID such as T001")
+    absence.add_argument("--day", type=int, required=True, help="0 = first day of the week")
+    absence.add_argument("--periods", type=int, nargs="*", help="Periods of the day (default: all)")
+    absence.add_argument("--reason")
+    args = parser.parse_args()
+
+    if args.command == "generate":
+        result = generate_timetable(JobContext.standalone(), args.seed)
+    else:
+        from config import TIMETABLE_PERIODS_PER_DAY
+        from repositories.teacher_repository import TeacherRepository
+
+        db = open_session("teacher")
+        try:
+            teacher = TeacherRepository(db).get_teacher_by_code(args.teacher)
+        finally:
+            db.close()
+        if not teacher:
+            parser.error(f"No teacher with ID {args.teacher}")
+        periods = args.periods if args.periods else range(TIMETABLE_PERIODS_PER_DAY)
+        result = reschedule(teacher.id, [(args.day, period) for period in periods], args.reason)
+    print(f"[SUCCESS] {result}")
+
+
+if __name__ == "__main__":
+    main()